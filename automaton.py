@@ -0,0 +1,92 @@
+from collections import deque
+
+
+class KeywordAutomaton:
+    """ Keyword Automaton
+        An Aho-Corasick matcher which finds every registered keyword in a
+        message with a single pass over it. Each keyword maps to a value
+        (usually a command) which is reported when the keyword is found.
+        Keywords flagged as whole words only count when they aren't part of
+        a bigger word, like the (^|\W)keyword($|\W) regular expressions
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.matches = [[]]
+        self.output = [[]]
+        self.built = True
+
+
+    def add(self, keyword, value, whole_word=True):
+        """ Add
+            Register a keyword to be reported as the given value
+        """
+        state = 0
+        for char in keyword:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.matches.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.matches[state].append((len(keyword), value, whole_word))
+        self.built = False
+
+
+    def build(self):
+        """ Build
+            Compute the failure links of the automaton with a breadth first
+            walk of the keyword trie
+        """
+        self.output = [list(matches) for matches in self.matches]
+        queue = deque()
+        for state in self.goto[0].values():
+            self.fail[state] = 0
+            queue.append(state)
+        while queue:
+            current = queue.popleft()
+            for char, state in self.goto[current].items():
+                queue.append(state)
+                fallback = self.fail[current]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[state] = self.goto[fallback].get(char, 0)
+                if self.fail[state] == state:
+                    self.fail[state] = 0
+                # Inherit the matches of the longest suffix we fall back to
+                self.output[state] = self.output[state] + self.output[self.fail[state]]
+        self.built = True
+
+
+    def search(self, text):
+        """ Search
+            Return the set of values whose keywords appear in the text
+        """
+        if not self.built:
+            self.build()
+        found = set()
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value, whole_word in self.output[state]:
+                if value in found:
+                    continue
+                if whole_word and not self._bounded(text, i - length + 1, i + 1):
+                    continue
+                found.add(value)
+        return found
+
+
+    def _bounded(self, text, start, end):
+        if start > 0 and self._is_word(text[start - 1]):
+            return False
+        if end < len(text) and self._is_word(text[end]):
+            return False
+        return True
+
+
+    def _is_word(self, char):
+        return char.isalnum() or char == '_'
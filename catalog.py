@@ -0,0 +1,123 @@
+import bisect
+from collections import defaultdict, namedtuple
+
+
+Index = namedtuple('Index', ['commands', 'helps', 'trigrams', 'levels', 'views'])
+
+
+def trigrams(text):
+    """ Trigrams
+        Return the set of three letter runs in some text, padded so the
+        start and end of each word count for more
+    """
+    text = '  ' + ' '.join(text.lower().split()) + ' '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CommandCatalog:
+    """ Command Catalog
+        Everything help and the command list need to know about the bot's
+        commands, worked out once when the commands are loaded (and again
+        whenever a command's privilege changes) rather than on every call.
+        Holds each command's help text ready to print, a trigram index of
+        help names for suggesting what someone meant, and for every
+        privilege level the help names and syntax of the commands which can
+        be run at that level
+    """
+
+    def __init__(self, commands):
+        self.build(commands)
+
+
+    def build(self, commands):
+        """ Build
+            Index a dictionary of commands to their privileges. The index is
+            swapped in all at once, so commands reading it from the thread
+            pool never see half of one
+        """
+        by_name = {}
+        helps = {} # help name -> (help text, privilege)
+        listing = [] # (privilege, syntax)
+        for cmd, privilege in commands.items():
+            # Some commands are admin only no matter what the database says
+            if cmd.cmd_priv == float('inf'):
+                privilege = float('inf')
+            by_name.setdefault(cmd.name.lower(), cmd)
+            if cmd.help_name is not None:
+                by_name.setdefault(cmd.help_name.lower(), cmd)
+            if cmd.help is not None and cmd.help_name is not None:
+                # Don't allow duplicate names
+                helps.setdefault(cmd.help_name.lower(), (' '.join(cmd.help.lower().split()), privilege))
+            if cmd.syntax is not None:
+                listing.append((privilege, cmd.syntax))
+        index = defaultdict(set)
+        for name in helps:
+            for trigram in trigrams(name):
+                index[trigram].add(name)
+        levels = sorted({privilege for privilege, syntax in listing} |
+                {privilege for text, privilege in helps.values()})
+        views = []
+        for level in levels:
+            names = [name for name, (text, privilege) in helps.items() if privilege <= level]
+            syntaxes = [syntax for privilege, syntax in listing if privilege <= level]
+            views.append((names, syntaxes))
+        self.index = Index(by_name, helps, dict(index), levels, views)
+
+
+    def find(self, name):
+        """ Find
+            Return the command with a given help name or class name
+            (ignoring case), or None
+        """
+        return self.index.commands.get(name.lower())
+
+
+    def help(self, name):
+        """ Help
+            Return the help text for a help name, or None
+        """
+        entry = self.index.helps.get(name.lower())
+        return entry[0] if entry is not None else None
+
+
+    def suggest(self, name, user_priv=float('inf'), count=3, threshold=0.3):
+        """ Suggest
+            Return up to count help names of commands the user can run which
+            look like the given name, most alike first
+        """
+        index = self.index
+        wanted = trigrams(name)
+        shared = defaultdict(int)
+        for trigram in wanted:
+            for candidate in index.trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        scored = []
+        for candidate, common in shared.items():
+            if index.helps[candidate][1] > user_priv:
+                continue
+            similarity = common / (len(wanted) + len(trigrams(candidate)) - common)
+            if similarity >= threshold:
+                scored.append((-similarity, candidate))
+        return [candidate for similarity, candidate in sorted(scored)[:count]]
+
+
+    def help_names(self, user_priv):
+        """ Help Names
+            Return the help names of every command the user can run
+        """
+        return self._view(user_priv)[0]
+
+
+    def syntaxes(self, user_priv):
+        """ Syntaxes
+            Return the syntax of every command the user can run
+        """
+        return self._view(user_priv)[1]
+
+
+    def _view(self, user_priv):
+        index = self.index
+        level = bisect.bisect_right(index.levels, user_priv) - 1
+        if level < 0:
+            return [], []
+        return index.views[level]
@@ -1,4 +1,6 @@
 import re
+
+from util import *
 from hangups.bot.commands.command import Command
 
 class AddAlias(Command):
@@ -7,6 +9,8 @@ class AddAlias(Command):
         to another
     """
 
+    keywords = ['alias']
+
     def __init__(self):
         self.help = """Add Alias Command - example: 'gambit: alias 
                        black white' link some valid karma term with a 
@@ -16,41 +20,34 @@ class AddAlias(Command):
         self.syntax = "gambit: alias <old> <new>"
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_add = re.compile("^.*gambit[:,]? alias ((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\)) ((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\)).*$", re.IGNORECASE)
-        res = re_add.match(message)
+        res = re_add.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['old'], self.cmd_args['new'] = res.groups()
-        self.cmd_args['old'] = self.cmd_args['old'].replace('(', '').replace(')', '')
-        self.cmd_args['new'] = self.cmd_args['new'].replace('(', '').replace(')', '')
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
+        ctx.args['old'], ctx.args['new'] = res.groups()
+        ctx.args['old'] = ctx.args['old'].replace('(', '').replace(')', '')
+        ctx.args['new'] = ctx.args['new'].replace('(', '').replace(')', '')
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Add Alias")
-            karma = self.bot.db.execute("SELECT target, karma FROM karma")
-            for pair in karma.fetchall():
-                if pair[0].lower() == self.cmd_args['old'].lower() and pair[1] != 0:
-                    self.bot.say("There's already karma for {}".format(self.cmd_args['old']))
-                    return
-            aliases = self.bot.db.execute("SELECT old, new FROM aliases")
-            for pair in aliases.fetchall():
-                if pair[0].lower() == self.cmd_args['old'].lower():
-                    self.bot.say("There's already an alias for {}".format(self.cmd_args['old']))
-                    return
-            self.bot.db.execute("INSERT INTO aliases (old, new) VALUES(?, ?)", (self.cmd_args['old'],self.cmd_args['new'],))
-            self.bot.db.commit()
-            self.bot.say("Aliased {} to {}".format(self.cmd_args['old'], self.cmd_args['new']))
+            ctx.bot.log.info("Executing Add Alias")
+            if get_karma(ctx.bot.db, ctx.args['old']) != 0:
+                ctx.say("There's already karma for {}".format(ctx.args['old']))
+                return
+            names.load(ctx.bot.db)
+            if ctx.args['old'].lower() in names.aliases:
+                ctx.say("There's already an alias for {}".format(ctx.args['old']))
+                return
+            ctx.bot.db.execute("INSERT INTO aliases (old, new) VALUES(?, ?)", (ctx.args['old'],ctx.args['new'],))
+            ctx.bot.db.commit()
+            names.add_alias(ctx.args['old'], ctx.args['new'])
+            ctx.say("Aliased {} to {}".format(ctx.args['old'], ctx.args['new']))
         except Exception as error:
-            self.bot.log.warn("Error in Add Alias:\n{}".format(error))
+            ctx.bot.log.warn("Error in Add Alias:\n{}".format(error))
 
 
 class RemoveAlias(Command):
@@ -58,6 +55,8 @@ class RemoveAlias(Command):
         Remove a link mapping one karma value to another
     """
 
+    keywords = ['remove']
+
     def __init__(self):
         self.help = """Remove Alias Command - example 'gambit: remove 
                      alias black' remove from the bots database an 
@@ -67,34 +66,31 @@ class RemoveAlias(Command):
         self.syntax = "gambit: remove alias <old>"
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_remove = re.compile("^.*gambit[:,]? remove alias ((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\)).*$", re.IGNORECASE)
-        res = re_remove.match(message)
+        res = re_remove.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['alias'] = res.groups()[0].replace('(', '').replace(')', '')
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['alias'] = res.groups()[0].replace('(', '').replace(')', '')
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Remove Alias")
-            exists = self.bot.db.execute("SELECT COUNT(*) FROM aliases WHERE old = ?", (self.cmd_args['alias'],))
+            ctx.bot.log.info("Executing Remove Alias")
+            exists = ctx.bot.db.execute("SELECT COUNT(*) FROM aliases WHERE old = ?", (ctx.args['alias'],))
             exists = exists.fetchone()[0] > 0
             if not exists:
-                self.bot.say("There is no alias for that name.")
+                ctx.say("There is no alias for that name.")
                 return
-            self.bot.db.execute("DELETE FROM aliases WHERE old = ?",(self.cmd_args['alias'],))
-            self.bot.db.commit()
-            self.bot.say("Removed alias for {}".format(self.cmd_args['alias']))
+            ctx.bot.db.execute("DELETE FROM aliases WHERE old = ?",(ctx.args['alias'],))
+            ctx.bot.db.commit()
+            names.invalidate()
+            leaderboard.invalidate()
+            ctx.say("Removed alias for {}".format(ctx.args['alias']))
         except Exception as error:
-            self.bot.log.warn("Error in Remove Alias:\n{}".format(error))
+            ctx.bot.log.warn("Error in Remove Alias:\n{}".format(error))
 
 
 class ListAliases(Command):
@@ -102,6 +98,8 @@ class ListAliases(Command):
         Print out all current aliases in the bot's database
     """
 
+    keywords = ['show', 'list']
+
     def __init__(self):
         self.help = """List Aliases Command - example 'gambit: list 
                        aliases' have the bot list out all aliases 
@@ -110,27 +108,22 @@ class ListAliases(Command):
         self.syntax = "gambit: list aliases"
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_list = re.compile("^.*gambit[:,]? (show|list) aliases.*")
-        res = re_list.match(message)
+        res = re_list.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing List Aliases")
-            aliases = self.bot.db.execute("SELECT old, new FROM aliases")
+            ctx.bot.log.info("Executing List Aliases")
+            aliases = ctx.bot.db.execute("SELECT old, new FROM aliases")
             statement = ''
             statement += "Current aliases are:\n"
             for pair in aliases.fetchall():
                 statement += "{} -> {}\n".format(pair[0], pair[1])
-            self.bot.say(statement)
-        except Exception as error: self.bot.log.warn("Error in List Aliases:\n{}".format(error))
+            ctx.say(statement)
+        except Exception as error: ctx.bot.log.warn("Error in List Aliases:\n{}".format(error))
@@ -1,29 +1,90 @@
+from collections import namedtuple
+
+
+class MessageContext(namedtuple('MessageContext',
+        ['bot', 'user', 'conversation', 'text', 'user_priv', 'args'])):
+    """ Message Context
+        An immutable snapshot of everything a command needs to know about a
+        single message: who sent it, where, what they said and at what
+        privilege. Each command gets its own args dictionary to fill in
+        parse, so several messages can be in flight at once without stepping
+        on each other
+    """
+    __slots__ = ()
+
+    def with_args(self, args):
+        """ With Args
+            Return a copy of the context with a fresh arguments dictionary
+        """
+        return self._replace(args=args)
+
+
+    def say(self, text):
+        """ Say
+            Reply in the conversation the message came from
+        """
+        self.bot.say(text, self.conversation)
+
+
 class Command:
     """ Command
         A class representing the base interface to run and interact with a
         command trigger for the bot
     """
-    cmd_args = {}
     cmd_priv = 0 # Privilege level required to execute command
-    parsed = False
     help = None
     help_name = None
     syntax = None
+    # Leading words (after an optional 'gambit:') the command can be triggered
+    # by. Commands without keywords are handed every message
+    keywords = None
+    # Words or phrases found anywhere in a message which trigger the command,
+    # matched in a single pass for every ambient command
+    triggers = None
+    # Whether triggers only count as whole words
+    whole_words = True
+    # Higher priority commands are tried first when dispatch is first-match
+    priority = 0
+    # (capacity, seconds per token) of a token bucket limiting how often the
+    # command runs, and who shares a bucket: 'user', 'conversation' or
+    # 'command' (everyone). None for no limit
+    rate_limit = None
+    rate_limit_per = 'user'
+
+
+    @property
+    def name(self):
+        """ Name
+            The name the command is registered under in the database
+        """
+        return self.__class__.__name__
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         """ Parse
-            Given a message sent to the bot, determine and return whether or
-            not the message is a trigger for the given command. If so, fill
-            the command argument dictionary with appropriate data to run the
-            command itself
+            Given the context of a message sent to the bot, determine and
+            return whether or not the message is a trigger for the given
+            command. If so, fill the context's argument dictionary with
+            appropriate data to run the command itself
         """
         pass
 
 
-    def execute(self):
+    def execute(self, ctx):
         """ Execute
             After the command has been parsed and the arguments dictionary
-            filled, execute the command itself
+            filled, execute the command itself. Commands which block (on the
+            database, the network, etc.) are run in the bot's thread pool,
+            commands can instead define execute as a coroutine to be awaited
+            on the event loop
+        """
+        pass
+
+
+    def on_timer(self, bot, payload):
+        """ On Timer
+            Called when a timer the command scheduled (see bot.timers) goes
+            off, with the payload it was given. Run in the thread pool
+            unless defined as a coroutine, like execute
         """
         pass
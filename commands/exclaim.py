@@ -1,10 +1,9 @@
 import re
 from random import randint
-from urllib import parse, request
-from bs4 import BeautifulSoup
 
 from util import *
 from hangups.bot.commands.command import Command
+from hangups.bot.titles import find_urls
 
 class SayHi(Command):
     """ Say Hi
@@ -13,60 +12,57 @@ class SayHi(Command):
 
     greetings = ["hi", "hello", "hey", "howdy", "salutations",
                  "greetings", "'ello", "hola"]
+    triggers = greetings
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         exp = re.compile("^(.+)[:,]? gambit[.!?]?$", re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None or res.groups()[0].lower() not in self.greetings:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Say Hi")
+            ctx.bot.log.info("Executing Say Hi")
             greeting = self.greetings[randint(0, len(self.greetings)-1)]
-            username = get_honorific_name(self.bot.db, self.bot.user.full_name, self.bot.conversation.id_)
-            self.bot.say("{}, {}!".format(greeting.capitalize(), username))
+            username = get_honorific_name(ctx.bot.db, ctx.user.full_name, ctx.conversation.id_)
+            ctx.say("{}, {}!".format(greeting.capitalize(), username))
         except Exception as error:
-            self.bot.log.warn("Error in Say Hi:\n{}".format(error))
+            ctx.bot.log.warn("Error in Say Hi:\n{}".format(error))
 
 
 
 class SayURL(Command):
     """ Say URL
-        Respond to text containing a URL with the link title
+        Respond to text containing URLs with the title of each linked page
     """
 
-    def parse(self, bot, message, user_priv):
-        self.parsed = False
-        pieces = parse.urlparse(message)
-        if pieces.hostname:
-            self.bot = bot
-            self.user_priv = user_priv
-            self.message = message
-            self.parsed = True
-        return self.parsed
+    triggers = ['http', 'https']
+    rate_limit = (5, 60)
+    rate_limit_per = 'conversation'
+    timeout = 10 # Seconds to wait on a page before giving up
+    max_bytes = 64 * 1024 # How much of a page to read looking for its title
 
+    def parse(self, ctx):
+        urls = find_urls(ctx.text)
+        if not urls:
+            return False
+        ctx.args['urls'] = urls
+        return True
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+
+    async def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Say URL')
-            res = request.urlopen(self.message)
-            html = res.read()
-            soup = BeautifulSoup(html)
-            title = soup.html.head.title.text
-            self.bot.say(title)
+            ctx.bot.log.info('Executing Say URL')
+            titles = await ctx.bot.titles.titles(ctx.args['urls'], self.timeout, self.max_bytes)
+            for title in titles:
+                if title:
+                    ctx.say(title)
         except Exception as error:
-            self.bot.log.warn('Error in Say URL:\n{}'.format(error))
+            ctx.bot.log.warn('Error in Say URL:\n{}'.format(error))
 
 
 class Substitute(Command):
@@ -75,40 +71,41 @@ class Substitute(Command):
         sent on a chat with the bot
     """
 
-    def parse(self, bot, message, user_priv):
-        exp = re.compile('^s\/(.+)\/(.+)$')
-        res = exp.match(message)
+    # s/before/after, optionally followed by a / and how many messages back
+    re_substitute = re.compile('^s/([^/]+)/([^/]*?)(?:/(\d+)?)?$')
+
+    def parse(self, ctx):
+        res = self.re_substitute.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        before, after = res.groups()
-        self.cmd_args['before'] = before
-        self.cmd_args['after'] = after
-        self.message = message
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        before, after, back = res.groups()
+        ctx.args['before'] = before
+        ctx.args['after'] = after
+        ctx.args['back'] = int(back) if back is not None else 1
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Substitute')
-            if self.bot.user.full_name not in self.bot.last_message.keys():
+            ctx.bot.log.info('Executing Substitute')
+            # Earlier substitutions aren't worth correcting
+            said = ctx.bot.history.last(ctx.conversation.id_, ctx.user.full_name, ctx.args['back'],
+                    lambda message: not self.re_substitute.match(message.text))
+            if said is None:
                 return
-            last = self.bot.last_message[self.bot.user.full_name]
+            last = said.text
+            before, after = ctx.args['before'], ctx.args['after']
             msg = None
-            if last.find(self.cmd_args['before']) != -1:
-                msg = last.replace(self.cmd_args['before'], self.cmd_args['after'])
-            elif last.find(before.lower() != -1):
-                msg = last.replace(self.cmd_args['before'].lower(), self.cmd_args['after'])
+            if last.find(before) != -1:
+                msg = last.replace(before, after)
+            elif last.lower().find(before.lower()) != -1:
+                msg = re.sub(re.escape(before), lambda match: after, last, flags=re.IGNORECASE)
             if msg:
-                username = get_honorific_name(self.bot.db, self.bot.user.full_name, self.bot.conversation.id_)
-                self.bot.say(username + ' MEANT to say: ' + msg)
+                username = get_honorific_name(ctx.bot.db, ctx.user.full_name, ctx.conversation.id_)
+                ctx.say(username + ' MEANT to say: ' + msg)
         except Exception as error:
-            self.bot.log.warn('Error in Substitute:\n{}'.format(error))
+            ctx.bot.log.warn('Error in Substitute:\n{}'.format(error))
 
 
 class TellDadJoke(Command):
@@ -118,6 +115,8 @@ class TellDadJoke(Command):
         non-offensive, punny humor
     """
 
+    keywords = ['dad', 'dadjoke']
+
     def __init__(self):
         self.help = """Dad Joke Command - Example: 'Gambit: dad joke' 
                        Tells a horrible dad joke."""
@@ -125,29 +124,26 @@ class TellDadJoke(Command):
         self.syntax = "gambit: dad joke"
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         exp = re.compile('^(?:gambit[:,]?)?\s?dad\s?joke.?$', re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
     
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Tell Dad Joke')
-            res = self.bot.db.execute("SELECT joke FROM jokes WHERE type = 'dad'")
-            jokes = res.fetchall()
-            joke = jokes[randint(0, len(jokes) - 1)][0]
-            self.bot.say(joke)
+            ctx.bot.log.info('Executing Tell Dad Joke')
+            joke = sampler.choice(ctx.bot.db, 'jokes', 'joke', "WHERE type = ?", ('dad',),
+                    bag=ctx.conversation.id_)
+            if joke is None:
+                ctx.say("I'm all out of jokes")
+                return
+            ctx.say(joke[0])
         except Exception as error:
-            self.bot.log.warn('Error in Tell Dad Joke\n{}'.format(error))
+            ctx.bot.log.warn('Error in Tell Dad Joke\n{}'.format(error))
 
 
 class SayWat(Command):
@@ -156,28 +152,27 @@ class SayWat(Command):
         all software talk
     """
 
-    def parse(self, bot, message, user_priv):
+    triggers = ["wat"]
+    rate_limit = (2, 60)
+    rate_limit_per = 'conversation'
+
+    def parse(self, ctx):
         exp = re.compile("^.*(^|\W)wat($|\W).*$", re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Say Wat')
+            ctx.bot.log.info('Executing Say Wat')
             filenames = ['watduck.jpg', 'wathorse.jpg', 'wat.jpeg', 'watman.jpg']
-            image_file = self.bot.image_src + filenames[randint(0, len(filenames)-1)]
-            self.bot.say('/image ' + image_file)
+            image_file = ctx.bot.image_src + filenames[randint(0, len(filenames)-1)]
+            ctx.say('/image ' + image_file)
         except Exception as error:
-            self.bot.log.warn('Error in Say Wat\n{}'.format(error))
+            ctx.bot.log.warn('Error in Say Wat\n{}'.format(error))
 
 
 class SayItsATrap(Command):
@@ -186,28 +181,27 @@ class SayItsATrap(Command):
         leading a rebel fleet against the second death star
     """
 
-    def parse(self, bot, message, user_priv):
+    triggers = ["it's a trap", "its a trap"]
+    rate_limit = (2, 60)
+    rate_limit_per = 'conversation'
+
+    def parse(self, ctx):
         exp = re.compile("^.*(^|\W)IT'?S A TRAP($|\W).*$", re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Its A Trap')
+            ctx.bot.log.info('Executing Its A Trap')
             filenames = ['hopeitsatrap.jpg', 'itsafrappe.jpg', 'itsaruse.jpeg', 'itsatrap.jpg']
-            image_file = self.bot.image_src + filenames[randint(0, len(filenames)-1)]
-            self.bot.say('/image ' + image_file)
+            image_file = ctx.bot.image_src + filenames[randint(0, len(filenames)-1)]
+            ctx.say('/image ' + image_file)
         except Exception as error:
-            self.bot.log.warn('Error in Its A Trap\n{}'.format(error))
+            ctx.bot.log.warn('Error in Its A Trap\n{}'.format(error))
 
 
 class FuckGrails(Command):
@@ -215,27 +209,26 @@ class FuckGrails(Command):
         'Rails on the JVM, need I say more?' - William Doyle
     """
 
-    def parse(self, bot, message, user_priv):
+    triggers = ["grails"]
+    rate_limit = (2, 60)
+    rate_limit_per = 'conversation'
+
+    def parse(self, ctx):
         exp = re.compile("^.*(^|\W)grails($|\W).*$", re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Fuck Grails')
-            image_file = self.bot.image_src + 'grails.png'
-            self.bot.say('/image ' + image_file)
+            ctx.bot.log.info('Executing Fuck Grails')
+            image_file = ctx.bot.image_src + 'grails.png'
+            ctx.say('/image ' + image_file)
         except Exception as error:
-            self.bot.log.warn('Error in Fuck Grails\n{}'.format(error))
+            ctx.bot.log.warn('Error in Fuck Grails\n{}'.format(error))
 
 
 class TellGoodNews(Command):
@@ -244,27 +237,26 @@ class TellGoodNews(Command):
          AOL, and it just went through! Wheee! We're online!'
     """
 
-    def parse(self, bot, message, user_priv):
+    triggers = ["good news"]
+    rate_limit = (2, 60)
+    rate_limit_per = 'conversation'
+
+    def parse(self, ctx):
         exp = re.compile("^.*(^|\W)good news($|\W).*$", re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Tell Good News')
-            image_file = self.bot.image_src + 'goodnews.jpg'
-            self.bot.say('/image ' + image_file)
+            ctx.bot.log.info('Executing Tell Good News')
+            image_file = ctx.bot.image_src + 'goodnews.jpg'
+            ctx.say('/image ' + image_file)
         except Exception as error:
-            self.bot.log.warn('Error in Tell Good News\n{}'.format(error))
+            ctx.bot.log.warn('Error in Tell Good News\n{}'.format(error))
 
 
 class SpoilerAlert(Command):
@@ -272,27 +264,26 @@ class SpoilerAlert(Command):
         Vroom VROOM. Yay spoilers.
     """
 
-    def parse(self, bot, message, user_priv):
+    triggers = ["spoiler alert"]
+    rate_limit = (2, 60)
+    rate_limit_per = 'conversation'
+
+    def parse(self, ctx):
         exp = re.compile("^.*(^|\W)spoiler alert($|\W).*$", re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Spoiler Alert')
-            image_file = self.bot.image_src + 'Spoilers.jpg'
-            self.bot.say('/image ' + image_file)
+            ctx.bot.log.info('Executing Spoiler Alert')
+            image_file = ctx.bot.image_src + 'Spoilers.jpg'
+            ctx.say('/image ' + image_file)
         except Exception as error:
-            self.bot.log.warn('Error in Tell Spoiler Alert\n{}'.format(error))
+            ctx.bot.log.warn('Error in Tell Spoiler Alert\n{}'.format(error))
 
 
 class TellItToTheCleaningLadyOnMonday(Command):
@@ -306,31 +297,28 @@ class TellItToTheCleaningLadyOnMonday(Command):
         (P.S.S. Gambit is technically vegan!)
     """
 
-    def parse(self, bot, message, user_priv):
+    triggers = ["cleaning lady"]
+
+    def parse(self, ctx):
         exp = re.compile("^.*(^|\W)cleaning lady($|\W).*$", re.IGNORECASE)
-        res = exp.match(message)
+        res = exp.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
     
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Tell it to the Cleaning Lady on Monday')
-            self.bot.say("Tell it to the cleaning lady on Monday.")
-            self.bot.say("Because you'll be dust by Monday...")
-            self.bot.say("Because you'll be pulverized in two seconds...")
-            self.bot.say("The cleaning lady? She cleans up... dust. She dusts.")
-            self.bot.say("'Cause... it's Friday now, and she has the weekends off, so...")
-            self.bot.say("Monday... right?")
+            ctx.bot.log.info('Executing Tell it to the Cleaning Lady on Monday')
+            ctx.say("Tell it to the cleaning lady on Monday.")
+            ctx.say("Because you'll be dust by Monday...")
+            ctx.say("Because you'll be pulverized in two seconds...")
+            ctx.say("The cleaning lady? She cleans up... dust. She dusts.")
+            ctx.say("'Cause... it's Friday now, and she has the weekends off, so...")
+            ctx.say("Monday... right?")
         except Exception as error:
-            self.bot.log.warn('Error in Tell it to the Cleaning Lady on Monday\n{}'.format(error))
+            ctx.bot.log.warn('Error in Tell it to the Cleaning Lady on Monday\n{}'.format(error))
 
 
 class WOTSwear(Command):
@@ -339,21 +327,19 @@ class WOTSwear(Command):
         'Wheel of Time' series
     """
 
-    def parse(self, bot, message, user_priv):
-        if 'light!' not in message.lower():
-            self.parsed = False
+    triggers = ["light!"]
+    whole_words = False
+
+    def parse(self, ctx):
+        if 'light!' not in ctx.text.lower():
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
     
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing WOT Swear")
+            ctx.bot.log.info("Executing WOT Swear")
             swears = ["Blood and bloody ashes!",
                       "Mother's milk in a cup!",
                       "Oh sheep swallop!",
@@ -362,6 +348,6 @@ class WOTSwear(Command):
                       "You hairy lummox!",
                       "You milk-hearted wetlander!",
                       "You bloody ox of a thimble-brained man!"]
-            self.bot.say(swears[randint(0, len(swears)-1)])
+            ctx.say(swears[randint(0, len(swears)-1)])
         except Exception as error:
-            self.bot.log.warn('Error in WOT Swear\n{}'.format(error))
+            ctx.bot.log.warn('Error in WOT Swear\n{}'.format(error))
@@ -5,45 +5,35 @@ class Help(Command):
     """ Help
         Provide help on using any command the bot knows
     """
+
+    keywords = ['help']
     
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_help = re.compile('^(?:gambit[:,]? )?help(?: (.+))?$', re.IGNORECASE)
-        res = re_help.match(message)
+        res = re_help.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['cmd'] = res.groups()[0]
-        if self.cmd_args['cmd'] is not None:
-            self.cmd_args['cmd'] = self.cmd_args['cmd'].lower()
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
+        ctx.args['cmd'] = res.groups()[0]
+        if ctx.args['cmd'] is not None:
+            ctx.args['cmd'] = ctx.args['cmd'].lower()
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
+    def execute(self, ctx):
         # There's no such thing as a privilege level for help
         try:
-            self.bot.log.info("Executing Help.")
-            help_dict = {}
-            # Build a help dictionary
-            for cmd in self.bot.cmd_list:
-                if cmd.help is not None and cmd.help_name is not None:
-                    if cmd.help_name.lower() in help_dict.keys():
-                        # Don't allow duplicate names
-                        continue
-                    help_dict[cmd.help_name.lower()] = cmd.help.lower()
-            if self.cmd_args['cmd'] in help_dict.keys():
-                response = help_dict[self.cmd_args['cmd']]
-                response = response.replace('\n', ' ')
-                response = ' '.join(response.split())
-                self.bot.say(response)
-                return
-            response = 'help options: '
-            for option in help_dict.keys():
-                response += '{}, '.format(option)
-            response = response[:-2] # Chop off trailing ', '
-            self.bot.say(response)
+            ctx.bot.log.info("Executing Help.")
+            catalog = ctx.bot.catalog
+            if ctx.args['cmd'] is not None:
+                response = catalog.help(ctx.args['cmd'])
+                if response is not None:
+                    ctx.say(response)
+                    return
+                suggestions = catalog.suggest(ctx.args['cmd'], ctx.user_priv)
+                if suggestions:
+                    ctx.say("No help for {}. Did you mean: {}?".format(ctx.args['cmd'], ', '.join(suggestions)))
+                    return
+            # Only offer help on what the user can actually run
+            ctx.say('help options: ' + ', '.join(catalog.help_names(ctx.user_priv)))
         except Exception as error:
-            self.bot.log.warn("Error in Help:\n{}".format(error))
+            ctx.bot.log.warn("Error in Help:\n{}".format(error))
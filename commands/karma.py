@@ -1,17 +1,22 @@
 import re
-from random import randint
-from time import time
 
 from util import *
 from hangups.bot.commands.command import Command
 
+max_leaderboard = 25 # Most entries a leaderboard command will list
+max_history_days = 366 # Furthest back karma history can be asked about
+max_history_lines = 10 # Most days karma history will list
+max_debt_lines = 25 # Most debts show debts will list
+
+
 class ChangeKarma(Command):
     """ Change Karma
         Take a list of groups gathered by karma regular expressions and
         parse out any increments or decrements which need to be applied
     """
 
-    tokens = {}
+    # Karma changes are limited one by one rather than per message
+    change_limit = (5, 30)
 
     def __init__(self):
         self.help = """Change Karma Command - example 'poop++' Give
@@ -26,19 +31,17 @@ class ChangeKarma(Command):
         self.syntax =  "<target>++, <target>--, (<multiword target>)++, (<mutiword target>)--"
 
 
-    def parse(self, bot, message, user_priv):
-        if not bot.karma[bot.conversation.id_]:
-            self.parsed = False
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
             return False
         re_base = re.compile('((?:\w|\d)+(?:\+\+|\-\-))')
         re_paren = re.compile('(\((?:(?:\w|\d)+ )*(?:\w|\d)+\)(?:\+\+|\-\-))')
-        changes = re_base.findall(message) 
-        for change in re_paren.findall(message): # Trim the compound karma changes of their parentheses
+        changes = re_base.findall(ctx.text) 
+        for change in re_paren.findall(ctx.text): # Trim the compound karma changes of their parentheses
             change = change.replace('(', '') 
             change = change.replace(')', '')
             changes.append(change)
         if not changes:
-            self.parsed = False
             return False
         # Separate our changes into increments and decrements
         inc = []
@@ -46,101 +49,69 @@ class ChangeKarma(Command):
         for change in changes:
             if change.endswith('++'):
                 target = change[:-2] # Cut off the '++'
-                target = resolve_alias(bot.db, target)
-                link = resolve_full(bot.db, target)
+                target = resolve_alias(ctx.bot.db, target)
+                link = resolve_full(ctx.bot.db, target)
                 # Don't let people give themselves karma
-                if link.lower() == bot.user.full_name.lower():
+                if link.lower() == ctx.user.full_name.lower():
                     dec.append(target)
                 else:
                     inc.append(target)
             elif change.endswith('--'): # Just to be safe
                 target = change[:-2]
-                target = resolve_alias(bot.db, target)
+                target = resolve_alias(ctx.bot.db, target)
                 dec.append(target) # Cut off the '--'
-        self.cmd_args['inc'] = inc
-        self.cmd_args['dec'] = dec
-        self.parsed = True
-        self.user_priv = user_priv
-        self.bot = bot
+        ctx.args['inc'] = inc
+        ctx.args['dec'] = dec
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Change Karma')
-            for target in self.cmd_args['inc']:
-                can_change = self._change_karma(target, 1)
-                update_honorifics(self.bot.db, self.bot.conversation.id_)
-                if not can_change:
-                    self.bot.say('Bitch, be cool! Stop spamming me with karma')
+            ctx.bot.log.info('Executing Change Karma')
+            changes = []
+            limited = False
+            for target in ctx.args['inc']:
+                if self._apply_rate_limit(ctx):
+                    changes.append((target, 1))
                 else:
-                    username = target
-                    if target in get_users(self.bot.db):
-                        username = resolve_nick(target)
-                        username = get_honorific_name(self.bot.db, username, self.bot.conversation.id_)
-                    karma = get_karma(self.bot.db, target)
-                    self.bot.say('Gave karma to {}, total: {}'.format(username, karma))
-            for target in self.cmd_args['dec']:
-                can_change = self._change_karma(target, -1)
-                update_honorifics(self.bot.db, self.bot.conversation.id_)
-                if not can_change:
-                    self.bot.say('Bitch, be cool! Stop spamming me with karma')
+                    limited = True
+            for target in ctx.args['dec']:
+                if self._apply_rate_limit(ctx):
+                    changes.append((target, -1))
                 else:
-                    karma = get_karma(self.bot.db, target)
-                    username = target
-                    if target in get_users(self.bot.db):
-                        username = resolve_nick(target)
-                        username = get_honorific_name(self.bot.db, username, self.bot.conversation.id_)
-                    self.bot.say('Took karma from {}, total: {}'.format(username, karma))
+                    limited = True
+            if limited:
+                ctx.say('Bitch, be cool! Stop spamming me with karma')
+            # Apply every change in the message at once
+            totals = change_karma(ctx.bot.db, changes, ctx.user.full_name, 'karma', ctx.conversation.id_)
+            for target, (change, karma) in totals.items():
+                ctx.bot.honorifics.karma_changed(ctx.bot.db, target, karma)
+                username = target
+                if target.lower() in get_users(ctx.bot.db):
+                    username = resolve_full(ctx.bot.db, target)
+                    username = get_honorific_name(ctx.bot.db, username, ctx.conversation.id_)
+                if change == 1:
+                    ctx.say('Gave karma to {}, total: {}'.format(username, karma))
+                elif change == -1:
+                    ctx.say('Took karma from {}, total: {}'.format(username, karma))
+                elif change > 0:
+                    ctx.say('Gave {} karma to {}, total: {}'.format(change, username, karma))
+                elif change < 0:
+                    ctx.say('Took {} karma from {}, total: {}'.format(abs(change), username, karma))
+                else:
+                    ctx.say('Karma for {}: {}.'.format(username, karma))
         except Exception as error:
-            self.bot.log.warn('Error in Change Karma:\n{}'.format(error))
-
-
-    def _change_karma(self, name, change):
-        """ Change Karma
-            Make sure that the user can make a karma change using rate
-            limiting and return whether or not the karma value was
-            added or changed
-        """
-        can_change = self._apply_rate_limit()
-        if not can_change: return False
-        res = self.bot.db.execute('SELECT target, karma FROM karma')
-        for target in res.fetchall():
-            if target[0].lower() == name.lower():
-                self.bot.db.execute('UPDATE karma SET karma = karma + ? WHERE target = ?', (change, target[0],))
-                self.bot.db.commit()
-                return True
-        self.bot.db.execute("INSERT INTO karma (target, karma) VALUES(?, 0)", (name,))
-        self.bot.db.execute("UPDATE karma SET karma = karma + ? WHERE target = ?", (change, name,))
-        self.bot.db.commit()
-        return True
+            ctx.bot.log.warn('Error in Change Karma:\n{}'.format(error))
 
 
-    def _apply_rate_limit(self):
+    def _apply_rate_limit(self, ctx):
         """ Apply Rate Limit
-            Check how frequently the current user has run karma commands
-            and, if they exceed a certain threshold (30 seconds) return
-            False so they don't make any karma changes
+            Take a token from the current user's karma bucket, which holds
+            5 tokens and gains one every 30 seconds. Return False if it's
+            empty so they don't make any more karma changes
         """
-        update_time = time()
-        user_name = self.bot.user.full_name
-        if user_name in self.tokens.keys():
-            last_change = self.tokens[user_name][0]
-            # Add 1 token for every 30 seconds from the last change
-            added_tokens = int((update_time - last_change) / 30)
-            self.tokens[user_name][1] += added_tokens
-            # Max at 5 self.tokens
-            if self.tokens[user_name][1] > 5:
-                self.tokens[user_name][1] = 5
-        else:
-            # Initialize the users token pair (last change, # of self.tokens)
-            self.tokens[user_name] = [update_time, 5] # Start with 5 self.tokens
-        if self.tokens[user_name][1] <= 0:
-            return False
-        self.tokens[user_name][1] -= 1
-        return True
+        return ctx.bot.limits.allow((self.name, 'user', ctx.user.full_name), *self.change_limit)
 
 
 class GetKarma(Command):
@@ -148,6 +119,8 @@ class GetKarma(Command):
         Resolve a targets name after aliasing and state its karma
     """
 
+    keywords = ['karma']
+
     def __init__(self):
         self.help = """Get Karma Command - example 'Karma poop' 
                        Retrieves and states the karma of a given
@@ -158,46 +131,43 @@ class GetKarma(Command):
         self.syntax = "karma <target>, karma (<multiword target>)"
 
 
-    def parse(self, bot, message, user_priv):
-        if not bot.karma[bot.conversation.id_]:
-            self.parsed = False
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
             return False
         re_karma = re.compile('^(?:gambit[:,]? )?karma ((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\))$', re.IGNORECASE)
-        targets = re_karma.findall(message)
+        targets = re_karma.findall(ctx.text)
         if len(targets) == 0:
-            self.parsed = False
             return False
         for i, target in enumerate(targets):
             target = target.replace('(','')
             target = target.replace(')','')
             targets[i] = target
-        self.cmd_args['targets'] = targets
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['targets'] = targets
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Get Karma')
-            for target in self.cmd_args['targets']:
-                target = resolve_alias(self.bot.db, target)
-                karma = get_karma(self.bot.db, target)
-                self.bot.say('Karma for {}: {}.'.format(target, karma))
+            ctx.bot.log.info('Executing Get Karma')
+            for target in ctx.args['targets']:
+                target = resolve_alias(ctx.bot.db, target)
+                karma = get_karma(ctx.bot.db, target)
+                ctx.say('Karma for {}: {}.'.format(target, karma))
         except Exception as error:
-            self.bot.log.warn('Error in Get Karma:\n{}'.format(error))
+            ctx.bot.log.warn('Error in Get Karma:\n{}'.format(error))
 
 
 class Spot(Command):
     """ Spot
         Transfer karma from the calling user to the borrower. The total
-        karma is specified as an arguments and any outstanding debts are
-        logged in the debts table of the database
+        karma is specified as an arguments and the debt is netted against
+        the others outstanding in the conversation, in the debts table of
+        the database
     """
 
+    keywords = ['spot']
+
     def __init__(self):
         self.help = """Spot Command - example: 'Gambit: spot Goofy 1'
                        Lend some karma to another user. The karma is
@@ -208,170 +178,394 @@ class Spot(Command):
         self.syntax = "gambit: spot <borrower> <amount>"
 
 
-    def parse(self, bot, message, user_priv):
-        if not bot.karma[bot.conversation.id_]:
-            self.parsed = False
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
             return False
         re_spot = re.compile("^.*gambit[:,]? spot (\w+) (\d+).?!?\??.*$", re.IGNORECASE)
-        res = re_spot.match(message)
+        res = re_spot.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
         borrower, amount = res.groups()
-        self.cmd_args['borrower'] = borrower
-        self.cmd_args['amount'] = amount
-        self.user_priv = user_priv
-        self.bot = bot
-        self.parsed = True
+        ctx.args['borrower'] = borrower
+        ctx.args['amount'] = amount
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Excecuting Spot')
-            lender = resolve_nick(self.bot.db, self.bot.user.full_name)
-            borrower = resolve_alias(self.bot.db, self.cmd_args['borrower'])
-            amount = int(self.cmd_args['amount'])
-            borrower_username = resolve_full(self.bot.db, borrower)
-            borrower_username = get_honorific_name(self.bot.db, borrower_username, self.bot.conversation.id_)
+            ctx.bot.log.info('Excecuting Spot')
+            lender = resolve_nick(ctx.bot.db, ctx.user.full_name)
+            borrower = resolve_alias(ctx.bot.db, ctx.args['borrower'])
+            amount = int(ctx.args['amount'])
+            borrower_username = resolve_full(ctx.bot.db, borrower)
+            borrower_username = get_honorific_name(ctx.bot.db, borrower_username, ctx.conversation.id_)
             # Check to make sure the loan isn't invalid
-            if amount > get_karma(self.bot.db, lender):
-                self.bot.say("You're a bit too generous, friend. Don't lend what you don't have.")
-                return
             if borrower.lower() == 'gambit':
-                self.bot.say("I don't need your charity!")
+                ctx.say("I don't need your charity!")
+                return
+            if borrower.lower() not in get_users(ctx.bot.db):
+                ctx.say("You can only lend to another user")
                 return
-            if borrower.lower() not in get_users(self.bot.db):
-                self.bot.say("You can only lend to another user")
+            # Move the karma and net the debt in one go
+            spotted = spot_karma(ctx.bot.db, lender, borrower, amount, ctx.user.full_name, ctx.conversation.id_)
+            if spotted is None:
+                ctx.say("You're a bit too generous, friend. Don't lend what you don't have.")
                 return
-            # Check if there are pre-existing debts
-            debt_exists = self.bot.db.execute("SELECT COUNT(*) FROM debt WHERE lender = ? AND borrower = ?", (lender, borrower,))
-            debt_exists = debt_exists.fetchone()[0] > 0
-            if not debt_exists:
-                bot.db.execute("INSERT INTO debt VALUES(?, ?, 0)", (lender, borrower,))
-                bot.db.commit()
-            # Check if this is repaying an existing debt
-            change = amount
-            return_loan = self.bot.db.execute("SELECT COUNT(*) FROM debt WHERE lender = ? AND borrower = ?", (borrower, lender,))
-            return_loan = return_loan.fetchone()[0] > 0
-            if return_loan:
-                current_debt = self.bot.db.execute("SELECT amount FROM debt WHERE lender = ? AND borrower = ?", (borrower, lender,))
-                current_debt = current_debt.fetchone()[0]
-                if amount >= current_debt: # Debt was paid in full
-                    self.bot.db.execute("UPDATE debt SET amount = 0 WHERE lender = ? AND borrower = ?", (borrower, lender,))
-                    self.bot.db.commit()
-                    change -= current_debt
-                else: # Partial payment
-                    self.bot.db.execute("UPDATE debt SET amount = amount - ? WHERE lender = ? AND borrower = ?", (amount, borrower, lender,))
-                    self.bot.db.commit()
-                    self.bot.say("Gave {} karma to {}. You now owe them {} karma".format(amount, borrower_username, current_debt - amount))
-                    # Get subtract the given karma before we return
-                    self.bot.db.execute("UPDATE karma SET karma = karma - ? WHERE target = ?", (amount, lender,))
-                    self.bot.db.commit()
-                    return
-            # Apply the remaining changes
-            self.bot.db.execute("UPDATE debt SET amount = amount + ? WHERE lender = ? AND borrower = ?", (change, lender, borrower,))
-            self.bot.db.commit()
-            total_debt = self.bot.db.execute("SELECT amount FROM debt WHERE lender = ? AND borrower = ?", (lender, borrower,))
-            total_debt = total_debt.fetchone()[0]
-            self.bot.db.execute("UPDATE karma SET karma = karma - ? WHERE target = ?", (change, lender,))
-            self.bot.db.execute("UPDATE karma SET karma = karma + ? WHERE target = ?", (change, borrower,))
-            self.bot.db.commit()
-            self.bot.say("Spotted {} {} karma, they now owe you {}".format(borrower_username, amount, total_debt))
+            totals, balance = spotted
+            for target, (change, karma) in totals.items():
+                ctx.bot.honorifics.karma_changed(ctx.bot.db, target, karma)
+            # Debts are netted across the conversation, so report where the
+            # lender stands overall rather than with just the borrower
+            if balance > 0:
+                ctx.say("Spotted {} {} karma. After netting, you're owed {} karma here".format(
+                        borrower_username, amount, balance))
+            elif balance < 0:
+                ctx.say("Gave {} karma to {}. After netting, you still owe {} karma here".format(
+                        amount, borrower_username, -balance))
+            else:
+                ctx.say("Gave {} karma to {}. After netting, you owe and are owed nothing here".format(
+                        amount, borrower_username))
         except Exception as error:
-            self.bot.log.warn('Error in Spot:\n{}'.format(error))
+            ctx.bot.log.warn('Error in Spot:\n{}'.format(error))
 
 
 class ShowDebts(Command):
     """ Show Debts
-        List out all currently outstanding debts held in the database
+        List out the outstanding debts in the conversation, or just those
+        of one person, in a single message
     """
 
+    keywords = ['show', 'list']
+
     def __init__(self):
         self.help = """Show Debts - example 'Gambit: show debts'
-                       has the bot list out all current debts in the
-                       database where the current amount owed is
-                       greater than 0."""
+                       has the bot list out all current debts in this
+                       chat where the current amount owed is greater
+                       than 0, biggest first. Add someone's name
+                       ('gambit: show debts goofy') to only list the
+                       debts they're part of."""
         self.help_name = "show debts"
-        self.syntax = "gambit: show debts" 
+        self.syntax = "gambit: show debts [<person>]"
 
 
-    def parse(self, bot, message, user_priv):
-        if not bot.karma[bot.conversation.id_]:
-            self.parsed = False
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
             return False
-        re_debt = re.compile("^.*gambit[:,]? (show|list) debts.?!?\??.*$", re.IGNORECASE)
-        res = re_debt.match(message)
+        re_debt = re.compile("^.*gambit[:,]? (?:show|list) debts(?: (?:for |of )?(\w+))?[.!?]*$", re.IGNORECASE)
+        res = re_debt.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['person'] = res.groups()[0]
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info('Executing Show Debts')
-            debts = self.bot.db.execute('SELECT * FROM debt')
-            for debt in debts.fetchall():
-                if debt[2] > 0:
-                    self.bot.say("{} owes {} {} karma.".format(debt[1],debt[0],debt[2]))
+            ctx.bot.log.info('Executing Show Debts')
+            person = ctx.args['person']
+            if person is not None:
+                person = resolve_alias(ctx.bot.db, person)
+            debts = get_debts(ctx.bot.db, ctx.conversation.id_, person)
+            if not debts:
+                ctx.say("Nobody owes anybody anything.")
+                return
+            lines = ["{} owes {} {} karma.".format(borrower, lender, amount)
+                    for lender, borrower, amount in debts[:max_debt_lines]]
+            if len(debts) > max_debt_lines:
+                lines.append("...and {} more".format(len(debts) - max_debt_lines))
+            ctx.say('\n'.join(lines))
         except Exception as error:
-            self.bot.log.warn('Error in Show Debts:\n{}'.format(error))
+            ctx.bot.log.warn('Error in Show Debts:\n{}'.format(error))
 
 
 class GetTopKarma(Command):
     """ Get Top Karma
         Find the entity in the database with the highest karma value and
-        tell everyone how its the best thing ever
+        tell everyone how its the best thing ever, or list the top few
     """
 
+    keywords = ['top', 'highest']
+
     def __init__(self):
         self.help = """Top Karma Command - example 'gambit: top karma'
                        Has the bot state what entity has the highest
-                       karma in the database."""
+                       karma in the database. Give a number ('gambit:
+                       top 5 karma') to list that many, and end with
+                       'here' to only count people in this chat."""
         self.help_name = "top karma"
-        self.syntax = "gambit: top karma"
+        self.syntax = "gambit: top karma, gambit: top <count> karma [here]"
 
 
 
-    def parse(self, bot, message, user_priv):
-        if not bot.karma[bot.conversation.id_]:
-            self.parsed = False
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
             return False
-        re_top = re.compile('^.*gambit[:,]? (top|highest) karma.?!?\??.*$', re.IGNORECASE)
-        res = re_top.match(message)
+        re_top = re.compile('^.*gambit[:,]? (?:top|highest)(?: (\d+))? karma( here)?.?!?\??.*$', re.IGNORECASE)
+        res = re_top.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        count, here = res.groups()
+        ctx.args['count'] = int(count) if count else None
+        ctx.args['here'] = here is not None
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Get Top Karma")
-            karma = self.bot.db.execute("SELECT target, karma  FROM karma")
-            karma = karma.fetchall()
-            top_target = None
-            top_karma = 0
-            for pair in karma:
-                if not top_target or pair[1] > top_karma:
-                    top_target = pair[0]
-                    top_karma = pair[1]
-            self.bot.say("The current best thing ever is {} with {} karma".format(top_target, top_karma))
+            ctx.bot.log.info("Executing Get Top Karma")
+            scope = ctx.conversation.id_ if ctx.args['here'] else None
+            count = min(ctx.args['count'] or 1, max_leaderboard)
+            top = leaderboard.top(ctx.bot.db, count, scope)
+            if not top:
+                ctx.say("Nobody has any karma yet")
+            elif ctx.args['count'] is None:
+                ctx.say("The current best thing ever is {} with {} karma".format(top[0][0], top[0][1]))
+            else:
+                ctx.say(format_leaderboard(top, 1))
         except Exception as error:
-            self.bot.log.warn("Error in Get Top Karma:\n{}".format(error))
+            ctx.bot.log.warn("Error in Get Top Karma:\n{}".format(error))
+
+
+class GetBottomKarma(Command):
+    """ Get Bottom Karma
+        List the entities in the database with the least karma
+    """
+
+    keywords = ['bottom', 'lowest']
+
+    def __init__(self):
+        self.help = """Bottom Karma Command - example 'gambit: bottom 5
+                       karma' Has the bot list the entities with the
+                       least karma in the database, worst first. End
+                       with 'here' to only count people in this chat."""
+        self.help_name = "bottom karma"
+        self.syntax = "gambit: bottom [<count>] karma [here]"
+
+
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
+            return False
+        re_bottom = re.compile('^.*gambit[:,]? (?:bottom|lowest)(?: (\d+))? karma( here)?.?!?\??.*$', re.IGNORECASE)
+        res = re_bottom.match(ctx.text)
+        if res is None:
+            return False
+        count, here = res.groups()
+        ctx.args['count'] = int(count) if count else 1
+        ctx.args['here'] = here is not None
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Get Bottom Karma")
+            scope = ctx.conversation.id_ if ctx.args['here'] else None
+            bottom = leaderboard.bottom(ctx.bot.db, min(ctx.args['count'], max_leaderboard), scope)
+            if not bottom:
+                ctx.say("Nobody has any karma yet")
+                return
+            ctx.say(format_leaderboard(bottom, None))
+        except Exception as error:
+            ctx.bot.log.warn("Error in Get Bottom Karma:\n{}".format(error))
+
+
+class GetKarmaRank(Command):
+    """ Get Karma Rank
+        State where a target ranks by karma and who is just above and
+        below them
+    """
+
+    keywords = ['rank']
+
+    def __init__(self):
+        self.help = """Karma Rank Command - example 'gambit: rank poop'
+                       Has the bot state where an entity ranks by karma
+                       and who is just ahead of and behind it. End with
+                       'here' to only count people in this chat."""
+        self.help_name = "karma rank"
+        self.syntax = "gambit: rank <target> [here], gambit: rank (<multiword target>) [here]"
+
+
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
+            return False
+        re_rank = re.compile('^gambit[:,]? rank ((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\))( here)?[.!?]?$', re.IGNORECASE)
+        res = re_rank.match(ctx.text)
+        if res is None:
+            return False
+        target, here = res.groups()
+        ctx.args['target'] = target.replace('(', '').replace(')', '')
+        ctx.args['here'] = here is not None
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Get Karma Rank")
+            scope = ctx.conversation.id_ if ctx.args['here'] else None
+            target = resolve_alias(ctx.bot.db, ctx.args['target'])
+            rank = leaderboard.rank(ctx.bot.db, target, scope)
+            if rank is None:
+                ctx.say("{} isn't ranked".format(target))
+                return
+            target, karma, place = rank
+            above, below = leaderboard.neighbors(ctx.bot.db, target, scope)
+            response = "{} is #{} with {} karma".format(target, place, karma)
+            if above:
+                response += ", behind {} ({})".format(above[0], above[1])
+            if below:
+                response += ", ahead of {} ({})".format(below[0], below[1])
+            ctx.say(response)
+        except Exception as error:
+            ctx.bot.log.warn("Error in Get Karma Rank:\n{}".format(error))
+
+
+def format_leaderboard(entries, first):
+    """ Format Leaderboard
+        Put a list of (target, karma) pairs one to a line, numbered from
+        the given rank if there is one
+    """
+    lines = []
+    for i, (target, karma) in enumerate(entries):
+        if first is None:
+            lines.append("{}: {}".format(target, karma))
+        else:
+            lines.append("{}. {}: {}".format(first + i, target, karma))
+    return "\n".join(lines)
+
+
+class GetKarmaHistory(Command):
+    """ Get Karma History
+        State how a target's karma has changed, day by day, over the
+        last so many days
+    """
+
+    keywords = ['history', 'karma']
+
+    def __init__(self):
+        self.help = """Karma History Command - example 'gambit: history
+                       poop 7' Has the bot state how much karma an
+                       entity gained and lost over the last week (or
+                       however many days are given, 30 by default)."""
+        self.help_name = "karma history"
+        self.syntax = "gambit: history <target> [<days>], gambit: history (<multiword target>) [<days>]"
+
+
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
+            return False
+        re_history = re.compile('^gambit[:,]? (?:karma )?history ((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\))(?: (\d+))?[.!?]?$', re.IGNORECASE)
+        res = re_history.match(ctx.text)
+        if res is None:
+            return False
+        target, days = res.groups()
+        ctx.args['target'] = target.replace('(', '').replace(')', '')
+        ctx.args['days'] = min(int(days), max_history_days) if days else 30
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Get Karma History")
+            target = resolve_alias(ctx.bot.db, ctx.args['target'])
+            days = max(ctx.args['days'], 1)
+            history = karma_history(ctx.bot.db, target, days)
+            if not history:
+                ctx.say("{} hasn't had any karma changes in the last {} days".format(target, days))
+                return
+            gained = sum(day[1] for day in history)
+            lost = sum(day[2] for day in history)
+            response = "Karma for {} over the last {} days: +{}/-{} (net {})".format(
+                    target, days, gained, lost, gained - lost)
+            for day, day_gained, day_lost in history[:max_history_lines]:
+                response += "\n{}: +{}/-{}".format(day, day_gained, day_lost)
+            ctx.say(response)
+        except Exception as error:
+            ctx.bot.log.warn("Error in Get Karma History:\n{}".format(error))
+
+
+class GetTopGivers(Command):
+    """ Get Top Givers
+        State who has given a target the most karma over the last so
+        many days
+    """
+
+    keywords = ['top']
+
+    def __init__(self):
+        self.help = """Top Givers Command - example 'gambit: top givers
+                       poop' Has the bot list who has given an entity
+                       the most karma over the last 30 days (or however
+                       many days are given)."""
+        self.help_name = "top givers"
+        self.syntax = "gambit: top givers <target> [<days>], gambit: top givers (<multiword target>) [<days>]"
+
+
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
+            return False
+        re_givers = re.compile('^gambit[:,]? top givers (?:to |for )?((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\))(?: (\d+))?[.!?]?$', re.IGNORECASE)
+        res = re_givers.match(ctx.text)
+        if res is None:
+            return False
+        target, days = res.groups()
+        ctx.args['target'] = target.replace('(', '').replace(')', '')
+        ctx.args['days'] = min(int(days), max_history_days) if days else 30
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Get Top Givers")
+            target = resolve_alias(ctx.bot.db, ctx.args['target'])
+            days = max(ctx.args['days'], 1)
+            givers = top_givers(ctx.bot.db, target, days, 5)
+            if not givers:
+                ctx.say("Nobody has given {} karma in the last {} days".format(target, days))
+                return
+            response = "Top givers to {} over the last {} days:".format(target, days)
+            for i, (actor, gained, lost) in enumerate(givers):
+                response += "\n{}. {}: +{}/-{}".format(i + 1, actor, gained, lost)
+            ctx.say(response)
+        except Exception as error:
+            ctx.bot.log.warn("Error in Get Top Givers:\n{}".format(error))
+
+
+class RebuildKarma(Command):
+    """ Rebuild Karma
+        Admin only. Recompute every karma total from the karma ledger
+    """
+
+    keywords = ['rebuild']
+
+    def __init__(self):
+        self.cmd_priv = float('inf')
+
+
+    def parse(self, ctx):
+        re_rebuild = re.compile("^gambit[:,]? rebuild karma.?$", re.IGNORECASE)
+        res = re_rebuild.match(ctx.text)
+        if res is None:
+            return False
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Rebuild Karma")
+            wrong = rebuild_karma(ctx.bot.db)
+            for conversation_id in list(ctx.bot.honorifics.rooms):
+                ctx.bot.honorifics.load(ctx.bot.db, conversation_id)
+            ctx.say("Rebuilt karma from the ledger, fixed {} totals".format(wrong))
+        except Exception as error:
+            ctx.bot.log.warn("Error in Rebuild Karma:\n{}".format(error))
 
 
 class GetRandomKarma(Command):
@@ -380,6 +574,8 @@ class GetRandomKarma(Command):
         chat
     """
 
+    keywords = ['random']
+
     def __init__(self):
         self.help = """Random Karma Command - example 'gambit: random
                        karma' Has the bot state some randomly selected
@@ -388,32 +584,27 @@ class GetRandomKarma(Command):
         self.syntax = "gambit: random karma"
 
 
-    def parse(self, bot, message, user_priv):
-        if not bot.karma[bot.conversation.id_]:
-            self.parsed = False
+    def parse(self, ctx):
+        if not ctx.bot.karma[ctx.conversation.id_]:
             return False
         re_rand = re.compile('^.*gambit[:,]? random karma.?!?\??.*$', re.IGNORECASE)
-        res = re_rand.match(message)
+        res = re_rand.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Get Random Karma")
-            karma = self.bot.db.execute("SELECT target, karma FROM karma")
-            karma = karma.fetchall()
-            rand_karma = karma[randint(0, len(karma)-1)]
-            self.bot.say("Karma for {} is {}".format(rand_karma[0], rand_karma[1]))
+            ctx.bot.log.info("Executing Get Random Karma")
+            rand_karma = sampler.choice(ctx.bot.db, 'karma', 'target, karma')
+            if rand_karma is None:
+                ctx.say("Nobody has any karma yet")
+                return
+            ctx.say("Karma for {} is {}".format(rand_karma[0], rand_karma[1]))
         except Exception as error:
-            self.bot.log.warn("Error in Get Random Karma:\n{}".format(error))
+            ctx.bot.log.warn("Error in Get Random Karma:\n{}".format(error))
 
 
 class EnableKarma(Command):
@@ -422,32 +613,29 @@ class EnableKarma(Command):
         chat
     """
 
+    keywords = ['yes', 'yeskarma']
+
     def __init__(self):
         self.cmd_priv = float('inf')
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_enable = re.compile("^gambit[:,]? yes\s?karma.?$", re.IGNORECASE)
-        res = re_enable.match(message)
+        res = re_enable.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Enable Karma")
-            if not self.bot.karma[self.bot.conversation.id_]:
-                self.bot.say("Enabling karma...")
-            self.bot.karma[self.bot.conversation.id_] = True
+            ctx.bot.log.info("Executing Enable Karma")
+            if not ctx.bot.karma[ctx.conversation.id_]:
+                ctx.say("Enabling karma...")
+            ctx.bot.karma[ctx.conversation.id_] = True
         except Exception as error:
-            self.bot.log.warn("Error in Enable Karma:\n{}".format(error))
+            ctx.bot.log.warn("Error in Enable Karma:\n{}".format(error))
 
 
 class DisableKarma(Command):
@@ -456,29 +644,26 @@ class DisableKarma(Command):
         chat
     """
 
+    keywords = ['no', 'nokarma']
+
     def __init__(self):
         self.cmd_priv = float('inf')
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_disable = re.compile("^gambit[:,]? no\s?karma.?$", re.IGNORECASE)
-        res = re_disable.match(message)
+        res = re_disable.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Disable Karma")
-            if self.bot.karma[self.bot.conversation.id_]:
-                self.bot.say("Disabling karma...")
-            self.bot.karma[self.bot.conversation.id_] = False
+            ctx.bot.log.info("Executing Disable Karma")
+            if ctx.bot.karma[ctx.conversation.id_]:
+                ctx.say("Disabling karma...")
+            ctx.bot.karma[ctx.conversation.id_] = False
         except Exception as error:
-            self.bot.log.warn("Error in Disable Karma:\n{}".format(error))
+            ctx.bot.log.warn("Error in Disable Karma:\n{}".format(error))
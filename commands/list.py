@@ -1,34 +1,77 @@
 import re
 from hangups.bot.commands.command import Command
 
+commands_per_page = 15 # Most commands listed at once
+
+
 class ListCommands(Command):
     """ List Commands
-        Print out the basic syntax for every command the bot
-        knows
+        Print out the basic syntax for every command the caller can
+        run, a page at a time
     """
 
-    def parse(self, bot, message, user_priv):
-        re_list = re.compile("^gambit[:,]? (show|list) commands$", re.IGNORECASE)
-        res = re_list.match(message)
+    keywords = ['show', 'list']
+
+    def parse(self, ctx):
+        re_list = re.compile("^gambit[:,]? (?:show|list) commands(?: page (\d+))?$", re.IGNORECASE)
+        res = re_list.match(ctx.text)
+        if res is None:
+            return False
+        page = res.groups()[0]
+        ctx.args['page'] = max(int(page), 1) if page is not None else 1
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing List Commands.")
+            syntaxes = ctx.bot.catalog.syntaxes(ctx.user_priv)
+            pages = max((len(syntaxes) + commands_per_page - 1) // commands_per_page, 1)
+            if ctx.args['page'] > pages:
+                ctx.say("That's past the last page of commands ({})".format(pages))
+                return
+            start = (ctx.args['page'] - 1) * commands_per_page
+            response = '\n'.join(syntaxes[start:start + commands_per_page])
+            if pages > 1:
+                response = "Commands, page {} of {} ('gambit: list commands page <number>' for more):\n".format(
+                        ctx.args['page'], pages) + response
+            ctx.say(response)
+        except Exception as error:
+            ctx.bot.log.warn("Error in list commands:\n{}".format(error))
+
+
+class ShowStats(Command):
+    """ Show Stats
+        Print out the bot's running counters, like how often its
+        caches are hit
+    """
+
+    keywords = ['show', 'stats']
+
+    def __init__(self):
+        self.help = """Show Stats Command - example 'gambit show stats'.
+                       Outputs the bot's counters since it started."""
+        self.help_name = "show stats"
+        self.syntax = "gambit: show stats"
+
+
+    def parse(self, ctx):
+        re_stats = re.compile("^gambit[:,]? (?:show )?stats$", re.IGNORECASE)
+        res = re_stats.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing List Commands.")
-            response = ''
-            for command in self.bot.cmd_list:
-                syntax = command.syntax
-                if syntax is not None:
-                    response += syntax + "\n"
-            self.bot.say(response)
+            ctx.bot.log.info("Executing Show Stats.")
+            stats = sorted(ctx.bot.stats.items())
+            if not stats:
+                ctx.say("Nothing to report yet")
+                return
+            ctx.say('\n'.join("{}: {}".format(name, count) for name, count in stats))
         except Exception as error:
-            self.bot.log.warn("Error in list commands:\n{}".format(error))
+            ctx.bot.log.warn("Error in show stats:\n{}".format(error))
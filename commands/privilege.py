@@ -10,6 +10,8 @@ class SetUserPrivilege(Command):
         privilege values in the privilege database
     """
 
+    keywords = ['set']
+
     def __init__(self):
         self.help = """Set User Privilege Command - example 'gambit
                        set user privilege brad 10'. Updates the
@@ -20,47 +22,42 @@ class SetUserPrivilege(Command):
         self.syntax = "gambit: set user privilege <user> <level>"
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_set = re.compile('^gambit[:,]? set user (?:priv|privilege) (\w+) (\d+)[.!\?]?$', re.IGNORECASE)
-        res = re_set.match(message)
+        res = re_set.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['user'], self.cmd_args['priv'] = res.groups()
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
+        ctx.args['user'], ctx.args['priv'] = res.groups()
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
+    def execute(self, ctx):
         # Get the current user privilege of the desired user
         try:
-            self.bot.log.info("Executing Set User Privilege")
-            user = resolve_alias(self.bot.db, self.cmd_args['user'])
-            user = resolve_full(self.bot.db, user)
-            current_priv = get_privilege(self.bot.db, user, self.bot.conversation)
+            ctx.bot.log.info("Executing Set User Privilege")
+            user = resolve_alias(ctx.bot.db, ctx.args['user'])
+            user = resolve_full(ctx.bot.db, user)
+            current_priv = get_privilege(ctx.bot.db, user, ctx.conversation)
             if current_priv is None:
-                self.bot.say("{} is not a valid user".format(self.cmd_args['user']))
+                ctx.say("{} is not a valid user".format(ctx.args['user']))
                 return
-            if self.user_priv <= current_priv:
-                self.bot.say("{} has a higher privilege than you can change.".format(self.cmd_args['user']))
+            if ctx.user_priv <= current_priv:
+                ctx.say("{} has a higher privilege than you can change.".format(ctx.args['user']))
                 return
-            new_priv = int(self.cmd_args['priv'])
-            if new_priv > self.user_priv:
-                self.bot.say("You can't give someone higher privilege than you have.")
+            new_priv = int(ctx.args['priv'])
+            if new_priv > ctx.user_priv:
+                ctx.say("You can't give someone higher privilege than you have.")
                 return
             if new_priv < 0:
-                self.bot.say("Don't be a dick. You can't give someone negative privilege.")
+                ctx.say("Don't be a dick. You can't give someone negative privilege.")
                 return
             # If we've reached this point the change is valid
-            self.bot.db.execute("UPDATE users SET privilege = ? WHERE full_name = ? AND conversation_id = ?",
-                    (new_priv, user, self.bot.conversation.id_))
-            self.bot.db.commit()
-            self.bot.say("Gave {} a privilege of {}".format(self.cmd_args['user'], new_priv))
+            ctx.bot.db.execute("UPDATE users SET privilege = ? WHERE full_name = ? AND conversation_id = ?",
+                    (new_priv, user, ctx.conversation.id_))
+            ctx.bot.db.commit()
+            ctx.say("Gave {} a privilege of {}".format(ctx.args['user'], new_priv))
         except Exception as error:
-            self.bot.log.warn("Error in Set User Privilege:\n{}".format(error))
+            ctx.bot.log.warn("Error in Set User Privilege:\n{}".format(error))
 
 
 class GetUserPrivilege(Command):
@@ -69,6 +66,8 @@ class GetUserPrivilege(Command):
         a given user
     """
 
+    keywords = ['get']
+
 
     def __init__(self):
         self.help = """Get User Privilege Command - example 'gambit
@@ -78,34 +77,29 @@ class GetUserPrivilege(Command):
         self.syntax = "gambit: get user privilege <user>"
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_get = re.compile('^gambit[:,]? get user (?:priv|privilege) (\w+)[.!\?]?$', re.IGNORECASE)
-        res = re_get.match(message)
+        res = re_get.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['user'] = res.groups()[0]
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
+        ctx.args['user'] = res.groups()[0]
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         # Get the current user privilege of the desired user
         try:
-            self.bot.log.info("Executing Get User Privilege")
-            user = resolve_alias(self.bot.db, self.cmd_args['user'])
-            user = resolve_full(self.bot.db, user)
-            current_priv = get_privilege(self.bot.db, user, self.bot.conversation)
+            ctx.bot.log.info("Executing Get User Privilege")
+            user = resolve_alias(ctx.bot.db, ctx.args['user'])
+            user = resolve_full(ctx.bot.db, user)
+            current_priv = get_privilege(ctx.bot.db, user, ctx.conversation)
             if current_priv is None:
-                self.bot.say("{} is not a valid user".format(self.cmd_args['user']))
+                ctx.say("{} is not a valid user".format(ctx.args['user']))
                 return
-            self.bot.say("Privilege for {} is {}".format(self.cmd_args['user'], current_priv))
+            ctx.say("Privilege for {} is {}".format(ctx.args['user'], current_priv))
         except Exception as error:
-            self.bot.log.warn("Error in Get User Privilege:\n{}".format(error))
+            ctx.bot.log.warn("Error in Get User Privilege:\n{}".format(error))
 
 
 class SetCommandPrivilege(Command):
@@ -114,6 +108,8 @@ class SetCommandPrivilege(Command):
         of equal or higher privilege can use it.
     """
 
+    keywords = ['set']
+
     def __init__(self):
         self.help = """Set Command Privilege Command - example 'gambit
                        set command privilege wat 10'. Updates the
@@ -124,40 +120,31 @@ class SetCommandPrivilege(Command):
         self.cmd_priv = float('inf')
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_set = re.compile("^gambit[:,]? set (?:cmd|command) (?:priv|privilege) ((?:(?:\w+) )*(?:\w+)) (\d+)[.!\?]?$", re.IGNORECASE)
-        res = re_set.match(message)
+        res = re_set.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['cmd'], self.cmd_args['priv'] = res.groups()
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
+        ctx.args['cmd'], ctx.args['priv'] = res.groups()
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Set Command Privilege")
-            cmd = None
-            for command in self.bot.cmd_list.keys():
-                if command.help_name == self.cmd_args['cmd'] or\
-                        command.__class__.__name__ == self.cmd_args['cmd']:
-                    cmd = command.__class__.__name__
-                    break
+            ctx.bot.log.info("Executing Set Command Privilege")
+            cmd = ctx.bot.catalog.find(ctx.args['cmd'])
             if cmd is None:
-                self.bot.say("{} is not a valid command".format(self.cmd_args['cmd']))
+                ctx.say("{} is not a valid command".format(ctx.args['cmd']))
                 return
-            new_priv = int(self.cmd_args['priv'])
-            self.bot.db.execute("UPDATE commands SET privilege = ? WHERE name = ?", (new_priv, cmd,))
-            self.bot.db.commit()
-            self.bot.cmd_list[self] = new_priv
-            self.bot.say("Set privilege of {} to {}".format(self.cmd_args['cmd'], new_priv))
+            new_priv = int(ctx.args['priv'])
+            ctx.bot.db.execute("UPDATE commands SET privilege = ? WHERE name = ?", (new_priv, cmd.name,))
+            ctx.bot.db.commit()
+            ctx.bot.cmd_list[cmd] = new_priv
+            ctx.bot.catalog.build(ctx.bot.cmd_list)
+            ctx.say("Set privilege of {} to {}".format(ctx.args['cmd'], new_priv))
         except Exception as error:
-            self.bot.log.warn("Error in Set Command Privilege:\n{}".format(error))
+            ctx.bot.log.warn("Error in Set Command Privilege:\n{}".format(error))
 
 
 class GetCommandPrivilege(Command):
@@ -166,6 +153,8 @@ class GetCommandPrivilege(Command):
         a given command
     """
 
+    keywords = ['get']
+
 
     def __init__(self):
         self.help = """Get Command Privilege Command - example 'gambit
@@ -176,35 +165,25 @@ class GetCommandPrivilege(Command):
 
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_get = re.compile("^gambit[:,]? get (?:cmd|command) (?:priv|privilege) ((?:(?:\w+) )*(?:\w+))[.!\?]?$", re.IGNORECASE)
-        res = re_get.match(message)
+        res = re_get.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['cmd'] = res.groups()[0]
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
+        ctx.args['cmd'] = res.groups()[0]
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Get Command Privilege")
-            cmd = None
-            for command in self.bot.cmd_list.keys():
-                if command.help_name == self.cmd_args['cmd'] or\
-                        command.__class__.__name__ == self.cmd_args['cmd']:
-                    cmd = command.__class__.__name__
-                    break
+            ctx.bot.log.info("Executing Get Command Privilege")
+            cmd = ctx.bot.catalog.find(ctx.args['cmd'])
             if cmd is None:
-                self.bot.say("{} is not a valid command".format(self.cmd_args['cmd']))
+                ctx.say("{} is not a valid command".format(ctx.args['cmd']))
                 return
-            current_priv = self.bot.db.execute("SELECT privilege FROM commands WHERE name = ?", (cmd,))
+            current_priv = ctx.bot.db.execute("SELECT privilege FROM commands WHERE name = ?", (cmd.name,))
             current_priv = current_priv.fetchone()[0]
-            self.bot.say("Privilege for {} is {}".format(self.cmd_args['cmd'], current_priv))
+            ctx.say("Privilege for {} is {}".format(ctx.args['cmd'], current_priv))
         except Exception as error:
-            self.bot.log.warn("Error in Get Command Privilege:\n{}".format(error))
+            ctx.bot.log.warn("Error in Get Command Privilege:\n{}".format(error))
@@ -1,69 +1,69 @@
 import re
 from util import *
-from random import randint
+from datetime import datetime
 from hangups.bot.commands.command import Command
 
+quotes_per_page = 5 # Most quotes a search lists at once
+
+
+def format_quote(quote, said_by, said_at):
+    """ Format Quote
+        Attribute a quote to who said it and the month and year they said it
+    """
+    said_at = datetime.strptime(said_at.split(' ')[0], '%Y-%m-%d')
+    return '"{}" - {}, {}'.format(quote, said_by, said_at.strftime('%B %Y'))
+
+
 class CreateQuote(Command):
     """ Create Quote
         Take the last statement made by a given person in chat and save it
         into the quotes database.
     """
 
+    keywords = ['quote']
+
     def __init__(self):
         self.help = """Create Quote Command - example 'gambit: quote
                        Mess' saves a quote from a given user in the
                        database to be stated later through the random 
-                       quote command."""
+                       quote command. Add a number to quote something
+                       they said before that, 'gambit: quote Mess 2'
+                       quotes their second to last message."""
         self.help_name = "quote"
-        self.syntax = "gambit: quote <person>"
+        self.syntax = "gambit: quote <person> [<how many messages back>]"
 
 
-    def parse(self, bot, message, user_priv):
-        re_add = re.compile("^(?:gambit[:,]? )?quote (.+)$", re.IGNORECASE)
-        res = re_add.match(message)
-        if res is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_add = re.compile("^(?:gambit[:,]? )?quote (.+?)(?: (\d+))?$", re.IGNORECASE)
+        res = re_add.match(ctx.text)
+        if res is None or res.groups()[0].startswith('#'):
             return False
-        self.cmd_args['user'] = res.groups()[0]
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['user'], back = res.groups()
+        ctx.args['back'] = int(back) if back is not None else 1
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Create Quote")
-            name = resolve_alias(self.bot.db, self.cmd_args['user'])
-            name = resolve_full(self.bot.db, name)
-            if name not in self.bot.last_message.keys():
-                self.bot.say("I don't know what they said.")
+            ctx.bot.log.info("Executing Create Quote")
+            name = resolve_alias(ctx.bot.db, ctx.args['user'])
+            name = resolve_full(ctx.bot.db, name)
+            # Only quote what was said in this conversation
+            said = ctx.bot.history.last(ctx.conversation.id_, name, ctx.args['back'])
+            if said is None:
+                ctx.say("I don't know what they said.")
                 return
-            quote = self.bot.last_message[name]
-            self.bot.db.execute("INSERT INTO quotes (quote, said_by) VALUES(?, ?)", (quote, name,))
-            self.bot.db.commit()
-            res = self.bot.db.execute("SELECT quote, said_by, said_at FROM quotes WHERE quote = ?", (quote,))
-            res = res.fetchall()[0]
-            date = res[2].split(' ')[0] # Get just the date in YYYY-MM-DD
-            re_date = re.compile('^(\d{4})-(\d{1,2})-(\d{1,2})$')
-            year, month, dat = re_date.match(date).groups()
-            month = {'01': 'January',
-                     '02': 'February',
-                     '03': 'March',
-                     '04': 'April',
-                     '05': 'May',
-                     '06': 'June',
-                     '07': 'July',
-                     '08': 'August',
-                     '09': 'September',
-                     '10': 'October',
-                     '11': 'November',
-                     '12': 'December'}[month]
-            self.bot.say('"{}" - {}, {} {}'.format(res[0], res[1], month, year))
+            quote = said.text
+            cursor = ctx.bot.db.execute("INSERT INTO quotes (quote, said_by) VALUES(?, ?)", (quote, name,))
+            ctx.bot.db.commit()
+            sampler.added(ctx.bot.db, 'quotes', cursor.lastrowid)
+            # Read back exactly the row we just added
+            res = ctx.bot.db.execute("SELECT quote, said_by, said_at FROM quotes WHERE quote_id = ?",
+                    (cursor.lastrowid,)).fetchone()
+            ctx.say(format_quote(*res))
         except Exception as error:
-            self.bot.log.warn("Error in Create Quote:\n{}".format(error))
+            ctx.bot.log.warn("Error in Create Quote:\n{}".format(error))
 
 
 class SayRandomQuote(Command):
@@ -72,6 +72,8 @@ class SayRandomQuote(Command):
         specific user
     """
 
+    keywords = ['rand', 'random']
+
     def __init__(self):
         self.help = """Random Quote Command - example 'gambit: random
                        quote' have the bot state a random quote from
@@ -82,52 +84,147 @@ class SayRandomQuote(Command):
         self.syntax = "gambit: random quote, gambit: random <person> quote"
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_say = re.compile("^gambit[:,]? (?:rand|random) (\w+)? ?quote.?!?\??", re.IGNORECASE)
-        res = re_say.match(message)
+        res = re_say.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
         user = res.groups()[0]
         if user:
-            self.cmd_args['user'] = user
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+            ctx.args['user'] = user
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Say Random Quote with args {}".format(self.cmd_args))
-            if 'user' in self.cmd_args.keys():
-                name = resolve_alias(self.bot.db, self.cmd_args['user'])
-                name = resolve_full(self.bot.db, name)
-                res = self.bot.db.execute("SELECT quote, said_by, said_at FROM quotes WHERE said_by = ?", (name,))
+            ctx.bot.log.info("Executing Say Random Quote with args {}".format(ctx.args))
+            if 'user' in ctx.args.keys():
+                name = resolve_alias(ctx.bot.db, ctx.args['user'])
+                name = resolve_full(ctx.bot.db, name)
+                selected = sampler.choice(ctx.bot.db, 'quotes', 'quote, said_by, said_at',
+                        "WHERE said_by = ? COLLATE NOCASE", (name,), bag=ctx.conversation.id_)
             else:
-                res = self.bot.db.execute("SELECT quote, said_by, said_at FROM quotes")
-            quotes = res.fetchall()
-            if len(quotes) == 0:
-                self.bot.say("I couldn't find a quote!")
+                selected = sampler.choice(ctx.bot.db, 'quotes', 'quote, said_by, said_at',
+                        bag=ctx.conversation.id_)
+            if selected is None:
+                ctx.say("I couldn't find a quote!")
                 return
-            selected = quotes[randint(0, len(quotes) - 1)]
-            date = selected[2].split(' ')[0]
-            re_date = re.compile('^(\d{4})-(\d{1,2})-(\d{1,2})$')
-            year, month, date = re_date.match(date).groups()
-            month = {'01': 'January',
-                     '02': 'February',
-                     '03': 'March',
-                     '04': 'April',
-                     '05': 'May',
-                     '06': 'June',
-                     '07': 'July',
-                     '08': 'August',
-                     '09': 'September',
-                     '10': 'October',
-                     '11': 'November',
-                     '12': 'December'}[month]
-            self.bot.say('"{}" - {}, {} {}'.format(selected[0], selected[1], month, year))
+            ctx.say(format_quote(*selected))
         except Exception as error:
-            self.bot.log.warn("Error in Say Random Quote:\n{}".format(error))
+            ctx.bot.log.warn("Error in Say Random Quote:\n{}".format(error))
+
+
+class GetQuote(Command):
+    """ Get Quote
+        State a quote by its number, as listed by quote searches
+    """
+
+    keywords = ['quote']
+
+    def __init__(self):
+        self.help = """Get Quote Command - example 'gambit: quote #12'
+                       have the bot state the quote with the given
+                       number. Quote searches list each quote's
+                       number."""
+        self.help_name = "get quote"
+        self.syntax = "gambit: quote #<number>"
+
+
+    def parse(self, ctx):
+        re_get = re.compile("^(?:gambit[:,]? )?quote #(\d+)$", re.IGNORECASE)
+        res = re_get.match(ctx.text)
+        if res is None:
+            return False
+        ctx.args['quote_id'] = int(res.groups()[0])
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Get Quote")
+            res = ctx.bot.db.execute("SELECT quote, said_by, said_at FROM quotes WHERE quote_id = ?",
+                    (ctx.args['quote_id'],)).fetchone()
+            if res is None:
+                ctx.say("There's no quote #{}".format(ctx.args['quote_id']))
+                return
+            ctx.say(format_quote(*res))
+        except Exception as error:
+            ctx.bot.log.warn("Error in Get Quote:\n{}".format(error))
+
+
+class SearchQuotes(Command):
+    """ Search Quotes
+        Find the quotes containing some words through the full-text quote
+        index, best matches first, a page at a time
+    """
+
+    keywords = ['search']
+
+    def __init__(self):
+        self.help = """Search Quotes Command - example 'gambit: search
+                       quotes pie' lists the quotes with the word pie
+                       in them, best matches first. Narrow it down
+                       with 'by <person>', 'since <YYYY-MM-DD>' and
+                       'until <YYYY-MM-DD>', and see more with 'page
+                       <number>' (example: 'gambit: search quotes pie
+                       by mess since 2016-01-01 page 2'). End a word
+                       with * to match anything starting with it."""
+        self.help_name = "search quotes"
+        self.syntax = "gambit: search quotes <words> [by <person>] [since <date>] [until <date>] [page <number>]"
+
+
+    def parse(self, ctx):
+        re_search = re.compile("^gambit[:,]? search quotes? (.+?)(?: by (.+?))?" \
+                + "(?: since (\d{4}-\d{1,2}-\d{1,2}))?(?: until (\d{4}-\d{1,2}-\d{1,2}))?" \
+                + "(?: page (\d+))?$", re.IGNORECASE)
+        res = re_search.match(ctx.text)
+        if res is None:
+            return False
+        terms, user, since, until, page = res.groups()
+        ctx.args['terms'] = terms
+        ctx.args['user'] = user
+        try:
+            ctx.args['since'] = self._date(since)
+            ctx.args['until'] = self._date(until)
+        except ValueError:
+            return False
+        ctx.args['page'] = max(int(page), 1) if page is not None else 1
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Search Quotes with args {}".format(ctx.args))
+            name = None
+            if ctx.args['user'] is not None:
+                name = resolve_alias(ctx.bot.db, ctx.args['user'])
+                name = resolve_full(ctx.bot.db, name)
+            offset = (ctx.args['page'] - 1) * quotes_per_page
+            total, found = search_quotes(ctx.bot.db, ctx.args['terms'], name, ctx.args['since'],
+                    ctx.args['until'], offset, quotes_per_page)
+            if total == 0:
+                ctx.say("I couldn't find a quote!")
+                return
+            pages = (total + quotes_per_page - 1) // quotes_per_page
+            if not found:
+                ctx.say("That's past the last page of quotes ({})".format(pages))
+                return
+            response = "{} quotes found, page {} of {}:".format(total, ctx.args['page'], pages)
+            for quote_id, quote, said_by, said_at in found:
+                response += "\n#{} {}".format(quote_id, format_quote(quote, said_by, said_at))
+            ctx.say(response)
+        except Exception as error:
+            ctx.bot.log.warn("Error in Search Quotes:\n{}".format(error))
+
+
+    def _date(self, date):
+        """ Date
+            Normalise a YYYY-MM-DD date (which may leave out leading zeros)
+            for comparing against when quotes were said
+        """
+        if date is None:
+            return None
+        return datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
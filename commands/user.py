@@ -1,4 +1,6 @@
 import re
+
+from util import *
 from hangups.bot.commands.command import Command
 
 
@@ -8,46 +10,46 @@ class AddNickname(Command):
         their full name to their karma value
     """
 
+    keywords = ['nickname']
+
     def __init__(self):
         self.cmd_priv = float('inf')
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_add = re.compile("^gambit[:,]? nickname (\w+ \w+) ((?:\w|\d)+|\((?:(?:\w|\d)+ )*(?:\w|\d)+\))[.!\?]?$", re.IGNORECASE)
-        res = re_add.match(message)
+        res = re_add.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['full'], self.cmd_args['nick'] = res.groups()
-        self.bot = bot
-        self.message = message
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['full'], ctx.args['nick'] = res.groups()
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Add Nickname")
-            exists = self.bot.db.execute("SELECT COUNT(*) FROM users WHERE conversation_id = ? AND full_name = ?",
-                                         (self.bot.conversation.id_, self.cmd_args['full'],))
+            ctx.bot.log.info("Executing Add Nickname")
+            exists = ctx.bot.db.execute("SELECT COUNT(*) FROM users WHERE conversation_id = ? AND full_name = ?",
+                                         (ctx.conversation.id_, ctx.args['full'],))
             exists = exists.fetchone()[0] > 0
             if not exists:
-                self.bot.say("No user found with that name.")
+                ctx.say("No user found with that name.")
                 return
-            unique = self.bot.db.execute("SELECT COUNT(*) FROM users WHERE nickname = ?", (self.cmd_args['nick'],))
+            unique = ctx.bot.db.execute("SELECT COUNT(*) FROM users WHERE nickname = ? COLLATE NOCASE", (ctx.args['nick'],))
             unique = unique.fetchone()[0] == 0
             if not unique:
-                self.bot.say("Someone already exists with that nickname.")
+                ctx.say("Someone already exists with that nickname.")
                 return
-            self.bot.db.execute("UPDATE users SET nickname = ? WHERE conversation_id = ? AND full_Name = ?",
-                                (self.cmd_args['nick'], self.bot.conversation.id_, self.cmd_args['full'],))
-            self.bot.db.commit()
-            self.bot.say("Gave {} nickname {}".format(self.cmd_args['full'], self.cmd_args['nick']))
+            ctx.bot.db.execute("UPDATE users SET nickname = ? WHERE conversation_id = ? AND full_Name = ?",
+                                (ctx.args['nick'], ctx.conversation.id_, ctx.args['full'],))
+            ctx.bot.db.commit()
+            names.invalidate()
+            leaderboard.invalidate()
+            # Their karma now counts towards the conversation's honorifics
+            ctx.bot.honorifics.load(ctx.bot.db, ctx.conversation.id_)
+            ctx.say("Gave {} nickname {}".format(ctx.args['full'], ctx.args['nick']))
         except Exception as error:
-            self.bot.log.warn("Error in Add Nickname:\n{}".format(error))
+            ctx.bot.log.warn("Error in Add Nickname:\n{}".format(error))
 
 
 class ResolveUnknownUser(Command):
@@ -59,38 +61,37 @@ class ResolveUnknownUser(Command):
         provided full name.
     """
 
+    keywords = ['resolve']
+
     def __init__(self):
         self.cmd_priv = float('inf')
 
 
-    def parse(self, bot, message, user_priv):
+    def parse(self, ctx):
         re_resolve = re.compile('^gambit[:,]? resolve unknown (\w+ \w+)[.!\?]?$', re.IGNORECASE)
-        res = re_resolve.match(message)
+        res = re_resolve.match(ctx.text)
         if res is None:
-            self.parsed = False
             return False
-        self.cmd_args['name'] = res.groups()[0]
-        self.parsed = True
-        self.bot = bot
-        self.user_priv = user_priv
+        ctx.args['name'] = res.groups()[0]
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Resolve Unknown User")
-            exists = self.bot.db.execute("SELECT COUNT(*) FROM users WHERE conversation_id = ? AND full_name = ?",
-                    (self.bot.conversation.id_, self.cmd_args['name']))
+            ctx.bot.log.info("Executing Resolve Unknown User")
+            exists = ctx.bot.db.execute("SELECT COUNT(*) FROM users WHERE conversation_id = ? AND full_name = ?",
+                    (ctx.conversation.id_, ctx.args['name']))
             exists = exists.fetchone()[0] > 0
-            if exists or self.cmd_args['name'] in self.bot.ids[self.bot.conversation.id_]:
-                self.bot.say("A user with that name already exists.")
+            if exists or ctx.args['name'] in ctx.bot.ids[ctx.conversation.id_]:
+                ctx.say("A user with that name already exists.")
                 return
-            user_id = self.bot.ids[self.bot.conversation.id_]['Unknown']
-            self.bot.db.execute("INSERT INTO users (user_id, conversation_id, full_name) VALUES (?, ?, ?)",
-                    (user_id, self.bot.conversation.id_, self.cmd_args['name']))
-            self.bot.db.commit()
-            self.bot.say("Resolved User {}".format(self.cmd_args['name']))
+            user_id = ctx.bot.ids[ctx.conversation.id_]['Unknown']
+            ctx.bot.db.execute("INSERT INTO users (user_id, conversation_id, full_name) VALUES (?, ?, ?)",
+                    (user_id, ctx.conversation.id_, ctx.args['name']))
+            ctx.bot.db.commit()
+            names.invalidate()
+            leaderboard.invalidate()
+            ctx.say("Resolved User {}".format(ctx.args['name']))
         except Exception as error:
-            self.bot.log.warn("Error in Resolve Unknown User:\n{}".format(error))
+            ctx.bot.log.warn("Error in Resolve Unknown User:\n{}".format(error))
@@ -1,14 +1,614 @@
+import bisect
+import re
+import threading
+from collections import OrderedDict
+from random import randrange
+from time import time, gmtime, strftime
+
+
 def get_karma(db, target):
     """ Get Karma
         Return the current amount of karma for a given target, return the
         current value in the database. If the target is not in the database,
         return 0.
     """
-    karma = db.execute("SELECT target, karma FROM karma")
-    for pair in karma.fetchall():
-        if pair[0].lower() == target.lower():
-            return int(pair[1])
-    return 0
+    karma = db.execute("SELECT karma FROM karma WHERE target = ? COLLATE NOCASE", (target,))
+    karma = karma.fetchone()
+    if karma is None:
+        return 0
+    return int(karma[0])
+
+
+def get_karmas(db, targets):
+    """ Get Karmas
+        Look up the karma of several targets at once. Return a dictionary
+        of each target (lower case) to its karma, targets not in the
+        database have none
+    """
+    targets = list(targets)
+    if not targets:
+        return {}
+    marks = ', '.join('?' * len(targets))
+    res = db.execute("SELECT target, karma FROM karma WHERE target COLLATE NOCASE IN ({})".format(marks),
+            targets)
+    return {target.lower(): karma for target, karma in res.fetchall()}
+
+
+def change_karma(db, changes, actor=None, source='karma', conversation_id=None):
+    """ Change Karma
+        Apply a list of (target, change) pairs to the karma table in a single
+        transaction. Changes to the same target (regardless of case) are
+        added together first. Each change is also recorded in the karma
+        ledger, under who made it, what made it (karma, spot, high-low...)
+        and where, and added to the daily rollups. Return an ordered
+        dictionary of each target to its (total change, new karma)
+    """
+    deltas = _sum_changes(changes)
+    if not deltas:
+        return OrderedDict()
+    with db:
+        _write_karma(db, deltas, actor, source, conversation_id)
+    return _karma_totals(db, deltas)
+
+
+def _sum_changes(changes):
+    deltas = OrderedDict()
+    for target, change in changes:
+        key = target.lower()
+        if key not in deltas:
+            deltas[key] = [target, 0]
+        deltas[key][1] += change
+    return deltas
+
+
+def _write_karma(db, deltas, actor, source, conversation_id):
+    """ Write Karma
+        Make the writes for a set of karma changes, leaving the transaction
+        they're part of to the caller
+    """
+    now = time()
+    day = strftime('%Y-%m-%d', gmtime(now))
+    changed = [(target, change) for target, change in deltas.values() if change != 0]
+    db.executemany("INSERT INTO karma (target, karma) VALUES (?, ?) " \
+            + "ON CONFLICT (target COLLATE NOCASE) DO UPDATE SET karma = karma + excluded.karma",
+            deltas.values())
+    db.executemany("INSERT INTO karma_ledger (target, actor, delta, source, conversation_id, changed_at) " \
+            + "VALUES (?, ?, ?, ?, ?, ?)",
+            [(target, actor, change, source, conversation_id, now) for target, change in changed])
+    rollups = [(day, target, max(change, 0), max(-change, 0)) for target, change in changed]
+    db.executemany("INSERT INTO karma_daily (day, target, gained, lost) VALUES (?, ?, ?, ?) " \
+            + "ON CONFLICT (target, day) DO UPDATE SET gained = gained + excluded.gained, " \
+            + "lost = lost + excluded.lost", rollups)
+    if actor is not None:
+        db.executemany("INSERT INTO karma_givers_daily (day, target, actor, gained, lost) " \
+                + "VALUES (?, ?, ?, ?, ?) ON CONFLICT (target, actor, day) DO UPDATE SET " \
+                + "gained = gained + excluded.gained, lost = lost + excluded.lost",
+                [(day, target, actor, gained, lost) for day, target, gained, lost in rollups])
+
+
+def _karma_totals(db, deltas):
+    leaderboard.invalidate()
+    totals = get_karmas(db, [target for target, change in deltas.values()])
+    return OrderedDict((target, (change, totals[key])) for key, (target, change) in deltas.items())
+
+
+def net_debts(debts):
+    """ Net Debts
+        Given a list of (lender, borrower, amount) debts, return a smaller
+        list which leaves everyone owed or owing the same amount overall.
+        Debts going round in a circle cancel out, and whoever is owed the
+        most is paid by whoever owes the most until everyone is square, so
+        there are never more debts than people involved (less one)
+    """
+    names = {}
+    balances = {}
+    for lender, borrower, amount in debts:
+        for name, change in ((lender, amount), (borrower, -amount)):
+            key = name.lower()
+            names.setdefault(key, name)
+            balances[key] = balances.get(key, 0) + change
+    # Largest amounts first, ties by name so the result doesn't wander
+    creditors = sorted(((amount, key) for key, amount in balances.items() if amount > 0),
+            key=lambda entry: (-entry[0], entry[1]))
+    debtors = sorted(((-amount, key) for key, amount in balances.items() if amount < 0),
+            key=lambda entry: (-entry[0], entry[1]))
+    netted = []
+    i = j = 0
+    while i < len(creditors) and j < len(debtors):
+        owed, lender = creditors[i]
+        owing, borrower = debtors[j]
+        amount = min(owed, owing)
+        netted.append((names[lender], names[borrower], amount))
+        creditors[i] = (owed - amount, lender)
+        debtors[j] = (owing - amount, borrower)
+        if creditors[i][0] == 0: i += 1
+        if debtors[j][0] == 0: j += 1
+    return netted
+
+
+def spot_karma(db, lender, borrower, amount, actor, conversation_id):
+    """ Spot Karma
+        In one transaction, move amount karma from lender to borrower and
+        record that the borrower owes it back, netting it against every
+        other debt in the conversation. Debts from before they were kept per
+        conversation which involve the lender or borrower are netted too,
+        and become part of the conversation. Return None if the lender doesn't
+        have the karma to lend, otherwise the (change, karma) of both (as
+        change_karma would) and the lender's balance in the conversation
+        once everything's netted: how much they're owed in all, less how
+        much they owe
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if get_karma(db, lender) < amount:
+            db.rollback()
+            return None
+        where = "WHERE conversation_id IS ? OR (conversation_id IS NULL " \
+                + "AND (lender COLLATE NOCASE IN (?, ?) OR borrower COLLATE NOCASE IN (?, ?)))"
+        params = (conversation_id, lender, borrower, lender, borrower,)
+        debts = db.execute("SELECT lender, borrower, amount FROM debt " + where, params).fetchall()
+        netted = net_debts(debts + [(lender, borrower, amount)])
+        db.execute("DELETE FROM debt " + where, params)
+        db.executemany("INSERT INTO debt (lender, borrower, amount, conversation_id) VALUES (?, ?, ?, ?)",
+                [debt + (conversation_id,) for debt in netted])
+        deltas = _sum_changes([(lender, -amount), (borrower, amount)])
+        _write_karma(db, deltas, actor, 'spot', conversation_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    balance = 0
+    for debt_lender, debt_borrower, debt in netted:
+        if debt_lender.lower() == lender.lower():
+            balance += debt
+        elif debt_borrower.lower() == lender.lower():
+            balance -= debt
+    return _karma_totals(db, deltas), balance
+
+
+def get_debts(db, conversation_id, person=None):
+    """ Get Debts
+        Return the (lender, borrower, amount) of the debts in a conversation
+        (and those from before debts were kept per conversation), only those
+        involving person if one's given, largest first
+    """
+    query = "SELECT lender, borrower, amount FROM debt WHERE (conversation_id = ? OR conversation_id IS NULL) " \
+            + "AND amount > 0"
+    params = [conversation_id]
+    if person is not None:
+        query += " AND (lender = ? COLLATE NOCASE OR borrower = ? COLLATE NOCASE)"
+        params += [person, person]
+    res = db.execute(query + " ORDER BY amount DESC, borrower, lender", params)
+    return res.fetchall()
+
+
+def karma_history(db, target, days):
+    """ Karma History
+        Return the (day, gained, lost) of each of the last given number of
+        days that a target's karma changed, most recent first
+    """
+    since = strftime('%Y-%m-%d', gmtime(time() - (days - 1) * 24 * 60 * 60))
+    res = db.execute("SELECT day, gained, lost FROM karma_daily WHERE target = ? AND day >= ? " \
+            + "ORDER BY day DESC", (target, since,))
+    return res.fetchall()
+
+
+def top_givers(db, target, days, count):
+    """ Top Givers
+        Return up to count (actor, gained, lost) of whoever gave a target
+        the most karma over the last given number of days
+    """
+    since = strftime('%Y-%m-%d', gmtime(time() - (days - 1) * 24 * 60 * 60))
+    res = db.execute("SELECT actor, SUM(gained), SUM(lost) FROM karma_givers_daily " \
+            + "WHERE target = ? AND day >= ? GROUP BY actor ORDER BY SUM(gained) DESC, actor LIMIT ?",
+            (target, since, count,))
+    return res.fetchall()
+
+
+def rebuild_karma(db):
+    """ Rebuild Karma
+        Recompute every karma total from the ledger, in case the totals
+        have been corrupted. Return how many totals were wrong
+    """
+    with db:
+        wrong = db.execute("SELECT COUNT(*) FROM karma LEFT JOIN (SELECT target, SUM(delta) AS total " \
+                + "FROM karma_ledger GROUP BY target COLLATE NOCASE) AS ledger " \
+                + "ON karma.target = ledger.target COLLATE NOCASE " \
+                + "WHERE karma.karma != IFNULL(ledger.total, 0)").fetchone()[0]
+        db.execute("UPDATE karma SET karma = IFNULL((SELECT SUM(delta) FROM karma_ledger " \
+                + "WHERE karma_ledger.target = karma.target COLLATE NOCASE), 0)")
+    leaderboard.invalidate()
+    return wrong
+
+
+def search_quotes(db, terms, said_by=None, since=None, until=None, offset=0, count=5):
+    """ Search Quotes
+        Look up the quotes containing every one of the given words (a word
+        ending in * matches anything starting with it) through the quote
+        index, optionally only those said by someone and between two
+        YYYY-MM-DD dates. Return how many quotes match in total and up to
+        count (quote_id, quote, said_by, said_at) of them from the given
+        offset, best matches first
+    """
+    # Quote every word so nothing people type is taken as query syntax
+    words = re.findall(r'\w+\*?', terms)
+    if not words:
+        return 0, []
+    query = ' '.join('"{}"{}'.format(word.rstrip('*'), '*' if word.endswith('*') else '')
+            for word in words)
+    where = "quotes_fts MATCH ?"
+    params = [query]
+    if said_by is not None:
+        where += " AND quotes.said_by = ? COLLATE NOCASE"
+        params.append(said_by)
+    if since is not None:
+        where += " AND quotes.said_at >= ?"
+        params.append(since)
+    if until is not None:
+        where += " AND quotes.said_at < date(?, '+1 day')"
+        params.append(until)
+    tables = "quotes_fts JOIN quotes ON quotes.quote_id = quotes_fts.rowid"
+    total = db.execute("SELECT COUNT(*) FROM {} WHERE {}".format(tables, where), params).fetchone()[0]
+    res = db.execute("SELECT quotes.quote_id, quotes.quote, quotes.said_by, quotes.said_at " \
+            + "FROM {} WHERE {} ORDER BY quotes_fts.rank LIMIT ? OFFSET ?".format(tables, where),
+            params + [count, offset])
+    return total, res.fetchall()
+
+
+class Leaderboard:
+    """ Leaderboard
+        Rank karma targets, either everywhere or only among the members of
+        a conversation. Every query is answered from the karma index with a
+        LIMIT or a range, never by reading the whole table, and results are
+        cached until the next change to karma, nicknames or who is in a
+        conversation
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0 # Bumped by every change the rankings depend on
+        self.cached_version = 0
+        self.cache = {}
+
+
+    def invalidate(self):
+        """ Invalidate
+            Forget every cached result, called whenever karma, nicknames,
+            aliases or conversation members change
+        """
+        with self.lock:
+            self.version += 1
+
+
+    def top(self, db, count, conversation_id=None):
+        """ Top
+            Return up to count (target, karma) pairs with the most karma
+        """
+        return self._cached(('top', count, conversation_id), lambda: self._query(db,
+                "ORDER BY karma.karma DESC, karma.target DESC LIMIT ?", [count], conversation_id))
+
+
+    def bottom(self, db, count, conversation_id=None):
+        """ Bottom
+            Return up to count (target, karma) pairs with the least karma
+        """
+        return self._cached(('bottom', count, conversation_id), lambda: self._query(db,
+                "ORDER BY karma.karma, karma.target LIMIT ?", [count], conversation_id))
+
+
+    def rank(self, db, target, conversation_id=None):
+        """ Rank
+            Return the (target, karma, rank) of a target, where the rank is
+            one more than how many have more karma than it, or None if it has
+            no karma (or isn't in the conversation)
+        """
+        return self._cached(('rank', target.lower(), conversation_id),
+                lambda: self._rank(db, target, conversation_id))
+
+
+    def neighbors(self, db, target, conversation_id=None):
+        """ Neighbors
+            Return the (target, karma) pairs ranked just above and just below
+            a target, either of which may be None
+        """
+        return self._cached(('neighbors', target.lower(), conversation_id),
+                lambda: self._neighbors(db, target, conversation_id))
+
+
+    def _rank(self, db, target, conversation_id):
+        entry = self._query(db, "AND karma.target = ? COLLATE NOCASE", [target], conversation_id)
+        if not entry:
+            return None
+        target, karma = entry[0]
+        above = self._query(db, "AND karma.karma > ?", [karma], conversation_id,
+                columns="COUNT(*)")[0][0]
+        return (target, karma, above + 1)
+
+
+    def _neighbors(self, db, target, conversation_id):
+        entry = self._query(db, "AND karma.target = ? COLLATE NOCASE", [target], conversation_id)
+        if not entry:
+            return (None, None)
+        target, karma = entry[0]
+        # Ties are broken by name so every target has a single place
+        above = self._query(db, "AND (karma.karma, karma.target) > (?, ?) " \
+                + "ORDER BY karma.karma, karma.target LIMIT 1", [karma, target], conversation_id)
+        below = self._query(db, "AND (karma.karma, karma.target) < (?, ?) " \
+                + "ORDER BY karma.karma DESC, karma.target DESC LIMIT 1", [karma, target], conversation_id)
+        return (above[0] if above else None, below[0] if below else None)
+
+
+    def _query(self, db, clauses, params, conversation_id, columns="karma.target, karma.karma"):
+        if conversation_id is None:
+            query = "SELECT {} FROM karma WHERE 1 {}".format(columns, clauses)
+        else:
+            # Only targets which are the nicknames of the conversation's members
+            query = "SELECT {} FROM users INNER JOIN karma ON " \
+                    + "karma.target = users.nickname COLLATE NOCASE " \
+                    + "WHERE users.conversation_id = ? {}"
+            query = query.format(columns, clauses)
+            params = [conversation_id] + params
+        return db.execute(query, params).fetchall()
+
+
+    def _cached(self, key, compute):
+        with self.lock:
+            if self.cached_version != self.version:
+                self.cache = {}
+                self.cached_version = self.version
+            if key in self.cache:
+                return self.cache[key]
+            version = self.version
+        result = compute()
+        with self.lock:
+            # Don't keep a result karma may have changed under
+            if version == self.version == self.cached_version:
+                self.cache[key] = result
+        return result
+
+
+leaderboard = Leaderboard()
+
+
+class RandomSampler:
+    """ Random Sampler
+        Pick random rows out of a table without reading the whole thing on
+        every draw. Unfiltered draws pick a random rowid, trying again if it
+        lands in a gap left by a deletion. Filtered draws pick from a cached
+        list of the rowids matching the filter, read once per table, filter
+        and parameters and kept up to date by commands which add or remove
+        rows through added and removed. Draws can be made from a shuffle
+        bag, keyed by something like a conversation id, so no row repeats
+        until every row has been drawn. Rows added to a filtered table join
+        the bags already being drawn from; rows added past the end of an
+        unfiltered bag wait for the next one. Tables full of gaps make
+        unfiltered draws slow, as every gap drawn costs a lookup
+    """
+
+    retries = 16 # Random rowids to try before walking to the next row
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rowids = {} # (table, where, params) -> sorted rowids matching the filter
+        self.bags = {} # (bag, table, where, params) -> ShuffleBag or rowids left to draw
+
+
+    def choice(self, db, table, columns, where='', params=(), bag=None):
+        """ Choice
+            Return a random row of the given columns of a table, limited to
+            the rows matching a where clause if there is one, or None if
+            there are no rows
+        """
+        if not where:
+            return self._by_rowid(db, table, columns, bag)
+        key = (table, where, tuple(params))
+        query = "SELECT {} FROM {} WHERE rowid = ?".format(columns, table)
+        while True:
+            with self.lock:
+                rowids = self.rowids.get(key)
+                if rowids is None:
+                    rowids = [row[0] for row in db.execute(
+                            "SELECT rowid FROM {} {} ORDER BY rowid".format(table, where), params)]
+                    self.rowids[key] = rowids
+                if not rowids:
+                    return None
+                if bag is None:
+                    rowid = rowids[randrange(len(rowids))]
+                else:
+                    left = self.bags.get((bag,) + key)
+                    if not left:
+                        left = self._shuffled(rowids)
+                        self.bags[(bag,) + key] = left
+                    rowid = left.pop()
+            row = db.execute(query, (rowid,)).fetchone()
+            if row is not None:
+                return row
+            # Removed without telling us, forget it and draw again
+            self.removed(table, rowid)
+
+
+    def added(self, db, table, rowid):
+        """ Added
+            Note a row added to a table, so filtered draws can pick it
+        """
+        with self.lock:
+            for key, rowids in self.rowids.items():
+                if key[0] != table:
+                    continue
+                _, where, params = key
+                matches = db.execute("SELECT 1 FROM (SELECT rowid AS id FROM {} {}) WHERE id = ?".format(table, where),
+                        params + (rowid,)).fetchone()
+                if matches is None:
+                    continue
+                index = bisect.bisect_left(rowids, rowid)
+                if index == len(rowids) or rowids[index] != rowid:
+                    rowids.insert(index, rowid)
+                # Slip it into the bags being drawn from
+                for bag_key, left in self.bags.items():
+                    if bag_key[1:] == key and isinstance(left, list):
+                        left.append(rowid)
+                        swap = randrange(len(left))
+                        left[swap], left[-1] = left[-1], left[swap]
+
+
+    def removed(self, table, rowid):
+        """ Removed
+            Note a row removed from a table, so filtered draws skip it
+        """
+        with self.lock:
+            for key, rowids in self.rowids.items():
+                if key[0] != table:
+                    continue
+                index = bisect.bisect_left(rowids, rowid)
+                if index < len(rowids) and rowids[index] == rowid:
+                    del rowids[index]
+            for bag_key, left in self.bags.items():
+                if bag_key[1] == table and isinstance(left, list) and rowid in left:
+                    left.remove(rowid)
+
+
+    def _shuffled(self, rowids):
+        left = list(rowids)
+        for i in range(len(left) - 1, 0, -1):
+            j = randrange(i + 1)
+            left[i], left[j] = left[j], left[i]
+        return left
+
+
+    def _by_rowid(self, db, table, columns, bag):
+        last = db.execute("SELECT MAX(rowid) FROM {}".format(table)).fetchone()[0]
+        if last is None:
+            return None
+        query = "SELECT {} FROM {} WHERE rowid = ?".format(columns, table)
+        if bag is not None:
+            # Every rowid comes out of the bag once, so keep drawing past the
+            # gaps rather than settling for a row which may already have come
+            # up. Two bags' worth of draws is sure to hit any row still there
+            for attempt in range(2 * last):
+                rowid = self._draw((bag, table, '', ()), last) + 1
+                row = db.execute(query, (rowid,)).fetchone()
+                if row is not None:
+                    return row
+            return None
+        for attempt in range(self.retries):
+            rowid = randrange(last) + 1
+            row = db.execute(query, (rowid,)).fetchone()
+            if row is not None:
+                return row
+        # Lots of gaps, settle for the next row after the last random rowid
+        return db.execute("SELECT {} FROM {} WHERE rowid >= ? ORDER BY rowid LIMIT 1".format(columns, table),
+                (rowid,)).fetchone()
+
+
+    def _draw(self, key, size):
+        with self.lock:
+            shuffle = self.bags.get(key)
+            # Only start a new bag once the old one is used up, rows added
+            # since it was started come up in the next one
+            if shuffle is None or shuffle.empty():
+                shuffle = ShuffleBag(size)
+                self.bags[key] = shuffle
+            return shuffle.next()
+
+
+class ShuffleBag:
+    """ Shuffle Bag
+        Deal out the numbers 0 to size - 1 in a random order without
+        storing them, by walking a randomly seeded full-period linear
+        congruential generator over the next power of two, scrambling each
+        step with a random bijection and skipping anything past the end
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.modulus = 1
+        while self.modulus < size:
+            self.modulus *= 2
+        # Any multiplier of 1 mod 4 and odd increment cover every value
+        self.multiplier = randrange(0, self.modulus, 4) + 1
+        self.increment = randrange(1, self.modulus + 1, 2)
+        self.state = randrange(self.modulus)
+        # An odd multiplier and an xor mask hide the generator's patterns
+        self.scramble = randrange(1, self.modulus + 1, 2)
+        self.mask = randrange(self.modulus)
+        self.dealt = 0
+
+
+    def empty(self):
+        return self.dealt >= self.size
+
+
+    def next(self):
+        while True:
+            self.state = (self.multiplier * self.state + self.increment) % self.modulus
+            value = (self.state * self.scramble % self.modulus) ^ self.mask
+            if value < self.size:
+                self.dealt += 1
+                return value
+
+
+sampler = RandomSampler()
+
+
+class NameCache:
+    """ Name Cache
+        Case-folded copies of the aliases and the nickname to full name
+        links of the users table, so names can be resolved without going
+        to the database. Loaded on first use; commands which write those
+        tables update or invalidate it once they've committed
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.aliases = {} # alias -> what it's an alias for
+        self.full_names = {} # nickname -> full name
+        self.nicknames = {} # full name -> nickname
+        self.users = set() # every nickname
+
+
+    def load(self, db):
+        """ Load
+            Read the aliases and users tables, unless they already have been
+        """
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            aliases = {}
+            for old, new in db.execute("SELECT old, new FROM aliases").fetchall():
+                aliases.setdefault(old.lower(), new)
+            full_names = {}
+            nicknames = {}
+            for full, nick in db.execute("SELECT full_name, nickname FROM users").fetchall():
+                if nick is None: continue
+                full_names.setdefault(nick.lower(), full)
+                nicknames.setdefault(full.lower(), nick)
+            self.aliases = aliases
+            self.full_names = full_names
+            self.nicknames = nicknames
+            self.users = set(full_names.keys())
+            self.loaded = True
+
+
+    def invalidate(self):
+        """ Invalidate
+            Throw the cache away, it will be reloaded when it's next used
+        """
+        with self.lock:
+            self.loaded = False
+
+
+    def add_alias(self, old, new):
+        """ Add Alias
+            Record an alias which was just added to the database
+        """
+        with self.lock:
+            self.aliases.setdefault(old.lower(), new)
+
+
+names = NameCache()
 
 
 def resolve_alias(db, alias):
@@ -17,11 +617,8 @@ def resolve_alias(db, alias):
         for it exists in the database. If so, return the aliased value,
         otherwise, just return the value given.
     """
-    aliases = db.execute("SELECT old, new FROM aliases")
-    for pair in aliases.fetchall():
-        if pair[0].lower() == alias.lower():
-            return pair[1]
-    return alias
+    names.load(db)
+    return names.aliases.get(alias.lower(), alias)
 
 
 def resolve_full(db, nick):
@@ -29,12 +626,8 @@ def resolve_full(db, nick):
         If the given nickname maps to a full name in the users database,
         return the full name. If not, return the nickname.
     """
-    links = db.execute("SELECT full_name, nickname FROM users")
-    for pair in links.fetchall():
-        if pair[1] is None: continue
-        if pair[1].lower() == nick.lower():
-            return pair[0]
-    return nick
+    names.load(db)
+    return names.full_names.get(nick.lower(), nick)
 
 
 def resolve_nick(db, full):
@@ -42,24 +635,17 @@ def resolve_nick(db, full):
         If a given full name maps to a nickname in the users database,
         return the nickname. If not, return the full name.
     """
-    links = db.execute("SELECT full_name, nickname FROM users")
-    for pair in links.fetchall():
-        if pair[1] is None: continue
-        if pair[0].lower() == full.lower():
-            return pair[1]
-    return full
+    names.load(db)
+    return names.nicknames.get(full.lower(), full)
 
 
 def get_users(db):
     """ Get Users
-        Get all nicknames from gambit's database and return them as a list
+        Get all nicknames from gambit's database and return them as a
+        set of lowercase names
     """
-    users = []
-    links = db.execute("SELECT nickname FROM users")
-    for user in links.fetchall():
-        if user[0] is None: continue
-        users.append(user[0].lower())
-    return users
+    names.load(db)
+    return names.users
 
 
 def get_privilege(db, user, conversation):
@@ -67,35 +653,131 @@ def get_privilege(db, user, conversation):
         If a given full name is in the database, return that users
         privilege level
     """
-    privileges = db.execute("SELECT full_name, privilege FROM users WHERE conversation_id = ?", (conversation.id_,))
-    privileges = privileges.fetchall()
-    for privilege in privileges:
-        if privilege[0].lower() == user.lower():
-            return int(privilege[1])
-    return 0
-
-
-def update_honorifics(db, conversation_id, threshold=75):
-    """ Update Honorifics
-        Figure out the karma-based honorifics of each conversation and apply them in the database
-        clearing out all other changes
-    """
-    db.execute("UPDATE users SET title = NULL WHERE title = 'King' OR title = 'Lord'")
-    res = db.execute("SELECT target, karma FROM users INNER JOIN karma ON " \
-            + "users.nickname = karma.target COLLATE NOCASE " \
-            + "WHERE conversation_id = ? AND karma > ? ORDER BY karma DESC", 
-            (conversation_id, threshold,))
-    ordered = res.fetchall()
-    if len(ordered) < 2: return # You're always king of a one-on-one, so forget it
-    # First give everyone who has earned their lordship their title
-    for user, karma in ordered:
-        db.execute("UPDATE users SET title = 'Lord' WHERE nickname = ? " \
-                + "AND conversation_id = ?", (user, conversation_id,))
-    # Now give the king their rightful crown, but only if they're undisputed
-    if ordered[0][1] > ordered[1][1]:
-        db.execute("UPDATE users SET title = 'King' WHERE nickname = ? " \
-                + "AND conversation_id = ?", (ordered[0][0], conversation_id,))
-    db.commit()
+    privilege = db.execute("SELECT privilege FROM users WHERE full_name = ? COLLATE NOCASE " \
+            + "AND conversation_id = ?", (user, conversation.id_,))
+    privilege = privilege.fetchone()
+    if privilege is None:
+        return 0
+    return int(privilege[0])
+
+
+class Honorifics:
+    """ Honorifics
+        Keep track of the karma-based honorifics of each conversation. Once
+        at least two members of a conversation have more karma than the
+        threshold they are all made Lords, and whoever has the most karma
+        (undisputed) is made King. Each conversation keeps its members above
+        the threshold ranked by karma, so a karma change only re-ranks the
+        conversations the target is in and only writes the titles which
+        actually change. Titles are written while the lock is held, so
+        concurrent changes can't land in the database out of order
+    """
+
+    honorifics = ['King', 'Lord']
+
+    def __init__(self, threshold=75):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.rooms = {} # conversation id -> HonorificRoom
+        self.rooms_of = {} # lowercase nickname -> ids of conversations they're in
+
+
+    def load(self, db, conversation_id):
+        """ Load
+            Read a conversation's members and their karma from the database
+            and fix up any titles that are out of date
+        """
+        res = db.execute("SELECT nickname, title, karma FROM users LEFT JOIN karma ON " \
+                + "users.nickname = karma.target COLLATE NOCASE " \
+                + "WHERE conversation_id = ? AND nickname IS NOT NULL", (conversation_id,))
+        room = HonorificRoom()
+        with self.lock:
+            old = self.rooms.get(conversation_id)
+            if old is not None:
+                for nick in old.nicknames:
+                    self.rooms_of[nick].discard(conversation_id)
+            for nickname, title, karma in res.fetchall():
+                nick = nickname.lower()
+                room.nicknames[nick] = nickname
+                room.titles[nick] = title
+                if karma is not None and karma > self.threshold:
+                    room.rank(nick, karma)
+                self.rooms_of.setdefault(nick, set()).add(conversation_id)
+            self.rooms[conversation_id] = room
+            self._write(db, self._retitle(conversation_id))
+
+
+    def karma_changed(self, db, target, karma):
+        """ Karma Changed
+            Re-rank every conversation the target of a karma change is in,
+            updating only the titles which changed hands
+        """
+        nick = target.lower()
+        changes = []
+        with self.lock:
+            for conversation_id in self.rooms_of.get(nick, ()):
+                room = self.rooms[conversation_id]
+                room.unrank(nick)
+                if karma > self.threshold:
+                    room.rank(nick, karma)
+                changes += self._retitle(conversation_id)
+            self._write(db, changes)
+
+
+    def _retitle(self, conversation_id):
+        """ Retitle
+            Work out who should hold which honorific in a conversation and
+            return (title, conversation id, nickname) for each one to change
+        """
+        room = self.rooms[conversation_id]
+        earned = {}
+        if len(room.ranked) >= 2: # You're always king of a one-on-one, so forget it
+            # First give everyone who has earned their lordship their title
+            for karma, nick in room.ranked:
+                earned[nick] = 'Lord'
+            # Now give the king their rightful crown, but only if they're undisputed
+            if room.ranked[0][0] < room.ranked[1][0]:
+                earned[room.ranked[0][1]] = 'King'
+        changes = []
+        for nick, title in room.titles.items():
+            if title in self.honorifics or nick in earned:
+                if earned.get(nick) != title:
+                    room.titles[nick] = earned.get(nick)
+                    changes.append((earned.get(nick), conversation_id, room.nicknames[nick]))
+        return changes
+
+
+    def _write(self, db, changes):
+        # Called with the lock held, so titles reach the database in the
+        # order they were worked out in
+        if not changes:
+            return
+        with db:
+            db.executemany("UPDATE users SET title = ? WHERE conversation_id = ? AND nickname = ?",
+                    changes)
+
+
+class HonorificRoom:
+    """ Honorific Room
+        The members of a single conversation with nicknames, their titles
+        and those above the karma threshold ranked from most to least karma
+    """
+
+    def __init__(self):
+        self.nicknames = {} # lowercase nickname -> nickname
+        self.titles = {} # lowercase nickname -> title
+        self.ranked = [] # (negated karma, lowercase nickname), sorted
+        self.karma = {} # lowercase nickname -> karma, for those ranked
+
+
+    def rank(self, nick, karma):
+        bisect.insort(self.ranked, (-karma, nick))
+        self.karma[nick] = karma
+
+
+    def unrank(self, nick):
+        if nick in self.karma:
+            self.ranked.remove((-self.karma.pop(nick), nick))
 
 
 def get_honorific_name(db, full_name, conversation_id):
@@ -104,7 +786,7 @@ def get_honorific_name(db, full_name, conversation_id):
         as well as determine their nickname and return them as their full, honorific
         name
     """
-    res = db.execute("SELECT title, nickname FROM users WHERE full_name = ? "
+    res = db.execute("SELECT title, nickname FROM users WHERE full_name = ? COLLATE NOCASE "
                 + "AND conversation_id = ?", (full_name, conversation_id,))
     res = res.fetchone()
     if not res[0]:
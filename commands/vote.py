@@ -1,28 +1,116 @@
 from random import randint
+from time import time, gmtime, strftime
 from util import *
 import re
 from hangups.bot.commands.command import Command
 
+# Which vote a command is about: ' #<id>' after 'vote', or the conversation's
+# most recently started vote if it's left out
+re_vote_id = '(?: #(\d+))?'
+
+# How long a vote can be left open for, like 'for 10m' or 'for 2 hours'
+re_duration = '(?: for (\d+) ?(s|secs?|seconds?|m|mins?|minutes?|h|hrs?|hours?|d|days?))?'
+durations = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+max_duration = 30 * 24 * 60 * 60
+
+
 class Vote:
     """ Vote
-        A class representing the current state of a bot-level vote
-        Note that votes are tied to an instance of the bot, and all data
-        is lost if the bot is restarted
+        A class representing the state of a vote in a conversation. Votes
+        are kept in the database, so they survive the bot restarting and a
+        conversation can run several at once, each with its own id. Every
+        option keeps a running tally of the ballots cast for it, updated
+        along with the ballots themselves
     """
-    
-    def __init__(self, owner_priv, question, options=[], mutable=False):
+
+    def __init__(self, vote_id, question, owner_priv, mutable=False, ends_at=None, timer_id=None):
         # Note that all votes ARE mutable, the mutable option dictates whether the vote can
         # be altered by anyone or just admins and the owner
+        self.vote_id = vote_id
+        self.question = question
         self.owner_priv = owner_priv
-        self.options = []
-        for option in options:
-            self.options.append(option.lower())
         self.mutable = mutable
-        self.votes = {}
-        self.question = question
+        self.ends_at = ends_at # When the vote closes by itself, if ever
+        self.timer_id = timer_id
+
+
+    @classmethod
+    def start(cls, db, conversation_id, owner_priv, question, options=[], mutable=False):
+        """ Start
+            Create a new vote in a conversation and return it
+        """
+        with db:
+            cursor = db.execute("INSERT INTO votes (conversation_id, question, owner_priv, mutable, started_at) " \
+                    + "VALUES (?, ?, ?, ?, ?)", (conversation_id, question, owner_priv, mutable, time(),))
+            db.executemany("INSERT OR IGNORE INTO vote_options (vote_id, option) VALUES (?, ?)",
+                    [(cursor.lastrowid, option.lower()) for option in options])
+        return cls(cursor.lastrowid, question, owner_priv, mutable)
+
+
+    def set_deadline(self, db, ends_at, timer_id):
+        """ Set Deadline
+            Record when the vote closes by itself and the timer closing it
+        """
+        with db:
+            db.execute("UPDATE votes SET ends_at = ?, timer_id = ? WHERE vote_id = ?",
+                    (ends_at, timer_id, self.vote_id,))
+        self.ends_at = ends_at
+        self.timer_id = timer_id
+
+
+    @classmethod
+    def find(cls, db, conversation_id, vote_id=None):
+        """ Find
+            Return the open vote in a conversation with the given id, or the
+            most recently started one if no id is given. None if there's no
+            such vote
+        """
+        if vote_id is None:
+            res = db.execute("SELECT vote_id, question, owner_priv, mutable, ends_at, timer_id FROM votes " \
+                    + "WHERE conversation_id = ? AND ended_at IS NULL ORDER BY vote_id DESC LIMIT 1",
+                    (conversation_id,))
+        else:
+            res = db.execute("SELECT vote_id, question, owner_priv, mutable, ends_at, timer_id FROM votes " \
+                    + "WHERE vote_id = ? AND conversation_id = ? AND ended_at IS NULL",
+                    (int(vote_id), conversation_id,))
+        res = res.fetchone()
+        if res is None:
+            return None
+        vote_id, question, owner_priv, mutable, ends_at, timer_id = res
+        return cls(vote_id, question, owner_priv, bool(mutable), ends_at, timer_id)
+
+
+    @staticmethod
+    def open_votes(db, conversation_id):
+        """ Open Votes
+            Return the (vote id, question) of every open vote in a
+            conversation, oldest first
+        """
+        res = db.execute("SELECT vote_id, question FROM votes WHERE conversation_id = ? " \
+                + "AND ended_at IS NULL ORDER BY vote_id", (conversation_id,))
+        return res.fetchall()
+
+
+    def options(self, db):
+        """ Options
+            Return each (option, tally) in the vote, in the order they were
+            added
+        """
+        res = db.execute("SELECT option, tally FROM vote_options WHERE vote_id = ? ORDER BY rowid",
+                (self.vote_id,))
+        return res.fetchall()
+
 
+    def ballots(self, db):
+        """ Ballots
+            Return each (voter, option) cast in the vote
+        """
+        res = db.execute("SELECT voter, option FROM vote_ballots WHERE vote_id = ? ORDER BY rowid",
+                (self.vote_id,))
+        return res.fetchall()
 
-    def add_option(self, option, user_priv):
+
+    def add_option(self, db, option, user_priv):
         """ Add Option
             Check if a user has permission to add an option and, if so, add
             it to the vote list and return True, otherwise return
@@ -31,13 +119,13 @@ class Vote:
         # Only add an option if the user is an admin or the vote is mutable
         if not self.mutable and user_priv < self.owner_priv:
             return False
-        if option == 'invalid':
-            return False
-        self.options.append(option.lower())
+        with db:
+            db.execute("INSERT OR IGNORE INTO vote_options (vote_id, option) VALUES (?, ?)",
+                    (self.vote_id, option.lower(),))
         return True
 
 
-    def remove_option(self, option, user_priv):
+    def remove_option(self, db, option, user_priv):
         """ Remove Option
             Check if a user has permission to remove an option from  the vote
             Because there are multiple failure states, return an
@@ -46,392 +134,537 @@ class Vote:
         # Only remove an option if the user is an admin or the vote is mutable
         if not self.mutable and user_priv < self.owner_priv:
             return 1
-        if option.lower() not in self.options: return 2
-        self.options.remove(option.lower())
-        to_remove = []
-        for voter in self.votes:
-            if self.votes[voter] == option.lower(): to_remove.append(voter)
-        for voter in to_remove:
-            del(self.votes[voter])
+        with db:
+            removed = db.execute("DELETE FROM vote_options WHERE vote_id = ? AND option = ?",
+                    (self.vote_id, option.lower(),))
+            if removed.rowcount == 0: return 2
+            db.execute("DELETE FROM vote_ballots WHERE vote_id = ? AND option = ?",
+                    (self.vote_id, option.lower(),))
         return 0
-   
 
-    def vote(self, name, vote):
+
+    def vote(self, db, name, vote):
         """ Vote
-            Cast a vote and store it in the object
+            Cast (or change) a vote, moving it from the tally of whatever
+            the voter picked before to the tally of their new pick
+        """
+        vote = vote.lower()
+        with db:
+            added = db.execute("UPDATE vote_options SET tally = tally + 1 WHERE vote_id = ? AND option = ?",
+                    (self.vote_id, vote,))
+            if added.rowcount == 0:
+                return False
+            self._take_back(db, name)
+            db.execute("INSERT INTO vote_ballots (vote_id, voter, option) VALUES (?, ?, ?)",
+                    (self.vote_id, name, vote,))
+        return True
+
+
+    def retract(self, db, name):
+        """ Retract
+            Take back someone's vote. Return whether they had voted
         """
-        if vote.lower() not in self.options:
+        with db:
+            return self._take_back(db, name)
+
+
+    def _take_back(self, db, name):
+        previous = db.execute("SELECT option FROM vote_ballots WHERE vote_id = ? AND voter = ?",
+                (self.vote_id, name,)).fetchone()
+        if previous is None:
             return False
-        self.votes[name] = vote
+        db.execute("DELETE FROM vote_ballots WHERE vote_id = ? AND voter = ?", (self.vote_id, name,))
+        db.execute("UPDATE vote_options SET tally = tally - 1 WHERE vote_id = ? AND option = ?",
+                (self.vote_id, previous[0],))
         return True
 
 
-    def end_vote(self, bot, user_priv):
+    def end_vote(self, db, user_priv):
         """ End Vote
             If the user has permission to end the vote, end it and determine
-            which option won. Resolve ties with karma, then resolve karma ties
-            at random
-            Return an error status
+            which option won. Resolve ties with the karma of whoever voted
+            for each option, then resolve karma ties at random
+            Return an exit code along with the winner (None if nobody
+            voted): 0 if the vote was ended, 1 if the user doesn't have
+            permission, 2 if it had already been ended (by someone else, or
+            by its deadline)
         """
         if user_priv < self.owner_priv:
-            return 'invalid'
-        if len(self.votes.keys()) == 0:
-            return None
-        totals = {}
-        for vote in self.votes:
-            if self.votes[vote] not in totals.keys():
-                totals[self.votes[vote]] = 0
-            totals[self.votes[vote]] += 1
-        # We want to account for ties
-        max_votes = None
-        for option in totals:
-            if max_votes is None or totals[option] > max_votes: max_votes = totals[option]
-        winners = []
-        for option in totals:
-            if totals[option] == max_votes:
-                winners.append(option)
-        # Try to break ties with karma
-        if len(winners) > 1:
-            karma_totals = {}
-            for winner in winners:
-                karma_totals[winner] = 0
-            for vote in self.votes:
-                if self.votes[vote] in winners:
-                    karma_totals[winner] += get_karma(bot, resolve_nick(bot, vote))
-            max_karma = None
-            for option in totals:
-                if totals[option] > max_karma: max_karma = totals[option]
-            winners = []
-            for option in karma_totals:
-                if karma_totals[option] == max_karma:
-                    winners.append(option)
-        winner = winners[randint(0, len(winners) - 1)]
-        return winner
+            return 1, None
+        # The tallies are kept up to date, so the leaders are one lookup
+        winners = db.execute("SELECT option FROM vote_options WHERE vote_id = ? AND tally > 0 " \
+                + "AND tally = (SELECT MAX(tally) FROM vote_options WHERE vote_id = ?)",
+                (self.vote_id, self.vote_id,)).fetchall()
+        winners = [option for option, in winners]
+        winner = None
+        if winners:
+            # Try to break ties with karma
+            if len(winners) > 1:
+                voters = [(voter, option) for voter, option in self.ballots(db) if option in winners]
+                nicks = {voter: resolve_nick(db, voter) for voter, option in voters}
+                karma = get_karmas(db, nicks.values())
+                karma_totals = {winner: 0 for winner in winners}
+                for voter, option in voters:
+                    karma_totals[option] += karma.get(nicks[voter].lower(), 0)
+                max_karma = max(karma_totals.values())
+                winners = [option for option in winners if karma_totals[option] == max_karma]
+            winner = winners[randint(0, len(winners) - 1)]
+        with db:
+            ended = db.execute("UPDATE votes SET ended_at = ?, winner = ? WHERE vote_id = ? AND ended_at IS NULL",
+                    (time(), winner, self.vote_id,))
+        if ended.rowcount == 0:
+            return 2, None
+        return 0, winner
 
 
 class StartVote(Command):
     """ Start Vote
-        Create a vote object - store it in the bot instance and say
-        that the vote has started
+        Create a vote, store it in the database and say that the vote has
+        started
     """
 
+    keywords = ['start']
+
     def __init__(self):
         self.help = """Start Vote Command - example 'gambit: start
                        vote does voting work?'. Start a vote with a
                        specific question for all users to respond to
-                       and come to a decision."""
+                       and come to a decision. Several votes can run
+                       at once, each is given a number which can be
+                       put after 'vote' in the other vote commands
+                       (example: 'gambit: vote #2 for yes'), otherwise
+                       they go to the latest vote. End the question
+                       with 'for <time>' (example: 'for 10m', 'for 2
+                       hours') to close the vote by itself."""
         self.help_name = "start vote"
-        self.syntax = "gambit: start vote, gambit: start open vote"
+        self.syntax = "gambit: start vote <question> [for <time>], gambit: start open vote <question> [for <time>]"
 
 
-    def parse(self, bot, message, user_priv):
-        re_start = re.compile("^.*gambit[:,]? start (open )? ?vote (.+).*$", re.IGNORECASE)
-        res = re_start.match(message)
-        if res is None or bot.vote is not None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_start = re.compile("^.*gambit[:,]? start (open )? ?vote (.+?){}$".format(re_duration), re.IGNORECASE)
+        res = re_start.match(ctx.text)
+        if res is None:
             return False
-        groups = res.groups()
-        if len(groups) > 1:
-            self.cmd_args['mutable'] = True
-            self.cmd_args['question'] = groups[1]
-        else:
-            self.cmd_args['mutable'] = False
-            self.cmd_args['question'] = groups[0]
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        is_open, ctx.args['question'], amount, unit = res.groups()
+        ctx.args['mutable'] = is_open is not None
+        ctx.args['duration'] = None
+        if amount is not None:
+            ctx.args['duration'] = min(int(amount) * durations[unit[0].lower()], max_duration)
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Start Vote")
-            self.bot.vote = Vote(self.user_priv, self.cmd_args['question'], mutable=self.cmd_args['mutable'])
-            self.bot.say("Vote Started: {}".format(self.cmd_args['question']))
+            ctx.bot.log.info("Executing Start Vote")
+            vote = Vote.start(ctx.bot.db, ctx.conversation.id_, ctx.user_priv, ctx.args['question'],
+                    mutable=ctx.args['mutable'])
+            response = "Vote #{} Started: {}".format(vote.vote_id, ctx.args['question'])
+            if ctx.args['duration'] is not None:
+                ends_at = time() + ctx.args['duration']
+                timer_id = ctx.bot.timers.schedule('EndVote', ends_at,
+                        {'vote_id': vote.vote_id, 'conversation_id': ctx.conversation.id_})
+                vote.set_deadline(ctx.bot.db, ends_at, timer_id)
+                response += "\nVoting closes {}".format(strftime('%b %d at %H:%M UTC', gmtime(ends_at)))
+            ctx.say(response)
         except Exception as error:
-            self.bot.log.warn("Error in Start Vote:\n{}".format(error))
+            ctx.bot.log.warn("Error in Start Vote:\n{}".format(error))
 
 
 class AddVoteOption(Command):
     """ Add Vote Option
-        Allow a user to add an option to the current vote
+        Allow a user to add an option to a vote
     """
-    
+
+    keywords = ['add']
+
     def __init__(self):
         self.help = """Add Vote Option Command - example: 'gambit: add
                        vote option yes'. Add an option to the
                        currently existing vote."""
         self.help_name = "add vote option"
-        self.syntax =  "gambit: add vote option <option>"
+        self.syntax =  "gambit: add vote [#<number>] option <option>"
 
 
-    def parse(self, bot, message, user_priv):
-        re_add = re.compile("^gambit[:,]? add vote option (.+)$", re.IGNORECASE)
-        res = re_add.match(message)
-        if res is None or bot.vote is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_add = re.compile("^gambit[:,]? add vote{} option (.+)$".format(re_vote_id), re.IGNORECASE)
+        res = re_add.match(ctx.text)
+        if res is None:
             return False
-        self.cmd_args['option'] = res.groups()[0]
-        self.user_priv = user_priv
-        self.bot = bot
-        self.parsed = True
+        ctx.args['vote_id'], ctx.args['option'] = res.groups()
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Add Vote Option")
-            success = self.bot.vote.add_option(self.cmd_args['option'], self.user_priv)
+            ctx.bot.log.info("Executing Add Vote Option")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
+            success = vote.add_option(ctx.bot.db, ctx.args['option'], ctx.user_priv)
             if success:
-                self.bot.say("Added option: {}".format(self.cmd_args['option']))
+                ctx.say("Added option: {}".format(ctx.args['option']))
             else:
-                self.bot.say("You don't have permission to add an option.")
+                ctx.say("You don't have permission to add an option.")
         except Exception as error:
-            self.bot.log.warn("Error in Add Vote Option:\n{}".format(error))
+            ctx.bot.log.warn("Error in Add Vote Option:\n{}".format(error))
 
 
 class RemoveVoteOption(Command):
     """ Remove Vote Option
-        Allow a user to remove an option from the current vote
+        Allow a user to remove an option from a vote
     """
 
+    keywords = ['remove']
+
     def __init__(self):
         self.help = """Remove Vote Option Command - example: 'gambit:
-                       remove vote option yes'. Remove an option from 
+                       remove vote option yes'. Remove an option from
                        the currently existing vote."""
         self.help_name = "remove vote option"
-        self.syntax = "gambit: remove vote option <option>"
+        self.syntax = "gambit: remove vote [#<number>] option <option>"
 
 
-    def parse(self, bot, message, user_priv):
-        re_remove = re.compile("^gambit[:,]? remove vote option (.+)$", re.IGNORECASE)
-        res = re_remove.match(message)
-        if res is None or bot.vote is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_remove = re.compile("^gambit[:,]? remove vote{} option (.+)$".format(re_vote_id), re.IGNORECASE)
+        res = re_remove.match(ctx.text)
+        if res is None:
             return False
-        self.cmd_args['option'] = res.groups()[0]
-        self.user_priv = user_priv
-        self.bot = bot
-        self.parsed = True
+        ctx.args['vote_id'], ctx.args['option'] = res.groups()
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Remove Vote Option")
-            status = self.bot.vote.remove_option(self.cmd_args['option'], self.user_priv)
+            ctx.bot.log.info("Executing Remove Vote Option")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
+            status = vote.remove_option(ctx.bot.db, ctx.args['option'], ctx.user_priv)
             if status == 0:
-                self.bot.say("Removed option: {}, anyone who voted for it must vote again.".format(self.cmd_args['option']))
+                ctx.say("Removed option: {}, anyone who voted for it must vote again.".format(ctx.args['option']))
             elif status == 1:
-                self.bot.say("You don't have permission to remove an option.")
+                ctx.say("You don't have permission to remove an option.")
             else:
-                self.bot.say("Option does not exist.")
+                ctx.say("Option does not exist.")
         except Exception as error:
-            self.bot.log.warn("Error in Remove Vote Option:\n{}".format(error))
+            ctx.bot.log.warn("Error in Remove Vote Option:\n{}".format(error))
 
 
 class CastVote(Command):
     """ Cast Vote
-        Actually place a vote in the currently existing vote. One vote
-        allowed per user
+        Actually place a vote in a vote. One vote allowed per user,
+        voting again changes it
     """
 
+    keywords = ['vote']
+
     def __init__(self):
-        self.help = """Cast Vote Command - example 'gambit: vote for 
-                       yes' Cast your opinion in the currently open 
-                       vote. Only one vote is allowed per person."""
+        self.help = """Cast Vote Command - example 'gambit: vote for
+                       yes' Cast your opinion in the currently open
+                       vote. Only one vote is allowed per person,
+                       voting again changes your vote."""
         self.help_name = "vote for"
-        self.syntax = "gambit: vote for <option>"
+        self.syntax = "gambit: vote [#<number>] for <option>"
 
 
-    def parse(self, bot, message, user_priv):
-        re_cast = re.compile("^gambit[:,]? vote for (.+)$", re.IGNORECASE)
-        res = re_cast.match(message)
-        if res is None or bot.vote is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_cast = re.compile("^gambit[:,]? vote{} for (.+)$".format(re_vote_id), re.IGNORECASE)
+        res = re_cast.match(ctx.text)
+        if res is None:
             return False
-        self.cmd_args['option'] = res.groups()[0]
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['vote_id'], ctx.args['option'] = res.groups()
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing Cast Vote")
-            resolved = resolve_nick(self.bot.db, self.bot.user.full_name)
-            success = self.bot.vote.vote(resolved, self.cmd_args['option'])
+            ctx.bot.log.info("Executing Cast Vote")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
+            resolved = resolve_nick(ctx.bot.db, ctx.user.full_name)
+            success = vote.vote(ctx.bot.db, ctx.user.full_name, ctx.args['option'])
             if success:
-                self.bot.say("{} voted for {}".format(resolved, self.cmd_args['option']))
+                ctx.say("{} voted for {}".format(resolved, ctx.args['option']))
+            else:
+                ctx.say("That's not an option!")
+        except Exception as error:
+            ctx.bot.log.warn("Error in Cast Vote:\n{}".format(error))
+
+
+class RetractVote(Command):
+    """ Retract Vote
+        Take back a vote someone has cast
+    """
+
+    keywords = ['retract']
+
+    def __init__(self):
+        self.help = """Retract Vote Command - example 'gambit: retract
+                       vote' Take back the vote you cast in the
+                       currently open vote."""
+        self.help_name = "retract vote"
+        self.syntax = "gambit: retract vote [#<number>]"
+
+
+    def parse(self, ctx):
+        re_retract = re.compile("^gambit[:,]? retract vote{}$".format(re_vote_id), re.IGNORECASE)
+        res = re_retract.match(ctx.text)
+        if res is None:
+            return False
+        ctx.args['vote_id'] = res.groups()[0]
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Executing Retract Vote")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
+            resolved = resolve_nick(ctx.bot.db, ctx.user.full_name)
+            if vote.retract(ctx.bot.db, ctx.user.full_name):
+                ctx.say("{} took back their vote".format(resolved))
             else:
-                self.bot.say("That's not an option!")
+                ctx.say("You haven't voted!")
         except Exception as error:
-            self.bot.log.warn("Error in Cast Vote:\n{}".format(error))
+            ctx.bot.log.warn("Error in Retract Vote:\n{}".format(error))
 
 
 class EndVote(Command):
     """ End Vote
-        Finish off the current vote and have the bot state who won
+        Finish off a vote and have the bot state who won
     """
 
+    keywords = ['end']
+
     def __init__(self):
-        self.help = """End Vote Command - example: 'gambit: end vote' 
+        self.help = """End Vote Command - example: 'gambit: end vote'
                        ends the current vote if you have the right
                        permission and outputs the winner."""
         self.help_name = "end vote"
-        self.syntax = "gambit: end vote"
+        self.syntax = "gambit: end vote [#<number>]"
 
 
-    def parse(self, bot, message, user_priv):
-        re_end = re.compile("^gambit[:,]? end vote$", re.IGNORECASE)
-        res = re_end.match(message)
-        if res is None or bot.vote is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_end = re.compile("^gambit[:,]? end vote{}$".format(re_vote_id), re.IGNORECASE)
+        res = re_end.match(ctx.text)
+        if res is None:
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['vote_id'] = res.groups()[0]
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Executing End Vote")
-            winner = self.bot.vote.end_vote(self.bot, self.user_priv)
-            # If everyone chose the winner of the vote to be "invalid"
-            # the vote never ends, and that's kind of shitty... on the
-            # other hand... who votes for "invalid"?
-            if winner == 'invalid':
-                self.bot.say("You don't have permission to end the vote")
-                return # At least its better than voting for Trump...
-            elif winner is None:
-                self.bot.say("No one voted!?!? Lame, ending with no winner")
-            else:
-                self.bot.say("The votes are in! The winner is: {}".format(winner))
-            self.bot.vote = None
+            ctx.bot.log.info("Executing End Vote")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
+            code, winner = vote.end_vote(ctx.bot.db, ctx.user_priv)
+            if code == 1:
+                ctx.say("You don't have permission to end the vote")
+                return
+            if code == 2:
+                ctx.say("That vote has already ended.")
+                return
+            if vote.timer_id is not None:
+                ctx.bot.timers.cancel(vote.timer_id)
+            ctx.say(self._announce(vote, winner))
+        except Exception as error:
+            ctx.bot.log.warn("Error in End Vote:\n{}".format(error))
+
+
+    def on_timer(self, bot, payload):
+        """ On Timer
+            Close a vote whose time is up, unless someone already ended it
+        """
+        try:
+            bot.log.info("Executing End Vote for vote #{}".format(payload['vote_id']))
+            vote = Vote.find(bot.db, payload['conversation_id'], payload['vote_id'])
+            if vote is None:
+                return
+            code, winner = vote.end_vote(bot.db, float('inf'))
+            if code != 0:
+                return
+            bot.say(self._announce(vote, winner), bot.conv_list.get(payload['conversation_id']))
         except Exception as error:
-            self.bot.log.warn("Error in End Vote:\n{}".format(error))
+            bot.log.warn("Error in End Vote:\n{}".format(error))
+
+
+    def _announce(self, vote, winner):
+        if winner is None:
+            return "No one voted in #{}!?!? Lame, ending with no winner".format(vote.vote_id)
+        return "The votes are in for #{} {} The winner is: {}".format(vote.vote_id, vote.question, winner)
 
 
 class ShowVoteOptions(Command):
     """ Show Vote Options
-        Show all options currently permitted in the vote. Hopefully
+        Show all options currently permitted in a vote. Hopefully
         there's more than one. I'm not if sure gambit is a legitimate
         polling system in the democratic people's republic of north
         korea.
     """
 
+    keywords = ['show']
+
     def __init__(self):
-        self.help = """Show Vote Options Command - Example 'gambit: 
-                       show vote options'. Show all allowed options in 
+        self.help = """Show Vote Options Command - Example 'gambit:
+                       show vote options'. Show all allowed options in
                        the current vote."""
         self.help_name = "show vote options"
-        self.syntax = "gambit: show vote options"
+        self.syntax = "gambit: show vote [#<number>] options"
 
 
-    def parse(self, bot, message, user_priv):
-        re_show = re.compile("^gambit[:,]? show vote options$", re.IGNORECASE)
-        res = re_show.match(message)
-        if res is None or bot.vote is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_show = re.compile("^gambit[:,]? show vote{} options$".format(re_vote_id), re.IGNORECASE)
+        res = re_show.match(ctx.text)
+        if res is None:
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['vote_id'] = res.groups()[0]
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Exectuing Show Vote Options.")
+            ctx.bot.log.info("Exectuing Show Vote Options.")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
             response = ''
-            for option in self.bot.vote.options:
+            for option, tally in vote.options(ctx.bot.db):
                 response += option + '\n'
-            self.bot.say(response)
+            ctx.say(response)
         except Exception as error:
-            self.bot.log.warn("Error in Show Vote Options:\n{}".format(error))
+            ctx.bot.log.warn("Error in Show Vote Options:\n{}".format(error))
 
 
 class ShowVotes(Command):
     """ Show Votes
-        Show all currently placed votes
+        Show the running tally of a vote and everyone's votes
     """
 
+    keywords = ['show']
+
     def __init__(self):
-        self.help = """Show Votes Command - Example 'gambit: show 
-                       votes' Show all currently placed votes."""
+        self.help = """Show Votes Command - Example 'gambit: show
+                       votes' Show how many votes each option has so
+                       far and who voted for what."""
         self.help_name = "show votes"
-        self.syntax =  "gambit: show vote options"
+        self.syntax =  "gambit: show votes [#<number>]"
 
 
-    def parse(self, bot, message, user_priv):
-        re_show = re.compile("^gambit[:,]? show votes$", re.IGNORECASE)
-        res = re_show.match(message)
-        if res is None or bot.vote is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_show = re.compile("^gambit[:,]? show votes{}$".format(re_vote_id), re.IGNORECASE)
+        res = re_show.match(ctx.text)
+        if res is None:
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
+        ctx.args['vote_id'] = res.groups()[0]
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Exectuing Show Votes.")
+            ctx.bot.log.info("Exectuing Show Votes.")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
             response = ''
-            for voter in self.bot.vote.votes.keys():
-                response += '{} voted for {}\n'.format(voter, self.bot.vote.votes[voter])
-            self.bot.say(response)
+            for option, tally in vote.options(ctx.bot.db):
+                response += '{}: {}\n'.format(option, tally)
+            for voter, option in vote.ballots(ctx.bot.db):
+                response += '{} voted for {}\n'.format(resolve_nick(ctx.bot.db, voter), option)
+            ctx.say(response)
         except Exception as error:
-            self.bot.log.warn("Error in Show Votes:\n{}".format(error))
+            ctx.bot.log.warn("Error in Show Votes:\n{}".format(error))
 
 
 class ShowVoteQuestion(Command):
     """ Show Vote Question
-        State the question be decided by the current vote
+        State the question be decided by a vote
     """
 
+    keywords = ['show']
+
     def __init__(self):
-        self.help = """Show Vote Question Command - Example 'gambit: 
-                       show vote question' show the question being 
+        self.help = """Show Vote Question Command - Example 'gambit:
+                       show vote question' show the question being
                        answered by the current vote."""
         self.help_name = "show vote question"
-        self.syntax =  "gambit: show vote question"
+        self.syntax =  "gambit: show vote [#<number>] question"
+
+
+    def parse(self, ctx):
+        re_show = re.compile("^gambit[:,]? show vote{} question$".format(re_vote_id), re.IGNORECASE)
+        res = re_show.match(ctx.text)
+        if res is None:
+            return False
+        ctx.args['vote_id'] = res.groups()[0]
+        return True
+
+
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
+        try:
+            ctx.bot.log.info("Exectuing Show Vote Question.")
+            vote = Vote.find(ctx.bot.db, ctx.conversation.id_, ctx.args['vote_id'])
+            if vote is None:
+                ctx.say("There's no vote going on.")
+                return
+            response = vote.question
+            if vote.ends_at is not None:
+                response += "\nVoting closes {}".format(strftime('%b %d at %H:%M UTC', gmtime(vote.ends_at)))
+            ctx.say(response)
+        except Exception as error:
+            ctx.bot.log.warn("Error in Show Vote Question:\n{}".format(error))
+
+
+class ShowOpenVotes(Command):
+    """ Show Open Votes
+        List every vote still going on in the conversation
+    """
+
+    keywords = ['show']
+
+    def __init__(self):
+        self.help = """Show Open Votes Command - Example 'gambit: show
+                       open votes' list the number and question of
+                       every vote going on."""
+        self.help_name = "show open votes"
+        self.syntax =  "gambit: show open votes"
 
 
-    def parse(self, bot, message, user_priv):
-        re_show = re.compile("^gambit[:,]? show vote question$", re.IGNORECASE)
-        res = re_show.match(message)
-        if res is None or bot.vote is None:
-            self.parsed = False
+    def parse(self, ctx):
+        re_show = re.compile("^gambit[:,]? show open votes$", re.IGNORECASE)
+        res = re_show.match(ctx.text)
+        if res is None:
             return False
-        self.bot = bot
-        self.user_priv = user_priv
-        self.parsed = True
         return True
 
 
-    def execute(self):
-        if not self.parsed: return
-        if self.user_priv < self.cmd_priv: return
+    def execute(self, ctx):
+        if ctx.user_priv < self.cmd_priv: return
         try:
-            self.bot.log.info("Exectuing Show Vote Question.")
-            self.bot.say(self.bot.vote.question)
+            ctx.bot.log.info("Exectuing Show Open Votes.")
+            votes = Vote.open_votes(ctx.bot.db, ctx.conversation.id_)
+            if not votes:
+                ctx.say("There's no vote going on.")
+                return
+            ctx.say('\n'.join('#{} {}'.format(vote_id, question) for vote_id, question in votes))
         except Exception as error:
-            self.bot.log.warn("Error in Show Vote Question:\n{}".format(error))
+            ctx.bot.log.warn("Error in Show Open Votes:\n{}".format(error))
@@ -0,0 +1,106 @@
+import asyncio
+from collections import deque
+
+
+class ConversationQueues:
+    """ Conversation Queues
+        Hand each conversation's messages to its own worker so messages in a
+        conversation are processed in order while conversations are
+        processed in parallel. Queues are bounded; when one is full either
+        its oldest ambient message (one not addressed to gambit) is dropped
+        to make room or the new message is rejected. Workers which sit idle
+        are reaped and recreated on the conversation's next message
+    """
+
+    DROP_AMBIENT = 'drop_ambient'
+    REJECT = 'reject'
+
+    def __init__(self, handler, log, max_depth=50, overflow=DROP_AMBIENT, idle_timeout=300):
+        self.handler = handler
+        self.log = log
+        self.max_depth = max_depth
+        self.overflow = overflow
+        self.idle_timeout = idle_timeout
+        self.workers = {}
+
+
+    def submit(self, conversation_id, item, ambient=False):
+        """ Submit
+            Queue an item for the conversation's worker, starting the worker
+            if need be. Return whether or not the item was accepted
+        """
+        worker = self.workers.get(conversation_id)
+        if worker is None:
+            worker = ConversationWorker(self, conversation_id)
+            self.workers[conversation_id] = worker
+        return worker.put(item, ambient)
+
+
+    def depth(self, conversation_id):
+        """ Depth
+            Return how many items are waiting in a conversation's queue
+        """
+        worker = self.workers.get(conversation_id)
+        return len(worker.pending) if worker else 0
+
+
+class ConversationWorker:
+    """ Conversation Worker
+        Process the queued items of a single conversation one at a time
+    """
+
+    def __init__(self, queues, conversation_id):
+        self.queues = queues
+        self.conversation_id = conversation_id
+        self.pending = deque()
+        self.ready = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+
+    def put(self, item, ambient):
+        """ Put
+            Add an item to the queue, applying the overflow policy if the
+            queue is full
+        """
+        if len(self.pending) >= self.queues.max_depth:
+            if not self._make_room():
+                self.queues.log.warn('Queue full for conversation {}, rejecting message'.format(
+                    self.conversation_id))
+                return False
+        self.pending.append((item, ambient))
+        self.ready.set()
+        return True
+
+
+    async def run(self):
+        """ Run
+            Work through the queue until it has been idle long enough to
+            reap the worker
+        """
+        while True:
+            if not self.pending:
+                self.ready.clear()
+                try:
+                    await asyncio.wait_for(self.ready.wait(), self.queues.idle_timeout)
+                except asyncio.TimeoutError:
+                    if not self.pending:
+                        del self.queues.workers[self.conversation_id]
+                        return
+                continue
+            item, ambient = self.pending.popleft()
+            try:
+                await self.queues.handler(item)
+            except Exception as error:
+                self.queues.log.warn('Error in conversation worker:\n{}'.format(error))
+
+
+    def _make_room(self):
+        if self.queues.overflow != ConversationQueues.DROP_AMBIENT:
+            return False
+        for queued in self.pending:
+            if queued[1]:
+                self.pending.remove(queued)
+                self.queues.log.warn('Queue full for conversation {}, dropped an ambient message'.format(
+                    self.conversation_id))
+                return True
+        return False
@@ -5,13 +5,24 @@ import re
 import sqlite3
 import os
 import sys
-import glob
-import importlib
-import inspect
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from hangups.bot.commands.command import Command
+from hangups.bot.commands.command import MessageContext
 from hangups.bot.commands import *
-from hangups.bot.commands.util import update_honorifics
+from hangups.bot.commands.util import Honorifics
+from hangups.bot.router import CommandRouter
+from hangups.bot.dispatch import ConversationQueues
+from hangups.bot.sender import SendPipeline
+from hangups.bot.images import ImageCache
+from hangups.bot.titles import TitleCache
+from hangups.bot.loader import CommandLoader
+from hangups.bot.migrations import migrate
+from hangups.bot.ratelimit import RateLimiter
+from hangups.bot.history import MessageHistory
+from hangups.bot.timers import TimerService
+from hangups.bot.catalog import CommandCatalog
 
 class Gambit:
     """ Gambit Hangouts Bot
@@ -29,10 +40,39 @@ class Gambit:
     bot_src = root_dir + "bot/"
     image_src = bot_src + "images/"
     log_dir = "/var/"
-    vote = None
-    last_message = {}
     ids = {}
     cmd_list = {}
+    # Stop dispatching a message after the first command that accepts it
+    first_match = False
+    # Pools for commands that haven't been made asynchronous and for CPU
+    # heavy work respectively
+    worker_threads = 4
+    worker_processes = 2
+    # Messages waiting per conversation, what to do when a conversation
+    # falls that far behind ('drop_ambient' or 'reject') and how many
+    # seconds an idle conversation's worker sticks around
+    queue_depth = 50
+    queue_overflow = ConversationQueues.DROP_AMBIENT
+    idle_worker_timeout = 300
+    # Seconds to wait for more lines to coalesce into one message, how many
+    # sends can be out at once and how many times to retry a failed send
+    send_window = 0.25
+    max_sends_in_flight = 4
+    send_retries = 3
+    # How many link titles to keep in memory and how many seconds to trust a
+    # title, or a page not having one, before fetching it again
+    title_cache_size = 512
+    title_ttl = 24 * 60 * 60
+    failed_title_ttl = 60 * 60
+    # Seconds between saving commands' rate limits to the database
+    rate_limit_snapshot = 60
+    # Messages remembered per conversation and across every conversation,
+    # and how many seconds a quiet conversation's messages are kept
+    history_length = 50
+    max_history = 5000
+    history_idle = 24 * 60 * 60
+    # Seconds between clearing expired link titles out of the database
+    title_purge_interval = 60 * 60
 
     def __init__(self, client, conversation_list):
         """ init
@@ -49,57 +89,91 @@ class Gambit:
             self.log.setLevel(logging.INFO)
             # Initialize the database
             self.log.info('Connecting to gambit.db...')
-            self.db = sqlite3.connect(self.bot_src + 'gambit.db')
+            self.db_path = self.bot_src + 'gambit.db'
+            self.local = threading.local()
+            migrate(self.db, self.log)
+            # Commands run off of the event loop, so set up where they run
+            self.loop = asyncio.get_event_loop()
+            self.threads = ThreadPoolExecutor(self.worker_threads)
+            self.processes = ProcessPoolExecutor(self.worker_processes)
+            self.queues = ConversationQueues(self.handle_message, self.log, self.queue_depth,
+                    self.queue_overflow, self.idle_worker_timeout)
+            # Running counts of how the bot's caches and such are doing
+            self.stats = Counter()
+            self.titles = TitleCache(self, self.title_cache_size, self.title_ttl,
+                    self.failed_title_ttl)
+            self.titles.load()
+            # Rate limits pick up where they left off before a restart
+            self.limits = RateLimiter()
+            self.limits.load(self.db)
             # Specify our initial state
             self.karma = {}
+            self.members = None # (user id, conversation id) -> full name of every known user
+            self.history = MessageHistory(self.history_length, self.max_history)
+            self.honorifics = Honorifics()
             self.update_users(conversation_list.get_all())
             for conversation in conversation_list.get_all():
                 self.karma[conversation.id_] = True
-                update_honorifics(self.db, conversation.id_)
             self.client = client
             self.conv_list = conversation_list
+            # Images are validated up front and only uploaded once
+            self.images = ImageCache(client, self.image_src, self.log)
+            self.images.load()
+            self.sender = SendPipeline(self.loop, self._on_message_sent, self.images,
+                    self.send_window, self.max_sends_in_flight, self.send_retries)
             # Add our commands to the command list
             self.init_commands()
             self.load_admins()
+            # Timers left over from before a restart, and the housekeeping
+            self.timers = TimerService(self)
+            self.timers.load()
+            self.timers.every(self.rate_limit_snapshot, self.save_limits)
+            self.timers.every(self.title_purge_interval, self.titles.purge)
+            self.timers.every(self.history_idle / 24, self.forget_idle_history)
         except Exception as error:
             if 'log' in dir(self):
                 self.log.warn('Error while initializing:\n{}'.format(error))
 
 
+    @property
+    def db(self):
+        """ DB
+            Return the calling thread's connection to gambit.db. Commands
+            running in the thread pool can't share the event loop's
+            connection, so each thread opens its own
+        """
+        conn = getattr(self.local, 'db', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            self.local.db = conn
+        return conn
+
+
     def init_commands(self):
         """ Init Commands
-            Import any classes in the command directory that extends
-            the command superclass and add them to the command list
+            Find every class in the command directory that extends the
+            command superclass, register them all with the database in one
+            go and add them to the command list. Command modules are only
+            imported once one of their commands is needed
         """
+        self.router = CommandRouter(self.first_match)
         command_directory = os.path.join(os.path.dirname(os.path.abspath(self.bot_src + 'commands/command.py')))
         sys.path.append(command_directory)
-        for file in glob.glob(command_directory + '/*.py'):
-            name = os.path.splitext(os.path.basename(file))[0]
-            # Filter out __ files
-            if name.startswith('__'):
-                continue
-            module = importlib.import_module(name)
-            for member in dir(module):
-                # We don't want to have the Command class in our list
-                if member == 'Command': continue
-                handler_class = getattr(module, member)
-                # Handle weird cases to make sure its a command
-                if not inspect.isclass(handler_class): continue
-                if not issubclass(handler_class, Command): continue
-                if handler_class:
-                    # Add the command to the database if it's not already there
-                    exists = self.db.execute("SELECT COUNT(*) FROM commands WHERE name = ?", 
-                            (handler_class.__name__,))
-                    exists = exists.fetchone()[0] > 0
-                    if not exists:
-                        self.db.execute("INSERT INTO commands (name) VALUES (?)",
-                                (handler_class.__name__,))
-                        self.db.commit()
-                    cmd_priv = self.db.execute("SELECT privilege FROM commands WHERE name == ?", 
-                            (handler_class.__name__,))
-                    cmd_priv = cmd_priv.fetchone()[0]
-                    self.cmd_list[handler_class()] = cmd_priv
-    
+        loader = CommandLoader(command_directory, self.bot_src + 'manifest.json', self.log)
+        commands = loader.load()
+        # Add any commands not already in the database, then read back every
+        # command's privilege at once
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO commands (name) VALUES (?)",
+                    [(cmd.name,) for cmd in commands])
+        privileges = dict(self.db.execute("SELECT name, privilege FROM commands").fetchall())
+        for cmd in commands:
+            self.cmd_list[cmd] = privileges[cmd.name]
+            self.router.add(cmd)
+        self.router.build()
+        # What help and the command list show, by privilege
+        self.catalog = CommandCatalog(self.cmd_list)
+
 
     def load_admins(self):
         """ Load Admins
@@ -118,11 +192,19 @@ class Gambit:
             it was set over, then prepare the bot to process and respond to
             what was said
         """
+        ambient = not self.router.is_addressed(message)
+        self.queues.submit(conversation.id_, (user, message, conversation), ambient)
+
+
+    async def handle_message(self, item):
+        """ Handle Message
+            Run by a conversation's worker for each of its messages in the
+            order they were received. Messages from different conversations
+            are handled concurrently
+        """
+        user, message, conversation = item
         try:
-            self.user = user
-            self.message = message
-            self.conversation = conversation
-            if self.user.full_name == 'Unknown':
+            if user.full_name == 'Unknown':
                 db_user = self.db.execute("SELECT full_name FROM users WHERE user_id = ? AND conversation_id = ?",
                         (user.id_[0], conversation.id_))
                 db_user = db_user.fetchall()
@@ -130,68 +212,122 @@ class Gambit:
                     user.full_name = db_user[0][0]
                     user.first_name = db_user[0][0].split(' ')[0]
             self.log.info('Received message:')
-            self.log.info('\tuser: {}'.format(self.user.full_name))
-            self.log.info('\tmessage: {}'.format(self.message))
+            self.log.info('\tuser: {}'.format(user.full_name))
+            self.log.info('\tmessage: {}'.format(message))
             if user.is_self: return # Ignore responses from the bot itself
-            self.process_request()
+            user_priv = 0
+            res = self.db.execute("SELECT privilege FROM users WHERE user_id = ? AND conversation_id = ?",
+                                  (user.id_[0], conversation.id_)).fetchall()
+            if len(res) > 0:
+                user_priv = res[0][0]
+            if user.full_name in self.admins: user_priv = float('inf')
+            ctx = MessageContext(self, user, conversation, message, user_priv, None)
+            await self.process_request(ctx)
         except Exception as error:
             self.log.warn('Error parsing message:\n{}'.format(error))
 
 
-    def process_request(self):
+    async def process_request(self, ctx):
         """ Process Request
-            Look through the bot's list of commands and determine which, if
-            any, the last message sent matches. If a match is found, execute
-            the command
-        """
-        user_priv = 0
-        res = self.db.execute("SELECT privilege FROM users WHERE user_id = ? AND conversation_id = ?",
-                              (self.user.id_[0], self.conversation.id_)).fetchall()
-        if len(res) > 0:
-            user_priv = res[0][0]
-        if self.user.full_name in self.admins: user_priv = float('inf')
+            Ask the router which commands could match the message and
+            determine which, if any, it actually matches. If a match is
+            found, execute the command
+        """
         was_cmd = False
-        for cmd in self.cmd_list.keys():
+        for cmd in self.router.route(ctx.text):
             try:
-                is_valid = cmd.parse(self, self.message, user_priv)
+                cmd_ctx = ctx.with_args({})
+                is_valid = cmd.parse(cmd_ctx)
                 was_cmd |= is_valid
                 if is_valid:
                     if cmd.cmd_priv != float('inf'):
                         cmd.cmd_priv = self.cmd_list[cmd]
-                    cmd.execute()
-                cmd.cmd_args = {} # Clear the arguments
-                cmd.parsed = False
+                    if cmd.rate_limit is not None and \
+                            not self.limits.allow(self.limits.key(cmd, cmd_ctx), *cmd.rate_limit):
+                        self.log.info('Rate limited {} for {}'.format(cmd.name, ctx.user.full_name))
+                        self.stats['rate limited'] += 1
+                    else:
+                        await self.execute_command(cmd, cmd_ctx)
             except Exception as error:
-                self.log.warn("Error: {} in command {}. Ignoring.".format(error, cmd.__class__.__name__))
-        # Add the message to the last message dictionary
-        self.last_message[self.user.full_name] = self.message
+                self.log.warn("Error: {} in command {}. Ignoring.".format(error, cmd.name))
+            if was_cmd and self.router.first_match:
+                break
+        # Remember the message for commands which look back at the conversation
+        self.history.add(ctx.conversation.id_, ctx.user.full_name, ctx.text)
         # Map user name to ID for resolving unknowns
-        if self.conversation.id_ not in self.ids.keys():
-            self.ids[self.conversation.id_] = {}
-        self.ids[self.conversation.id_][self.user.full_name] = self.user.id_[0]
+        if ctx.conversation.id_ not in self.ids.keys():
+            self.ids[ctx.conversation.id_] = {}
+        self.ids[ctx.conversation.id_][ctx.user.full_name] = ctx.user.id_[0]
 
 
-    def say(self, text, conversation=None):
-        """ Say
-            Output some set of text in a specified (or most recent) conversation
-        """
-        if not conversation:
-            conversation = self.conversation
-        if len(text) == 0:
-            return
-        elif text.startswith('/image') and len(text.split(' ')) == 2:
-            filename = text.split(' ')[1]
-            image_file = open(filename, 'rb')
-            text = ''
+    async def execute_command(self, cmd, ctx):
+        """ Execute Command
+            Await commands which define execute as a coroutine and run the
+            rest in the thread pool so their blocking calls never hold up the
+            event loop
+        """
+        if asyncio.iscoroutinefunction(cmd.execute):
+            await cmd.execute(ctx)
         else:
-            image_file = None
-        segments = hangups.ChatMessageSegment.from_str(text)
-        asyncio.async(
-            conversation.send_message(segments, image_file=image_file)
-        ).add_done_callback(self._on_message_sent)
+            await self.loop.run_in_executor(self.threads, cmd.execute, ctx)
+
+
+    def run_blocking(self, func, *args):
+        """ Run Blocking
+            Run a blocking function in the thread pool and return a future
+            for its result
+        """
+        return self.loop.run_in_executor(self.threads, func, *args)
 
 
-    def send_private_message(self, user, text):
+    def run_in_process(self, func, *args):
+        """ Run In Process
+            Run a CPU heavy function in the process pool and return a future
+            for its result. The function and its arguments must be picklable
+        """
+        return self.loop.run_in_executor(self.processes, func, *args)
+
+
+    async def on_timer(self, owner, payload):
+        """ On Timer
+            Hand a timer which has gone off to the command it belongs to
+        """
+        for cmd in self.cmd_list:
+            if cmd.name == owner:
+                if asyncio.iscoroutinefunction(cmd.on_timer):
+                    await cmd.on_timer(self, payload)
+                else:
+                    await self.loop.run_in_executor(self.threads, cmd.on_timer, self, payload)
+                return
+        self.log.warn('No command {} for timer {}'.format(owner, payload))
+
+
+    def save_limits(self):
+        """ Save Limits
+            Save the rate limiters' buckets to the database and forget those
+            which have refilled
+        """
+        self.limits.save(self.db)
+        self.limits.evict_full()
+
+
+    def forget_idle_history(self):
+        """ Forget Idle History
+            Drop the message history of conversations which have gone quiet
+        """
+        self.history.forget_idle(self.history_idle)
+
+
+    def say(self, text, conversation):
+        """ Say
+            Output some set of text in a specified conversation through the
+            send pipeline. Safe to call from commands running in the thread
+            pool
+        """
+        self.loop.call_soon_threadsafe(self.sender.enqueue, conversation, text)
+
+
+    def send_private_message(self, user, text, conversation):
         """ Send Private Message
             Send an individual user in a conversation a private message
         """
@@ -211,7 +347,7 @@ class Gambit:
                 """
                 # We'll leave this commented in case we figure out a way to do it
                 self.log.info("Conversation does not yet exist with user")
-                self.say("You need to message me first!")
+                self.say("You need to message me first!", conversation)
                 return
             self.log.info("Sending PM")
             self.say(text, conv)
@@ -230,24 +366,49 @@ class Gambit:
     def update_users(self, conversations):
         """ Update Users
             Given a list of conversations - add any users the bot
-            is not yet familiar other than 'Unknown's to the database
+            is not yet familiar other than 'Unknown's to the database, and
+            update the full names of any who have changed theirs.
+            Membership is compared against a snapshot of who the bot
+            already knows, so only new or changed members are written, all
+            at once
         """
+        if self.members is None:
+            rows = self.db.execute("SELECT user_id, conversation_id, full_name FROM users").fetchall()
+            self.members = {(user_id, conversation_id): full_name for user_id, conversation_id, full_name in rows}
+        changed_users = []
         for conversation in conversations:
             for user in conversation.users:
-                exists = self.db.execute("SELECT COUNT(*) FROM users WHERE user_id = ? AND conversation_id = ?", (user.id_[0], conversation.id_,))
-                exists = exists.fetchone()[0] > 0
                 if user.full_name == 'Unknown' or user.full_name == 'Gambit Bot':
                     continue
-                if not exists: # Add the user to the database
-                    self.db.execute("INSERT INTO users (user_id, conversation_id, full_name) VALUES(?, ?, ?)", (user.id_[0], conversation.id_, user.full_name,))
-                    self.db.commit()
+                member = (user.id_[0], conversation.id_)
+                if self.members.get(member) != user.full_name:
+                    changed_users.append(member + (user.full_name,))
+                    self.members[member] = user.full_name
+        if changed_users:
+            with self.db:
+                self.db.executemany("INSERT INTO users (user_id, conversation_id, full_name) VALUES(?, ?, ?) " \
+                        + "ON CONFLICT(user_id, conversation_id) DO UPDATE SET full_name = excluded.full_name",
+                        changed_users)
+            # Names and rankings within a conversation depend on who is in
+            # it. The commands share the util loaded from the command
+            # directory, which has nothing cached until they've been loaded
+            util = sys.modules.get('util')
+            if util is not None:
+                util.names.invalidate()
+                util.leaderboard.invalidate()
+        # Rank the karma of any conversations we haven't seen before
+        for conversation in conversations:
+            if conversation.id_ not in self.honorifics.rooms:
+                self.honorifics.load(self.db, conversation.id_)
 
 
-    def _on_message_sent(self, future):
+    def _on_message_sent(self, batch, future):
         """ On Message Sent
-            Catch whether or not the last message sent properly
+            Catch whether or not the last message sent properly and hand the
+            result back to the send pipeline to retry or move on
         """
-        try:
-            future.result()
-        except Exception as err:
-            self.log.warn('Failure when sending message:\n{}'.format(err))
+        if future.cancelled():
+            self.log.warn('Message send was cancelled')
+        elif future.exception():
+            self.log.warn('Failure when sending message:\n{}'.format(future.exception()))
+        self.sender.settle(batch, future)
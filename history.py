@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+
+Message = namedtuple('Message', ['full_name', 'text', 'sent_at'])
+
+
+class MessageHistory:
+    """ Message History
+        The last few messages said in each conversation, who said them and
+        when, for commands which act on something already said (quoting,
+        substitution, ...). Each conversation keeps a ring of its latest
+        messages, and once the bot holds more than its limit in total the
+        conversations which have been quiet the longest are forgotten
+    """
+
+    def __init__(self, per_conversation=50, max_messages=5000):
+        self.per_conversation = per_conversation
+        self.max_messages = max_messages
+        self.lock = threading.Lock()
+        self.conversations = OrderedDict() # conversation id -> deque of messages
+        self.size = 0
+
+
+    def add(self, conversation_id, full_name, text):
+        """ Add
+            Record a message said in a conversation
+        """
+        with self.lock:
+            messages = self.conversations.get(conversation_id)
+            if messages is None:
+                messages = deque(maxlen=self.per_conversation)
+                self.conversations[conversation_id] = messages
+            self.conversations.move_to_end(conversation_id)
+            if len(messages) < messages.maxlen:
+                self.size += 1
+            messages.append(Message(full_name, text, time.time()))
+            while self.size > self.max_messages and len(self.conversations) > 1:
+                _, evicted = self.conversations.popitem(last=False)
+                self.size -= len(evicted)
+
+
+    def forget_idle(self, max_age):
+        """ Forget Idle
+            Forget conversations nobody has said anything in for max_age
+            seconds
+        """
+        cutoff = time.time() - max_age
+        with self.lock:
+            while self.conversations:
+                conversation_id, messages = next(iter(self.conversations.items()))
+                if messages[-1].sent_at >= cutoff:
+                    break
+                del self.conversations[conversation_id]
+                self.size -= len(messages)
+
+
+    def last(self, conversation_id, full_name=None, k=1, where=None):
+        """ Last
+            Return the k-th most recent message in a conversation, only
+            counting those said by full_name (if given, ignoring case) and
+            those where returns True (if given). None if there aren't that
+            many
+        """
+        if k < 1:
+            return None
+        for message in self.recent(conversation_id):
+            if full_name is not None and message.full_name.lower() != full_name.lower():
+                continue
+            if where is not None and not where(message):
+                continue
+            k -= 1
+            if k == 0:
+                return message
+        return None
+
+
+    def recent(self, conversation_id, count=None):
+        """ Recent
+            Return up to count (or all) of a conversation's latest
+            messages, newest first
+        """
+        with self.lock:
+            messages = list(self.conversations.get(conversation_id, ()))
+        messages.reverse()
+        return messages if count is None else messages[:count]
@@ -0,0 +1,98 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+
+class ImageCache:
+    """ Image Cache
+        Keep track of the images the bot can post and remember the hangups
+        image id of each one after its first upload, so posting the same
+        image again doesn't upload the whole file again. Entries are keyed
+        by path and invalidated whenever the file on disk changes
+    """
+
+    # Magic numbers of the image formats hangups will take
+    signatures = [b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a']
+
+    def __init__(self, client, image_src, log, max_entries=64, max_bytes=10 * 1024 * 1024):
+        self.client = client
+        self.image_src = image_src
+        self.log = log
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # path -> (file stamp, image id)
+        self.valid = {} # path -> file stamp of the last time it was validated
+        self.pending = {} # (path, file stamp) -> future of an upload already under way
+
+
+    def load(self):
+        """ Load
+            Validate every image in the image directory up front, logging
+            (and refusing to post) any that aren't usable
+        """
+        if not os.path.isdir(self.image_src):
+            self.log.warn('Image directory {} does not exist'.format(self.image_src))
+            return
+        for name in sorted(os.listdir(self.image_src)):
+            path = os.path.join(self.image_src, name)
+            try:
+                self._validate(path, self._stamp(path))
+            except (OSError, ValueError) as error:
+                self.log.warn('Skipping image {}:\n{}'.format(path, error))
+        self.log.info('Loaded {} images'.format(len(self.valid)))
+
+
+    async def image_id(self, path):
+        """ Image ID
+            Return the hangups image id for the image at the given path,
+            uploading it if it hasn't been or has changed since it was.
+            Images sent from several places at once are uploaded once
+        """
+        stamp = self._stamp(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            self.entries.move_to_end(path)
+            return entry[1]
+        if (path, stamp) not in self.pending:
+            self.pending[(path, stamp)] = asyncio.ensure_future(self._upload(path, stamp))
+        return await asyncio.shield(self.pending[(path, stamp)])
+
+
+    async def _upload(self, path, stamp):
+        try:
+            self._validate(path, stamp)
+            with open(path, 'rb') as image_file:
+                image_id = await self.client.upload_image(image_file, filename=os.path.basename(path))
+        finally:
+            del self.pending[(path, stamp)]
+        self.entries[path] = (stamp, image_id)
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return image_id
+
+
+    def invalidate(self, path):
+        """ Invalidate
+            Forget the uploaded id of an image so it gets uploaded again
+        """
+        self.entries.pop(path, None)
+
+
+    def _stamp(self, path):
+        info = os.stat(path)
+        return (info.st_mtime, info.st_size)
+
+
+    def _validate(self, path, stamp):
+        if self.valid.get(path) == stamp:
+            return
+        if not os.path.isfile(path):
+            raise ValueError('Not a file')
+        if stamp[1] == 0 or stamp[1] > self.max_bytes:
+            raise ValueError('Image is {} bytes'.format(stamp[1]))
+        with open(path, 'rb') as image_file:
+            header = image_file.read(8)
+        if not any(header.startswith(signature) for signature in self.signatures):
+            raise ValueError('Not a JPEG, PNG or GIF')
+        self.valid[path] = stamp
@@ -0,0 +1,160 @@
+import glob
+import importlib
+import inspect
+import json
+import os
+
+from hangups.bot.commands.command import Command
+
+
+class CommandLoader:
+    """ Command Loader
+        Find the commands in the command directory without importing them.
+        What the router and help need to know about each command (its
+        keywords, triggers, help text and so on) is kept in a manifest file,
+        keyed by the size and modification time of the module it came from,
+        and thrown away whenever the Command base class (which most of those
+        attributes default to) or the loader itself changes. Only modules
+        which are new or have changed since the manifest was written are
+        imported at startup, the rest are imported the first time one of
+        their commands is actually used
+    """
+
+    version = 3 # Bump when the manifest's layout changes
+
+    def __init__(self, command_dir, manifest_path, log):
+        self.command_dir = command_dir
+        self.manifest_path = manifest_path
+        self.log = log
+
+
+    def load(self):
+        """ Load
+            Return a LazyCommand for every command in the command directory,
+            refreshing the manifest if any of the modules have changed
+        """
+        base = self._base_stamp()
+        manifest = self._read_manifest(base)
+        modules = {}
+        changed = False
+        for file in sorted(glob.glob(os.path.join(self.command_dir, '*.py'))):
+            name = os.path.splitext(os.path.basename(file))[0]
+            # Filter out __ files
+            if name.startswith('__'):
+                continue
+            info = os.stat(file)
+            stamp = [info.st_mtime_ns, info.st_size]
+            entry = manifest.get(name)
+            if entry is None or entry['stamp'] != stamp:
+                entry = {'stamp': stamp, 'commands': self._describe(name)}
+                changed = True
+            modules[name] = entry
+        if changed or set(modules) != set(manifest):
+            self._write_manifest(base, modules)
+        commands = []
+        for name, entry in modules.items():
+            for meta in entry['commands']:
+                commands.append(LazyCommand(name, meta))
+        return commands
+
+
+    def _describe(self, name):
+        """ Describe
+            Import a module and describe each of the commands in it
+        """
+        module = importlib.import_module(name)
+        described = []
+        for member in dir(module):
+            # We don't want to have the Command class in our list
+            if member == 'Command': continue
+            handler_class = getattr(module, member)
+            # Handle weird cases to make sure its a command
+            if not inspect.isclass(handler_class): continue
+            if not issubclass(handler_class, Command): continue
+            cmd = handler_class()
+            meta = {'class': member}
+            for attr in LazyCommand.described:
+                meta[attr] = getattr(cmd, attr)
+            described.append(meta)
+        return described
+
+
+    def _base_stamp(self):
+        """ Base Stamp
+            Return the size and modification time of the files every entry
+            in the manifest depends on: the Command base class and the loader
+        """
+        stamp = []
+        for file in (inspect.getfile(Command), os.path.abspath(__file__)):
+            info = os.stat(file)
+            stamp.append([info.st_mtime_ns, info.st_size])
+        return stamp
+
+
+    def _read_manifest(self, base):
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('version') == self.version and manifest.get('base') == base:
+                return manifest['modules']
+        except (OSError, ValueError, KeyError) as error:
+            self.log.info('Rebuilding command manifest: {}'.format(error))
+        return {}
+
+
+    def _write_manifest(self, base, modules):
+        try:
+            with open(self.manifest_path, 'w') as manifest_file:
+                json.dump({'version': self.version, 'base': base, 'modules': modules}, manifest_file, indent=1)
+        except OSError as error:
+            self.log.warn('Could not write command manifest:\n{}'.format(error))
+
+
+class LazyCommand:
+    """ Lazy Command
+        Stands in for a command whose module hasn't been imported yet. The
+        attributes in the manifest are answered straight from it, anything
+        else (parse, execute, ...) imports the module and hands the request
+        to the real command
+    """
+
+    # Attributes of a command recorded in the manifest
+    described = ['keywords', 'triggers', 'whole_words', 'priority', 'help',
+                 'help_name', 'syntax', 'cmd_priv', 'rate_limit', 'rate_limit_per']
+
+    def __init__(self, module, meta):
+        self.__dict__['module'] = module
+        self.__dict__['meta'] = meta
+        self.__dict__['command'] = None
+
+
+    @property
+    def name(self):
+        return self.meta['class']
+
+
+    def load(self):
+        """ Load
+            Import the command's module (if it hasn't been already) and
+            return the real command
+        """
+        if self.command is None:
+            module = importlib.import_module(self.module)
+            command = getattr(module, self.name)()
+            command.cmd_priv = self.meta['cmd_priv']
+            self.__dict__['command'] = command
+        return self.command
+
+
+    def __getattr__(self, attr):
+        if attr in self.meta:
+            return self.meta[attr]
+        return getattr(self.load(), attr)
+
+
+    def __setattr__(self, attr, value):
+        # Privileges are changed at runtime, keep the real command in step
+        if attr in self.meta:
+            self.meta[attr] = value
+        if self.command is not None or attr not in self.meta:
+            setattr(self.load(), attr, value)
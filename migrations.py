@@ -0,0 +1,167 @@
+from hangups.bot.commands.util import net_debts
+
+
+def merge_karma_case_duplicates(db):
+    """ Merge Karma Case Duplicates
+        Fold karma targets which only differ by case into the oldest one,
+        summing their karma, so targets can be made unique regardless of case
+    """
+    duplicates = db.execute("SELECT MIN(karma_id), target, SUM(karma) FROM karma " \
+            + "GROUP BY target COLLATE NOCASE HAVING COUNT(*) > 1")
+    for karma_id, target, karma in duplicates.fetchall():
+        db.execute("DELETE FROM karma WHERE target = ? COLLATE NOCASE AND karma_id != ?",
+                (target, karma_id,))
+        db.execute("UPDATE karma SET karma = ? WHERE karma_id = ?", (karma, karma_id,))
+
+
+def open_karma_ledger(db):
+    """ Open Karma Ledger
+        Record everyone's karma before the ledger existed as an opening
+        balance, so the ledger always adds up to the totals
+    """
+    db.execute("INSERT INTO karma_ledger (target, actor, delta, source, conversation_id, changed_at) " \
+            + "SELECT target, NULL, karma, 'opening', NULL, strftime('%s', 'now') FROM karma WHERE karma != 0")
+
+
+def net_old_debts(db):
+    """ Net Old Debts
+        Net the debts from before they were kept per conversation against
+        each other, drop the ones which have been paid off, and move the
+        rest into a conversation the lender and borrower are both in. Debts
+        between people who share no conversation are left without one
+    """
+    debts = db.execute("SELECT lender, borrower, amount FROM debt WHERE conversation_id IS NULL").fetchall()
+    db.execute("DELETE FROM debt WHERE conversation_id IS NULL")
+    for lender, borrower, amount in net_debts(debts):
+        shared = db.execute("SELECT a.conversation_id FROM users a JOIN users b " \
+                + "ON a.conversation_id = b.conversation_id " \
+                + "WHERE (a.nickname = ? COLLATE NOCASE OR a.full_name = ? COLLATE NOCASE) " \
+                + "AND (b.nickname = ? COLLATE NOCASE OR b.full_name = ? COLLATE NOCASE) " \
+                + "ORDER BY a.conversation_id LIMIT 1", (lender, lender, borrower, borrower,)).fetchone()
+        db.execute("INSERT INTO debt (lender, borrower, amount, conversation_id) VALUES (?, ?, ?, ?)",
+                (lender, borrower, amount, shared[0] if shared else None,))
+
+
+def add_column(table, column, declaration):
+    """ Add Column
+        Return a migration step adding a column to a table, unless it's
+        already there (as it is in a database made from schema.sql)
+    """
+    def step(db):
+        columns = [info[1] for info in db.execute("PRAGMA table_info({})".format(table))]
+        if column not in columns:
+            db.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, declaration))
+    return step
+
+
+# Every change to the schema of an existing gambit.db, in order. A migration
+# is a list of statements and functions taking the connection, and is
+# applied once, in a single transaction. Never edit or reorder migrations
+# which have shipped, only add new ones to the end (and to schema.sql)
+migrations = [
+    ('Add url title cache', [
+        """CREATE TABLE IF NOT EXISTS url_titles (
+            url TEXT PRIMARY KEY, title TEXT, expires REAL NOT NULL)""",
+    ]),
+    ('Add case-insensitive lookup indexes', [
+        merge_karma_case_duplicates,
+        "CREATE UNIQUE INDEX IF NOT EXISTS karma_target ON karma (target COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS aliases_old ON aliases (old COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS users_nickname ON users (nickname COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS users_full_name ON users (full_name COLLATE NOCASE, conversation_id)",
+        "CREATE INDEX IF NOT EXISTS quotes_said_by ON quotes (said_by COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS debt_lender_borrower ON debt (lender, borrower)",
+    ]),
+    ('Add leaderboard indexes', [
+        "CREATE INDEX IF NOT EXISTS karma_karma ON karma (karma, target)",
+        "CREATE INDEX IF NOT EXISTS users_conversation ON users (conversation_id, nickname)",
+    ]),
+    ('Add joke type index', [
+        "CREATE INDEX IF NOT EXISTS jokes_type ON jokes (type)",
+    ]),
+    ('Add karma ledger and daily rollups', [
+        """CREATE TABLE IF NOT EXISTS karma_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT, target TEXT NOT NULL, actor TEXT,
+            delta INTEGER NOT NULL, source TEXT NOT NULL, conversation_id TEXT,
+            changed_at REAL NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS karma_ledger_target ON karma_ledger (target COLLATE NOCASE)",
+        """CREATE TABLE IF NOT EXISTS karma_daily (
+            day TEXT NOT NULL, target TEXT NOT NULL COLLATE NOCASE,
+            gained INTEGER NOT NULL DEFAULT 0, lost INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (target, day))""",
+        """CREATE TABLE IF NOT EXISTS karma_givers_daily (
+            day TEXT NOT NULL, target TEXT NOT NULL COLLATE NOCASE, actor TEXT NOT NULL,
+            gained INTEGER NOT NULL DEFAULT 0, lost INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (target, actor, day))""",
+        open_karma_ledger,
+    ]),
+    ('Add rate limit snapshots', [
+        """CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY, tokens REAL NOT NULL, capacity REAL NOT NULL,
+            period REAL NOT NULL, updated REAL NOT NULL)""",
+    ]),
+    ('Add full-text quote index', [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts USING fts5 (
+            quote, content='quotes', content_rowid='quote_id')""",
+        """CREATE TRIGGER IF NOT EXISTS quotes_fts_insert AFTER INSERT ON quotes BEGIN
+            INSERT INTO quotes_fts (rowid, quote) VALUES (new.quote_id, new.quote);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS quotes_fts_delete AFTER DELETE ON quotes BEGIN
+            INSERT INTO quotes_fts (quotes_fts, rowid, quote) VALUES ('delete', old.quote_id, old.quote);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS quotes_fts_update AFTER UPDATE OF quote ON quotes BEGIN
+            INSERT INTO quotes_fts (quotes_fts, rowid, quote) VALUES ('delete', old.quote_id, old.quote);
+            INSERT INTO quotes_fts (rowid, quote) VALUES (new.quote_id, new.quote);
+        END""",
+        "INSERT INTO quotes_fts (quotes_fts) VALUES ('rebuild')",
+        "CREATE INDEX IF NOT EXISTS quotes_said_at ON quotes (said_at)",
+    ]),
+    ('Add votes', [
+        """CREATE TABLE IF NOT EXISTS votes (
+            vote_id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL,
+            question TEXT NOT NULL, owner_priv REAL NOT NULL, mutable INTEGER NOT NULL DEFAULT 0,
+            started_at REAL NOT NULL, ended_at REAL, winner TEXT)""",
+        "CREATE INDEX IF NOT EXISTS votes_open ON votes (conversation_id) WHERE ended_at IS NULL",
+        """CREATE TABLE IF NOT EXISTS vote_options (
+            vote_id INTEGER NOT NULL REFERENCES votes (vote_id), option TEXT NOT NULL,
+            tally INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (vote_id, option))""",
+        """CREATE TABLE IF NOT EXISTS vote_ballots (
+            vote_id INTEGER NOT NULL REFERENCES votes (vote_id), voter TEXT NOT NULL,
+            option TEXT NOT NULL, PRIMARY KEY (vote_id, voter))""",
+    ]),
+    ('Add timers and vote deadlines', [
+        """CREATE TABLE IF NOT EXISTS timers (
+            timer_id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT NOT NULL, due REAL NOT NULL,
+            payload TEXT)""",
+        add_column('votes', 'ends_at', 'REAL'),
+        add_column('votes', 'timer_id', 'INTEGER'),
+    ]),
+    ('Keep debts per conversation', [
+        add_column('debt', 'conversation_id', 'TEXT'),
+        net_old_debts,
+        "CREATE INDEX IF NOT EXISTS debt_conversation ON debt (conversation_id)",
+    ]),
+]
+
+
+def migrate(db, log):
+    """ Migrate
+        Bring the database up to date by applying any migrations newer than
+        the schema version recorded in it, recording the new version with
+        each one
+    """
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for number, (description, steps) in enumerate(migrations[version:], version + 1):
+        log.info('Migrating gambit.db to version {}: {}'.format(number, description))
+        db.execute("BEGIN")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(db)
+                else:
+                    db.execute(step)
+            db.execute("PRAGMA user_version = {}".format(number))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """ Rate Limiter
+        Token buckets shared by every command. Each bucket holds up to a
+        fixed number of tokens and refills continuously, one token every
+        so many seconds, and every action takes a token. Buckets are keyed
+        by whatever the caller likes (a command and a user, a command and a
+        conversation, ...). Only a bounded number of buckets are kept, the
+        least recently used are forgotten first, and they can be saved to
+        and restored from the rate_limits table so restarts don't hand
+        everyone a fresh set of tokens
+    """
+
+    def __init__(self, max_buckets=10000):
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict() # key -> [tokens, capacity, period, last update]
+
+
+    def allow(self, key, capacity, period, cost=1):
+        """ Allow
+            Take cost tokens out of a bucket holding up to capacity tokens
+            which refills one token every period seconds. Return whether
+            there were enough tokens
+        """
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[3]) / period)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = [tokens, capacity, period, now]
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+            return allowed
+
+
+    def key(self, cmd, ctx):
+        """ Key
+            Return the bucket a command's rate limit applies to for a
+            message, per its rate_limit_per ('user', 'conversation' or
+            'command')
+        """
+        if cmd.rate_limit_per == 'user':
+            return (cmd.name, 'user', ctx.user.full_name)
+        if cmd.rate_limit_per == 'conversation':
+            return (cmd.name, 'conversation', ctx.conversation.id_)
+        return (cmd.name,)
+
+
+    def evict_full(self):
+        """ Evict Full
+            Forget buckets which have refilled completely, since a full
+            bucket is the same as no bucket at all
+        """
+        now = time.time()
+        with self.lock:
+            full = [key for key, (tokens, capacity, period, updated) in self.buckets.items()
+                    if tokens + (now - updated) / period >= capacity]
+            for key in full:
+                del self.buckets[key]
+
+
+    def load(self, db):
+        """ Load
+            Restore the buckets saved in the database
+        """
+        rows = db.execute("SELECT key, tokens, capacity, period, updated FROM rate_limits " \
+                + "ORDER BY updated").fetchall()
+        with self.lock:
+            for key, tokens, capacity, period, updated in rows:
+                key = tuple(json.loads(key))
+                self.buckets[key] = [tokens, capacity, period, updated]
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+
+
+    def save(self, db):
+        """ Save
+            Replace the buckets saved in the database with those which
+            aren't full (a full bucket is the same as no bucket at all)
+        """
+        now = time.time()
+        with self.lock:
+            rows = [(json.dumps(key), tokens, capacity, period, updated)
+                    for key, (tokens, capacity, period, updated) in self.buckets.items()
+                    if tokens + (now - updated) / period < capacity]
+        with db:
+            db.execute("DELETE FROM rate_limits")
+            db.executemany("INSERT INTO rate_limits (key, tokens, capacity, period, updated) " \
+                    + "VALUES (?, ?, ?, ?, ?)", rows)
@@ -0,0 +1,90 @@
+import re
+
+from hangups.bot.automaton import KeywordAutomaton
+
+
+class CommandRouter:
+    """ Command Router
+        An index over the bot's commands, built once at start up, which narrows
+        each message down to the handful of commands that could match it.
+        Commands that declare leading keywords are only handed messages that
+        start with (or address gambit with) one of those keywords, commands
+        that declare triggers are only handed messages containing one of
+        them and commands that declare neither are handed every message
+    """
+
+    re_addressed = re.compile("gambit[:,]?\s*(\S+)", re.IGNORECASE)
+    re_trailing = re.compile("\W+$")
+
+    def __init__(self, first_match=False):
+        # When first_match is set, dispatch stops at the first command
+        # (in priority order) whose parse accepts the message
+        self.first_match = first_match
+        self.keywords = {}
+        self.triggers = KeywordAutomaton()
+        self.ambient = []
+        self.order = {}
+
+
+    def add(self, cmd):
+        """ Add
+            Index a command by its leading keywords and triggers, or treat it
+            as ambient if it doesn't declare any
+        """
+        self.order[cmd] = len(self.order)
+        if not cmd.keywords and not cmd.triggers:
+            self.ambient.append(cmd)
+            return
+        for keyword in cmd.keywords or []:
+            self.keywords.setdefault(keyword.lower(), []).append(cmd)
+        for trigger in cmd.triggers or []:
+            self.triggers.add(trigger.lower(), cmd, cmd.whole_words)
+
+
+    def build(self):
+        """ Build
+            Finish indexing once every command has been added
+        """
+        self.triggers.build()
+
+
+    def leading_words(self, message):
+        """ Leading Words
+            Return the set of words a command could be keyed on: the first word
+            of the message and the first word after every 'gambit:' prefix
+        """
+        words = set()
+        first = message.split(None, 1)
+        if first:
+            words.add(self._normalize(first[0]))
+        for word in self.re_addressed.findall(message):
+            words.add(self._normalize(word))
+        return words
+
+
+    def is_addressed(self, message):
+        """ Is Addressed
+            Return whether the message could be a command addressed to gambit
+            rather than chatter only the ambient commands care about
+        """
+        return any(word in self.keywords for word in self.leading_words(message))
+
+
+    def route(self, message):
+        """ Route
+            Return the commands which could possibly match the message, ordered
+            by priority and then by the order they were registered
+        """
+        candidates = set(self.ambient)
+        candidates.update(self.triggers.search(message.lower()))
+        for word in self.leading_words(message):
+            candidates.update(self.keywords.get(word, ()))
+        return sorted(candidates, key=self._rank)
+
+
+    def _rank(self, cmd):
+        return (-cmd.priority, self.order[cmd])
+
+
+    def _normalize(self, word):
+        return self.re_trailing.sub('', word.lower())
@@ -19,6 +19,7 @@ CREATE TABLE debt (
     lender TEXT NOT NULL,
     borrower TEXT NOT NULL,
     amount INTEGER NOT NULL,
+    conversation_id TEXT, /* NULL for debts from before they were per conversation */
     FOREIGN KEY(lender) REFERENCES user(full_name),
     FOREIGN KEY(borrower) REFERENCES user(full_name)
 );
@@ -48,3 +49,121 @@ CREATE TABLE commands (
     name TEXT UNIQUE NOT NULL,
     privilege INTEGER DEFAULT 0
 );
+
+CREATE TABLE url_titles (
+    url TEXT PRIMARY KEY,
+    title TEXT, /* NULL when the page failed or had no title */
+    expires REAL NOT NULL /* Unix time to fetch the page again after */
+);
+
+/* Every karma change ever made, append only. Karma from before the ledger
+   existed is recorded as an 'opening' balance */
+CREATE TABLE karma_ledger (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL,
+    actor TEXT, /* Full name of whoever made the change */
+    delta INTEGER NOT NULL,
+    source TEXT NOT NULL, /* karma, spot, high-low or opening */
+    conversation_id TEXT,
+    changed_at REAL NOT NULL
+);
+
+/* Karma gained and lost per target per (UTC) day */
+CREATE TABLE karma_daily (
+    day TEXT NOT NULL,
+    target TEXT NOT NULL COLLATE NOCASE,
+    gained INTEGER NOT NULL DEFAULT 0,
+    lost INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (target, day)
+);
+
+/* Karma given and taken per target per actor per day */
+CREATE TABLE karma_givers_daily (
+    day TEXT NOT NULL,
+    target TEXT NOT NULL COLLATE NOCASE,
+    actor TEXT NOT NULL,
+    gained INTEGER NOT NULL DEFAULT 0,
+    lost INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (target, actor, day)
+);
+
+/* Commands' rate limit buckets, saved so they survive a restart */
+CREATE TABLE rate_limits (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    capacity REAL NOT NULL,
+    period REAL NOT NULL,
+    updated REAL NOT NULL
+);
+
+/* Full-text index over quotes, kept in step with them by triggers */
+CREATE VIRTUAL TABLE quotes_fts USING fts5 (
+    quote,
+    content='quotes',
+    content_rowid='quote_id'
+);
+
+CREATE TRIGGER quotes_fts_insert AFTER INSERT ON quotes BEGIN
+    INSERT INTO quotes_fts (rowid, quote) VALUES (new.quote_id, new.quote);
+END;
+
+CREATE TRIGGER quotes_fts_delete AFTER DELETE ON quotes BEGIN
+    INSERT INTO quotes_fts (quotes_fts, rowid, quote) VALUES ('delete', old.quote_id, old.quote);
+END;
+
+CREATE TRIGGER quotes_fts_update AFTER UPDATE OF quote ON quotes BEGIN
+    INSERT INTO quotes_fts (quotes_fts, rowid, quote) VALUES ('delete', old.quote_id, old.quote);
+    INSERT INTO quotes_fts (rowid, quote) VALUES (new.quote_id, new.quote);
+END;
+
+/* Votes, the options in them with a running count of ballots for each, and
+   everyone's ballot */
+CREATE TABLE votes (
+    vote_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    owner_priv REAL NOT NULL,
+    mutable INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    winner TEXT,
+    ends_at REAL,
+    timer_id INTEGER
+);
+
+CREATE TABLE vote_options (
+    vote_id INTEGER NOT NULL REFERENCES votes (vote_id),
+    option TEXT NOT NULL,
+    tally INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (vote_id, option)
+);
+
+CREATE TABLE vote_ballots (
+    vote_id INTEGER NOT NULL REFERENCES votes (vote_id),
+    voter TEXT NOT NULL,
+    option TEXT NOT NULL,
+    PRIMARY KEY (vote_id, voter)
+);
+
+/* Timers waiting to go off, each belonging to the command which handles it */
+CREATE TABLE timers (
+    timer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    due REAL NOT NULL,
+    payload TEXT
+);
+
+/* Indexes for case-insensitive lookups, see migrations.py */
+CREATE UNIQUE INDEX karma_target ON karma (target COLLATE NOCASE);
+CREATE INDEX aliases_old ON aliases (old COLLATE NOCASE);
+CREATE INDEX users_nickname ON users (nickname COLLATE NOCASE);
+CREATE INDEX users_full_name ON users (full_name COLLATE NOCASE, conversation_id);
+CREATE INDEX quotes_said_by ON quotes (said_by COLLATE NOCASE);
+CREATE INDEX debt_lender_borrower ON debt (lender, borrower);
+CREATE INDEX karma_karma ON karma (karma, target);
+CREATE INDEX users_conversation ON users (conversation_id, nickname);
+CREATE INDEX jokes_type ON jokes (type);
+CREATE INDEX karma_ledger_target ON karma_ledger (target COLLATE NOCASE);
+CREATE INDEX quotes_said_at ON quotes (said_at);
+CREATE INDEX debt_conversation ON debt (conversation_id);
+CREATE INDEX votes_open ON votes (conversation_id) WHERE ended_at IS NULL;
@@ -0,0 +1,157 @@
+import asyncio
+import hangups
+from collections import deque
+from functools import partial
+
+
+class Outbox:
+    """ Outbox
+        The messages waiting to be sent to a single conversation
+    """
+
+    def __init__(self, conversation):
+        self.conversation = conversation
+        self.items = deque()
+        self.current = None # The batch being sent (or retried)
+        self.sending = False
+        self.flush_handle = None
+
+
+class Batch:
+    """ Batch
+        A single outgoing hangups message: several lines of text coalesced
+        together, or one image
+    """
+
+    def __init__(self, outbox, text='', image=None):
+        self.outbox = outbox
+        self.text = text
+        self.image = image
+        self.attempts = 0
+
+
+class SendPipeline:
+    """ Send Pipeline
+        Everything the bot says goes through here. Lines said to the same
+        conversation within a short window are coalesced into one message,
+        each conversation's messages are sent one at a time and in order, no
+        more than a fixed number of sends are in flight at once and sends
+        which fail with a network error are retried with exponential backoff
+    """
+
+    def __init__(self, loop, on_sent, images, window=0.25, max_in_flight=4, max_retries=3,
+                 backoff=1.0, max_length=2000):
+        # on_sent is called with (batch, future) once a send finishes and
+        # must hand the result back through settle()
+        self.loop = loop
+        self.on_sent = on_sent
+        self.images = images
+        self.window = window
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_length = max_length
+        self.outboxes = {}
+        self.waiting = deque()
+        self.in_flight = 0
+
+
+    def enqueue(self, conversation, text):
+        """ Enqueue
+            Queue a line of text (or an '/image <path>' command) for a
+            conversation. Must be called on the event loop
+        """
+        if len(text) == 0:
+            return
+        outbox = self.outboxes.get(conversation.id_)
+        if outbox is None:
+            outbox = Outbox(conversation)
+            self.outboxes[conversation.id_] = outbox
+        outbox.items.append(text)
+        # Anything queued while a batch is out gets sent once it settles
+        if outbox.current is None and outbox.flush_handle is None:
+            outbox.flush_handle = self.loop.call_later(self.window, self._flush, outbox)
+
+
+    def settle(self, batch, future):
+        """ Settle
+            Take the result of a send, then either schedule a retry or move
+            on to the conversation's next batch
+        """
+        outbox = batch.outbox
+        outbox.sending = False
+        self.in_flight -= 1
+        error = None if future.cancelled() else future.exception()
+        if error and batch.image:
+            # The upload may be what went wrong, start fresh on a retry
+            self.images.invalidate(batch.image)
+        if isinstance(error, hangups.NetworkError) and batch.attempts <= self.max_retries:
+            delay = self.backoff * 2 ** (batch.attempts - 1)
+            self.loop.call_later(delay, self._pump, outbox)
+        else:
+            outbox.current = None
+            self._pump(outbox)
+        self._wake()
+
+
+    def _flush(self, outbox):
+        outbox.flush_handle = None
+        self._pump(outbox)
+
+
+    def _pump(self, outbox):
+        """ Pump
+            Send the conversation's current batch, or build the next one,
+            if a send slot is free
+        """
+        if outbox.sending or outbox.flush_handle is not None:
+            return
+        if outbox.current is None:
+            if not outbox.items:
+                del self.outboxes[outbox.conversation.id_]
+                return
+            outbox.current = self._next_batch(outbox)
+        if self.in_flight >= self.max_in_flight:
+            if outbox not in self.waiting:
+                self.waiting.append(outbox)
+            return
+        self._send(outbox.current)
+
+
+    def _next_batch(self, outbox):
+        first = outbox.items.popleft()
+        if first.startswith('/image') and len(first.split(' ')) == 2:
+            return Batch(outbox, image=first.split(' ')[1])
+        lines = [first]
+        length = len(first)
+        while outbox.items and not outbox.items[0].startswith('/image'):
+            length += len(outbox.items[0]) + 1
+            if length > self.max_length:
+                break
+            lines.append(outbox.items.popleft())
+        return Batch(outbox, text='\n'.join(lines))
+
+
+    def _send(self, batch):
+        outbox = batch.outbox
+        outbox.sending = True
+        self.in_flight += 1
+        batch.attempts += 1
+        asyncio.ensure_future(
+            self._deliver(batch)
+        ).add_done_callback(partial(self.on_sent, batch))
+
+
+    async def _deliver(self, batch):
+        segments = hangups.ChatMessageSegment.from_str(batch.text)
+        if batch.image:
+            # Images are uploaded once and reposted by id after that
+            image_id = await self.images.image_id(batch.image)
+            await batch.outbox.conversation.send_message(segments, image_id=image_id)
+        else:
+            await batch.outbox.conversation.send_message(segments)
+
+
+    def _wake(self):
+        while self.waiting and self.in_flight < self.max_in_flight:
+            self._pump(self.waiting.popleft())
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import json
+import time
+
+
+class TimerService:
+    """ Timer Service
+        Run things at a later time on the bot's event loop. Timers belong to
+        a command, carry a small payload and are kept in the timers table
+        until they've run, so they survive restarts. Recurring jobs (the
+        bot's housekeeping) are registered at startup and only live in
+        memory. Everything due is kept in one heap ordered by when it's due,
+        and only the earliest is ever waiting on the event loop, so any
+        number of timers cost nothing until they go off
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.loop = bot.loop
+        self.heap = [] # (due, sequence, timer id or None, owner or job, payload or interval)
+        self.sequence = itertools.count()
+        self.cancelled = set()
+        self.handle = None
+        self.armed_for = None
+
+
+    def load(self):
+        """ Load
+            Pick up the timers saved in the database. Any which came due
+            while the bot was down go off straight away
+        """
+        rows = self.bot.db.execute("SELECT timer_id, owner, due, payload FROM timers").fetchall()
+        for timer_id, owner, due, payload in rows:
+            self._push((due, next(self.sequence), timer_id, owner, json.loads(payload)))
+
+
+    def schedule(self, owner, due, payload=None):
+        """ Schedule
+            Save a timer for the command named owner which goes off at the
+            given (epoch) time with the given JSON-able payload, and return
+            its id. Safe to call from commands running in the thread pool
+        """
+        db = self.bot.db
+        with db:
+            cursor = db.execute("INSERT INTO timers (owner, due, payload) VALUES (?, ?, ?)",
+                    (owner, due, json.dumps(payload),))
+        entry = (due, next(self.sequence), cursor.lastrowid, owner, payload)
+        self.loop.call_soon_threadsafe(self._push, entry)
+        return cursor.lastrowid
+
+
+    def cancel(self, timer_id):
+        """ Cancel
+            Stop a timer from going off. Safe to call from the thread pool
+        """
+        db = self.bot.db
+        with db:
+            db.execute("DELETE FROM timers WHERE timer_id = ?", (timer_id,))
+        self.loop.call_soon_threadsafe(self.cancelled.add, timer_id)
+
+
+    def every(self, interval, job):
+        """ Every
+            Run a blocking function in the thread pool every interval
+            seconds, starting interval seconds from now
+        """
+        self._push((time.time() + interval, next(self.sequence), None, job, interval))
+
+
+    def _push(self, entry):
+        heapq.heappush(self.heap, entry)
+        self._arm()
+
+
+    def _arm(self):
+        """ Arm
+            Make sure the event loop wakes up when the earliest timer is due
+        """
+        if not self.heap:
+            return
+        due = self.heap[0][0]
+        if self.handle is not None:
+            if self.armed_for <= due:
+                return
+            self.handle.cancel()
+        self.armed_for = due
+        self.handle = self.loop.call_at(self.loop.time() + max(due - time.time(), 0), self._fire)
+
+
+    def _fire(self):
+        """ Fire
+            Set off everything that's due, then wait for the next one
+        """
+        self.handle = None
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            due, _, timer_id, owner, payload = heapq.heappop(self.heap)
+            if timer_id is None:
+                # A recurring job, payload is its interval
+                self.loop.create_task(self._run_job(owner))
+                # Don't try to catch up on runs missed while the loop was busy
+                next_due = due + payload if due + payload > now else now + payload
+                heapq.heappush(self.heap, (next_due, next(self.sequence), None, owner, payload))
+            elif timer_id in self.cancelled:
+                self.cancelled.discard(timer_id)
+            else:
+                self.loop.create_task(self._run_timer(timer_id, owner, payload))
+        self._arm()
+
+
+    async def _run_timer(self, timer_id, owner, payload):
+        try:
+            await self.bot.on_timer(owner, payload)
+        except Exception as error:
+            self.bot.log.warn('Error in timer for {}:\n{}'.format(owner, error))
+        # Only forget the timer once it has run, so a crash means running it again
+        await self.bot.run_blocking(self._forget, timer_id)
+
+
+    async def _run_job(self, job):
+        try:
+            await self.bot.run_blocking(job)
+        except Exception as error:
+            self.bot.log.warn('Error in {}:\n{}'.format(job.__name__, error))
+
+
+    def _forget(self, timer_id):
+        db = self.bot.db
+        with db:
+            db.execute("DELETE FROM timers WHERE timer_id = ?", (timer_id,))
@@ -0,0 +1,203 @@
+import asyncio
+import codecs
+import re
+import time
+from collections import OrderedDict
+from html.parser import HTMLParser
+
+import aiohttp
+
+
+re_url = re.compile("https?://[^\s<>\"]+", re.IGNORECASE)
+html_types = ['text/html', 'application/xhtml+xml']
+
+
+def find_urls(text, limit=5):
+    """ Find URLs
+        Return every distinct http(s) URL in a message, in the order they
+        appear, without any punctuation trailing them in the sentence
+    """
+    urls = []
+    for match in re_url.finditer(text):
+        url = match.group(0).rstrip('.,;:!?\'")]}>')
+        if url not in urls:
+            urls.append(url)
+    return urls[:limit]
+
+
+class TitleCache:
+    """ Title Cache
+        Fetch page titles, remembering them so links pasted again (or in
+        another conversation) aren't fetched again. Titles are kept in a
+        small in-memory LRU backed by the url_titles table, so they survive
+        restarts. Pages which failed or had no title are remembered too, for
+        a shorter time, so dead links aren't retried on every paste
+    """
+
+    def __init__(self, bot, max_entries=512, ttl=24 * 60 * 60, negative_ttl=60 * 60):
+        self.bot = bot
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict() # url -> (title or None, expiry time)
+        self.pending = {} # url -> future of a fetch already under way
+        self.session = None # aiohttp session, made on the first fetch
+
+
+    def load(self):
+        """ Load
+            Clear expired titles out of the database
+        """
+        self.purge()
+
+
+    def purge(self):
+        """ Purge
+            Delete titles which have expired from the database, run
+            periodically as part of the bot's housekeeping
+        """
+        self.bot.db.execute("DELETE FROM url_titles WHERE expires < ?", (time.time(),))
+        self.bot.db.commit()
+
+
+    async def titles(self, urls, timeout=10, max_bytes=64 * 1024):
+        """ Titles
+            Return the titles of the given pages, lined up with the URLs and
+            None for any without one. Only pages which aren't cached are
+            fetched, concurrently on the event loop
+        """
+        now = time.time()
+        found = {}
+        for url in urls:
+            entry = self.entries.get(url)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(url)
+                found[url] = entry[0]
+        missing = [url for url in urls if url not in found]
+        if missing:
+            stored = await self.bot.run_blocking(self._lookup, missing, now)
+            for url, (title, expires) in stored.items():
+                self._remember(url, title, expires)
+                found[url] = title
+        missing = [url for url in urls if url not in found]
+        self.bot.stats['url title hits'] += len(urls) - len(missing)
+        self.bot.stats['url title misses'] += len(missing)
+        for url in missing:
+            # Links pasted in several conversations at once are fetched once
+            if url not in self.pending:
+                self.pending[url] = asyncio.ensure_future(self._fetch(url, timeout, max_bytes))
+        fetched = await asyncio.gather(*[self.pending[url] for url in missing])
+        found.update(zip(missing, fetched))
+        return [found[url] for url in urls]
+
+
+    async def _fetch(self, url, timeout, max_bytes):
+        self.bot.stats['url title fetches'] += 1
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        try:
+            # The timeout covers the whole fetch, so slow trickles are cut off too
+            title = await asyncio.wait_for(fetch_title(self.session, url, max_bytes), timeout)
+        except Exception as error:
+            self.bot.log.info('Could not fetch title of {}: {}'.format(url, error))
+            title = None
+        expires = time.time() + (self.ttl if title else self.negative_ttl)
+        self._remember(url, title, expires)
+        try:
+            await self.bot.run_blocking(self._store, url, title, expires)
+        except Exception as error:
+            self.bot.log.warn('Error storing title of {}:\n{}'.format(url, error))
+        finally:
+            del self.pending[url]
+        return title
+
+
+    def _remember(self, url, title, expires):
+        self.entries[url] = (title, expires)
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+    def _lookup(self, urls, now):
+        marks = ', '.join('?' * len(urls))
+        rows = self.bot.db.execute("SELECT url, title, expires FROM url_titles WHERE url IN ({}) AND expires > ?".format(marks),
+                urls + [now])
+        return {url: (title, expires) for url, title, expires in rows.fetchall()}
+
+
+    def _store(self, url, title, expires):
+        self.bot.db.execute("INSERT OR REPLACE INTO url_titles (url, title, expires) VALUES (?, ?, ?)",
+                (url, title, expires))
+        self.bot.db.commit()
+
+
+async def fetch_title(session, url, max_bytes=64 * 1024):
+    """ Fetch Title
+        Stream the start of a page and return its title, reading no further
+        than the closing title tag or max_bytes bytes, whichever comes
+        first. Pages which aren't HTML aren't read at all
+    """
+    res = await session.get(url, headers={'User-Agent': 'gambit', 'Accept': 'text/html'})
+    try:
+        if res.content_type not in html_types:
+            return None
+        charset = res.charset or 'utf-8'
+        try:
+            decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        parser = TitleParser()
+        read = 0
+        while not parser.done and read < max_bytes:
+            chunk = await res.content.read(min(4096, max_bytes - read))
+            if not chunk:
+                break
+            read += len(chunk)
+            parser.feed(decoder.decode(chunk))
+        return parser.title()
+    finally:
+        # Drop the connection rather than reading the rest of the page
+        res.close()
+
+
+class TitleParser(HTMLParser):
+    """ Title Parser
+        An incremental HTML parser which only keeps the text of the first
+        title tag and notes when it has been closed
+    """
+
+    max_length = 300 # Longest title worth repeating in chat
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.in_title = False
+        self.done = False
+        self.parts = []
+
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title' and not self.done:
+            self.in_title = True
+
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self.in_title:
+            self.in_title = False
+            self.done = True
+
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.parts.append(data)
+
+
+    def title(self):
+        """ Title
+            Return the title found so far, with its whitespace collapsed and
+            cut short if need be, or None if there wasn't one
+        """
+        title = ' '.join(''.join(self.parts).split())
+        if len(title) > self.max_length:
+            title = title[:self.max_length - 3].rstrip() + '...'
+        return title or None